@@ -0,0 +1,38 @@
+"""Small script that compares the looped and vectorised versions of `augment_recons`."""
+from __future__ import annotations
+import time
+
+import torch
+from torch import Tensor
+import typer
+
+from paf.architectures.model.model_components import augment_recons
+
+
+def augment_recons_loop(x: Tensor, cf_x: Tensor, s: Tensor) -> list[Tensor]:
+    """The original per-row implementation."""
+    aug_list = [(x[i], cf_x[i]) if _s == 0 else (cf_x[i], x[i]) for i, _s in enumerate(s)]
+    return list((torch.stack([d[0] for d in aug_list]), torch.stack([d[1] for d in aug_list])))
+
+
+def main(
+    batch_size: int = 2056, num_features: int = 100, repeats: int = 20, device: str = "cpu"
+) -> None:
+    """Report the time per call of both implementations."""
+    x = torch.randn(batch_size, num_features, device=device)
+    cf_x = torch.randn(batch_size, num_features, device=device)
+    s = torch.randint(0, 2, (batch_size,), device=device).float()
+    for name, fn in (("loop", augment_recons_loop), ("vectorised", augment_recons)):
+        fn(x, cf_x, s)
+        if device != "cpu":
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for _ in range(repeats):
+            fn(x, cf_x, s)
+        if device != "cpu":
+            torch.cuda.synchronize()
+        print(f"{name:>12} | {(time.perf_counter() - start) / repeats * 1e3:10.3f} ms/call")
+
+
+if __name__ == "__main__":
+    typer.run(main)
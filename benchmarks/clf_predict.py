@@ -0,0 +1,84 @@
+"""Small script that times the classifier part of `PafModel.predict_step`.
+
+The looped version runs one classifier pass for the factual batch and one per augmented
+reconstruction, the stacked version runs them all as one batch.
+"""
+from __future__ import annotations
+import time
+
+import torch
+from torch import Tensor
+import typer
+
+from paf.architectures.model.model_components import Clf, ClfFwd, augment_recons
+
+
+def predict_loop(clf: Clf, x: Tensor, s: Tensor, recons: list[Tensor]) -> list[ClfFwd]:
+    """The original implementation with one forward pass per input."""
+    outs = [clf.forward(x=x, s=s)]
+    for i, recon in enumerate(recons):
+        outs.append(clf.forward(x=recon, s=torch.ones_like(s) * i))
+    return outs
+
+
+def predict_stacked(clf: Clf, x: Tensor, s: Tensor, recons: list[Tensor]) -> list[ClfFwd]:
+    """A single forward pass over the factual batch and the reconstructions."""
+    return clf.stacked_forward(
+        [x, *recons], ss=[s] + [torch.ones_like(s) * i for i in range(len(recons))]
+    )
+
+
+def main(
+    batch_size: int = 1_000,
+    num_features: int = 20,
+    latent_dims: int = 32,
+    repeats: int = 100,
+    device: str = "cpu",
+) -> None:
+    """Report the time per predict step of both versions."""
+    clf = Clf(
+        adv_weight=1.0,
+        pred_weight=1.0,
+        mmd_weight=1.0,
+        lr=1e-3,
+        s_as_input=True,
+        latent_dims=latent_dims,
+        mmd_kernel="LINEAR",
+        scheduler_rate=0.99,
+        weight_decay=0.0,
+        use_iw=False,
+        encoder_blocks=2,
+        adv_blocks=2,
+        decoder_blocks=2,
+        latent_multiplier=2,
+        batch_size=batch_size,
+        debug=False,
+    )
+    clf.build(
+        num_s=2,
+        data_dim=num_features,
+        s_dim=1,
+        cf_available=False,
+        feature_groups={"discrete": []},
+        outcome_cols=["outcome"],
+        scaler=None,
+    )
+    clf.to(device).eval()
+    x = torch.rand(batch_size, num_features, device=device)
+    s = torch.randint(0, 2, (batch_size,), device=device).float()
+    recons = augment_recons(x, torch.rand_like(x), s)
+    with torch.no_grad():
+        for name, fn in (("loop", predict_loop), ("stacked", predict_stacked)):
+            fn(clf, x, s, recons)
+            if device != "cpu":
+                torch.cuda.synchronize()
+            start = time.perf_counter()
+            for _ in range(repeats):
+                fn(clf, x, s, recons)
+            if device != "cpu":
+                torch.cuda.synchronize()
+            print(f"{name:>8} | {(time.perf_counter() - start) / repeats * 1e3:10.3f} ms/step")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,73 @@
+"""Small script that compares the epoch time of CycleGan with automatic and manual optimisation.
+
+Under automatic optimisation Lightning calls the training step once per optimizer, so the batch
+is pooled and the generators are run three times per batch; the manual mode does both once.
+"""
+from __future__ import annotations
+import time
+
+import pytorch_lightning as pl
+import typer
+
+from paf.architectures.model import CycleGan
+from paf.data_modules import LilliputDataModule
+
+
+def main(
+    epochs: int = 3, num_samples: int = 20_000, batch_size: int = 256, device: str = "cpu"
+) -> None:
+    """Report the training time per epoch of both modes."""
+    data = LilliputDataModule(
+        alpha=0.5,
+        gamma=0.02,
+        seed=0,
+        num_samples=num_samples,
+        train_batch_size=batch_size,
+        eval_batch_size=2056,
+        num_workers=0,
+        in_memory_loader=True,
+        in_memory_device=device,
+    )
+    data.prepare_data()
+    data.setup()
+    for manual_optimisation in (False, True):
+        pl.seed_everything(0)
+        model = CycleGan(
+            encoder_blocks=5,
+            decoder_blocks=5,
+            adv_blocks=2,
+            latent_multiplier=5,
+            batch_size=batch_size,
+            g_weight_decay=1e-6,
+            d_weight_decay=1e-6,
+            latent_dims=3,
+            manual_optimisation=manual_optimisation,
+        )
+        model.build(
+            num_s=data.card_s,
+            data_dim=data.size()[0],
+            s_dim=data.dim_s[0],
+            cf_available=data.cf_available,
+            feature_groups=data.feature_groups,
+            outcome_cols=data.disc_features + data.cont_features,
+            indices=None,
+            data=data,
+        )
+        trainer = pl.Trainer(
+            max_epochs=epochs,
+            gpus=0 if device == "cpu" else 1,
+            logger=False,
+            checkpoint_callback=False,
+            progress_bar_refresh_rate=0,
+            weights_summary=None,
+            num_sanity_val_steps=0,
+            limit_val_batches=0,
+        )
+        start = time.perf_counter()
+        trainer.fit(model=model, train_dataloaders=data.train_dataloader(shuffle=True))
+        elapsed = (time.perf_counter() - start) / epochs
+        print(f"manual_optimisation={manual_optimisation!s:>5} | {elapsed:8.2f} s/epoch")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,63 @@
+"""Small script that compares training-loader throughput with and without the in-memory loader."""
+from __future__ import annotations
+import time
+
+import typer
+
+from paf.base_templates.base_module import BaseDataModule
+from paf.data_modules import LilliputDataModule, SemiAdultDataModule, ThirdWayDataModule
+
+
+def make_data_modules(in_memory: bool, device: str) -> dict[str, BaseDataModule]:
+    """Build the data modules with their default experiment settings."""
+    options = dict(seed=0, num_workers=0, in_memory_loader=in_memory, in_memory_device=device)
+    return {
+        "lilliput": LilliputDataModule(
+            alpha=0.5,
+            gamma=0.02,
+            num_samples=20_000,
+            train_batch_size=256,
+            eval_batch_size=2056,
+            **options,
+        ),
+        "third_way": ThirdWayDataModule(
+            acceptance_rate=0.4,
+            alpha=0.6,
+            beta=0.1,
+            gamma=0.1,
+            num_samples=20_000,
+            batch_size=64,
+            num_features=5,
+            xi=0.01,
+            num_hidden_features=30,
+            **options,
+        ),
+        "semi_adult": SemiAdultDataModule(
+            batch_size=64, bin_nat=True, bin_race=True, sens="Sex", **options
+        ),
+    }
+
+
+def steps_per_second(data: BaseDataModule, epochs: int) -> float:
+    """Time full passes over the training loader."""
+    loader = data.train_dataloader()
+    num_steps = 0
+    start = time.perf_counter()
+    for _ in range(epochs):
+        for _ in loader:
+            num_steps += 1
+    return num_steps / (time.perf_counter() - start)
+
+
+def main(epochs: int = 3, device: str = "cpu") -> None:
+    """Report training steps/sec for the default and in-memory loaders."""
+    for in_memory in (False, True):
+        for name, data in make_data_modules(in_memory, device).items():
+            data.prepare_data()
+            data.setup()
+            rate = steps_per_second(data, epochs)
+            print(f"{name:>12} | in_memory={in_memory!s:>5} | {rate:10.1f} steps/sec")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,61 @@
+"""Small script that compares the throughput of the list-based and ring-buffer history pools."""
+from __future__ import annotations
+import time
+
+import numpy as np
+import torch
+from torch import Tensor
+import typer
+
+from paf.utils import HistoryPool
+
+
+class ListHistoryPool:
+    """The original pool, which handles one sample at a time."""
+
+    def __init__(self, pool_size: int = 50):
+        self.nb_samples = 0
+        self.history_pool: list[Tensor] = []
+        self.pool_sz = pool_size
+
+    def push_and_pop(self, samples: Tensor) -> Tensor:
+        samples_to_return = []
+        for sample in samples:
+            sample = torch.unsqueeze(sample, 0)
+            if self.nb_samples < self.pool_sz:
+                self.history_pool.append(sample)
+                samples_to_return.append(sample)
+                self.nb_samples += 1
+            elif np.random.uniform(0, 1) > 0.5:
+                rand_int = np.random.randint(0, self.pool_sz)
+                temp_img = self.history_pool[rand_int].clone()
+                self.history_pool[rand_int] = sample
+                samples_to_return.append(temp_img)
+            else:
+                samples_to_return.append(sample)
+        return torch.cat(samples_to_return, 0)
+
+
+def main(
+    batch_size: int = 256, num_features: int = 100, steps: int = 200, device: str = "cpu"
+) -> None:
+    """Report the number of pushed batches per second, with the pools already full."""
+    batches = torch.randn(steps, batch_size, num_features, device=device)
+    for name, pool in (
+        ("list", ListHistoryPool(pool_size=batch_size * 10)),
+        ("ring buffer", HistoryPool(pool_size=batch_size * 10)),
+    ):
+        for batch in batches[:10]:
+            pool.push_and_pop(batch)
+        if device != "cpu":
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for batch in batches:
+            pool.push_and_pop(batch)
+        if device != "cpu":
+            torch.cuda.synchronize()
+        print(f"{name:>12} | {steps / (time.perf_counter() - start):10.1f} batches/sec")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,23 @@
+"""Small script that times the lilliput generator for increasing numbers of samples."""
+from __future__ import annotations
+import contextlib
+import io
+import time
+from typing import List
+
+import typer
+
+from paf.datasets.lilliput import lilliput
+
+
+def main(sizes: List[int] = typer.Option([10_000, 100_000, 1_000_000]), seed: int = 0) -> None:
+    """Report the generation time for each number of samples."""
+    for num_samples in sizes:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            lilliput(seed=seed, num_samples=num_samples, alpha=0.5, gamma=0.02)
+        print(f"{num_samples:>12,} samples | {time.perf_counter() - start:8.2f} s")
+
+
+if __name__ == "__main__":
+    typer.run(main)
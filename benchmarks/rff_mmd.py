@@ -0,0 +1,53 @@
+"""Small script that compares the exact RBF MMD with its random Fourier feature approximation."""
+from __future__ import annotations
+import time
+from typing import Callable
+
+import torch
+from torch import Tensor
+import typer
+
+from paf.mmd import KernelType, RandomFourierFeatures, mmd2
+
+
+def _time(fn: Callable[[], Tensor], *, repeats: int, device: str) -> tuple[Tensor, float]:
+    out = fn()
+    if device != "cpu":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    if device != "cpu":
+        torch.cuda.synchronize()
+    return out, (time.perf_counter() - start) / repeats * 1e3
+
+
+def main(
+    batch_sizes: str = "64,256,1024,4096",
+    dim: int = 20,
+    num_features: int = 1024,
+    shift: float = 0.5,
+    repeats: int = 10,
+    device: str = "cpu",
+) -> None:
+    """Report the time per call of both versions and the error of the approximation."""
+    features = RandomFourierFeatures(num_features=num_features)
+    for batch_size in (int(size) for size in batch_sizes.split(",")):
+        x = torch.randn(batch_size, dim, device=device)
+        y = torch.randn(batch_size, dim, device=device) + shift
+        exact, exact_ms = _time(
+            lambda: mmd2(x, y, kernel=KernelType.RBF), repeats=repeats, device=device
+        )
+        approx, rff_ms = _time(
+            lambda: mmd2(x, y, kernel=KernelType.RBF_RFF, features=features),
+            repeats=repeats,
+            device=device,
+        )
+        print(
+            f"{batch_size:>8} | {exact_ms:10.3f} ms/exact | {rff_ms:10.3f} ms/rff"
+            f" | {exact.item():8.4f} exact | {(approx - exact).abs().item():8.4f} abs err"
+        )
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -17,7 +17,15 @@ from torch.utils.data import DataLoader
 
 from paf.base_templates.dataset_utils import Batch, CfBatch
 
-from .model_components import Adversary, CommonModel, Decoder, Encoder, index_by_s, to_discrete
+from .model_components import (
+    Adversary,
+    CommonModel,
+    Decoder,
+    Encoder,
+    FeatureLayout,
+    index_by_s,
+    to_discrete,
+)
 
 __all__ = [
     "SharedStepOut",
@@ -108,9 +116,9 @@ class Loss:
     ):
         """Init Loss."""
         self._loss_fn = nn.MSELoss() if loss_type is LossType.MSE else nn.BCEWithLogitsLoss()
-        self._recon_loss_fn = nn.L1Loss(reduction="mean")
         self.lambda_ = lambda_
         self.feature_groups = feature_groups if feature_groups is not None else {}
+        self.feature_layout = FeatureLayout(self.feature_groups.get("discrete", []))
 
     def get_dis_loss(self, dis_pred_real_data: Tensor, *, dis_pred_fake_data: Tensor) -> Tensor:
         dis_tar_real_data = torch.ones_like(dis_pred_real_data, requires_grad=False)
@@ -125,54 +133,10 @@ class Loss:
         return self._loss_fn(dis_pred_fake_data, gen_tar_fake_data)
 
     def get_gen_cyc_loss(self, real_data: Tensor, *, cyc_data: Tensor) -> Tensor:
-        if self.feature_groups["discrete"]:
-            gen_cyc_loss = real_data.new_tensor(0.0)
-            for i in range(
-                real_data[
-                    :, slice(self.feature_groups["discrete"][-1].stop, real_data.shape[1])
-                ].shape[1]
-            ):
-                gen_cyc_loss += self._recon_loss_fn(
-                    cyc_data[
-                        :, slice(self.feature_groups["discrete"][-1].stop, real_data.shape[1])
-                    ][:, i].sigmoid(),
-                    real_data[
-                        :, slice(self.feature_groups["discrete"][-1].stop, real_data.shape[1])
-                    ][:, i],
-                )
-            for group_slice in self.feature_groups["discrete"]:
-                gen_cyc_loss += nn.functional.cross_entropy(
-                    cyc_data[:, group_slice],
-                    torch.argmax(real_data[:, group_slice], dim=-1),
-                )
-        else:
-            gen_cyc_loss = self._recon_loss_fn(cyc_data.sigmoid(), real_data)
-        return gen_cyc_loss * self.lambda_
+        return self.feature_layout.recon_loss(cyc_data, real_data) * self.lambda_
 
     def get_gen_idt_loss(self, real_data: Tensor, *, idt_data: Tensor) -> Tensor:
-        if self.feature_groups["discrete"]:
-            gen_idt_loss = real_data.new_tensor(0.0)
-            for i in range(
-                real_data[
-                    :, slice(self.feature_groups["discrete"][-1].stop, real_data.shape[1])
-                ].shape[1]
-            ):
-                gen_idt_loss += self._recon_loss_fn(
-                    idt_data[
-                        :, slice(self.feature_groups["discrete"][-1].stop, real_data.shape[1])
-                    ][:, i].sigmoid(),
-                    real_data[
-                        :, slice(self.feature_groups["discrete"][-1].stop, real_data.shape[1])
-                    ][:, i],
-                )
-            for group_slice in self.feature_groups["discrete"]:
-                gen_idt_loss += nn.functional.cross_entropy(
-                    idt_data[:, group_slice],
-                    torch.argmax(real_data[:, group_slice], dim=-1),
-                )
-        else:
-            gen_idt_loss = self._recon_loss_fn(idt_data.sigmoid(), real_data)
-        return gen_idt_loss * self.lambda_ * 0.5
+        return self.feature_layout.recon_loss(idt_data, real_data) * self.lambda_ * 0.5
 
     def get_gen_loss(
         self,
@@ -320,6 +284,8 @@ class CycleGan(CommonModel):
         adv_weight: float = 1.0,
         lambda_: float = 10.0,
         s_as_input: bool = False,
+        pool_batches: bool = True,
+        manual_optimisation: bool = False,
     ):
         super().__init__(name="CycleGan")
         self.d_lr = d_lr
@@ -331,9 +297,14 @@ class CycleGan(CommonModel):
         self.adv_blocks = adv_blocks
         self.latent_multiplier = latent_multiplier
 
-        self.fake_pool_s0 = HistoryPool(pool_size=batch_size * 10)
-        self.fake_pool_s1 = HistoryPool(pool_size=batch_size * 10)
+        self.fake_pool_s0 = HistoryPool(pool_size=batch_size * 10, seed=0)
+        self.fake_pool_s1 = HistoryPool(pool_size=batch_size * 10, seed=1)
 
+        self.pool_batches = pool_batches
+        self.automatic_optimization = not manual_optimisation
+        if manual_optimisation:
+            # Lightning refuses a `training_step` that takes `optimizer_idx` in manual optimisation
+            self.training_step = self._manual_training_step  # type: ignore[assignment]
         self.pool_x0 = Stratifier(pool_size=batch_size // 2)
         self.pool_x1 = Stratifier(pool_size=batch_size // 2)
 
@@ -455,19 +426,7 @@ class CycleGan(CommonModel):
 
     def soft_invert(self, z: Tensor) -> Tensor:
         """Go from soft to discrete features."""
-        k = torch.ones_like(z)
-        if self.loss.feature_groups["discrete"]:
-            for i in range(
-                z[:, slice(self.loss.feature_groups["discrete"][-1].stop, z.shape[1])].shape[1]
-            ):
-                k[:, slice(self.loss.feature_groups["discrete"][-1].stop, z.shape[1])][:, i] *= z[
-                    :, slice(self.loss.feature_groups["discrete"][-1].stop, z.shape[1])
-                ][:, i].sigmoid()
-            for i, group_slice in enumerate(self.loss.feature_groups["discrete"]):
-                k[:, group_slice] *= torch.nn.functional.softmax(z[:, group_slice], dim=-1)
-        else:
-            k = z.sigmoid()
-        return k
+        return self.loss.feature_layout.soft_invert(z)
 
     @staticmethod
     def set_requires_grad(nets: nn.Module | list[nn.Module], requires_grad: bool = False) -> None:
@@ -502,98 +461,134 @@ class CycleGan(CommonModel):
         self, batch: Batch | CfBatch | TernarySample, batch_idx: int, optimizer_idx: int
     ) -> Tensor:
         _ = (batch_idx,)
+        real_s0, real_s1 = self.pooled_reals(batch)
+        cyc_out = self.forward(real_s0=real_s0, real_s1=real_s1)
+
+        if optimizer_idx == 0:
+            return self.gen_step_loss(real_s0=real_s0, real_s1=real_s1, cyc_out=cyc_out)
+        if optimizer_idx == 1:
+            return self.d_s0_step_loss(real_s0=real_s0, real_s1=real_s1, cyc_out=cyc_out)
+        if optimizer_idx == 2:
+            return self.d_s1_step_loss(real_s0=real_s0, real_s1=real_s1, cyc_out=cyc_out)
+        raise NotImplementedError("There should only be 3 optimizers.")
+
+    def _manual_training_step(self, batch: Batch | CfBatch | TernarySample, batch_idx: int) -> None:
+        """Training step with manual optimisation, used instead of :meth:`training_step`."""
+        _ = (batch_idx,)
+        real_s0, real_s1 = self.pooled_reals(batch)
+        cyc_out = self.forward(real_s0=real_s0, real_s1=real_s1)
+
+        # one pooled batch and one generator pass are shared by all three updates
+        g_opt, d_s0_opt, d_s1_opt = self.optimizers()
+        for opt, get_loss in (
+            (g_opt, self.gen_step_loss),
+            (d_s0_opt, self.d_s0_step_loss),
+            (d_s1_opt, self.d_s1_step_loss),
+        ):
+            opt.zero_grad()
+            self.manual_backward(get_loss(real_s0=real_s0, real_s1=real_s1, cyc_out=cyc_out))
+            opt.step()
+
+    def pooled_reals(self, batch: Batch | CfBatch | TernarySample) -> tuple[Tensor, Tensor]:
+        """Balance the batch and split it into equally sized s=0 and s=1 halves."""
         _x = torch.cat([batch.x, batch.s.unsqueeze(dim=-1)], dim=1) if self.s_as_input else batch.x
-        x0 = self.pool_x0.push_and_pop(_x[batch.s == 0])
-        s0 = batch.x.new_zeros(x0.shape[0])
-        x1 = self.pool_x1.push_and_pop(_x[batch.s == 1])
-        s1 = batch.x.new_ones(x1.shape[0])
-        x = torch.cat([x0, x1], dim=0)
-        s = torch.cat([s0, s1], dim=0)
+        if self.pool_batches:
+            x0 = self.pool_x0.push_and_pop(_x[batch.s == 0])
+            s0 = batch.x.new_zeros(x0.shape[0])
+            x1 = self.pool_x1.push_and_pop(_x[batch.s == 1])
+            s1 = batch.x.new_ones(x1.shape[0])
+            x = torch.cat([x0, x1], dim=0)
+            s = torch.cat([s0, s1], dim=0)
+        else:  # the batches are already balanced by the data module
+            x = _x
+            s = batch.s
 
         real_s0, real_s1 = x[s == 0], x[s == 1]
         size = min(len(real_s0), len(real_s1))
-        real_s0 = real_s0[:size]
-        real_s1 = real_s1[:size]
-        cyc_out = self.forward(real_s0=real_s0, real_s1=real_s1)
+        return real_s0[:size], real_s1[:size]
 
-        if optimizer_idx == 0:
-            gen_fwd = self.forward_gen(
-                real_s0=real_s0, real_s1=real_s1, fake_s0=cyc_out.fake_s0, fake_s1=cyc_out.fake_s1
-            )
-            # if self.s_as_input:
-            #     gen_fwd = GenFwd(
-            #         cyc_s0=gen_fwd.cyc_s0[:, :-1],
-            #         idt_s0=gen_fwd.idt_s0[:, :-1],
-            #         cyc_s1=gen_fwd.cyc_s1[:, :-1],
-            #         idt_s1=gen_fwd.idt_s1[:, :-1],
-            #     )
-
-            # mmd_results = self.mmd_reporting(
-            #     gen_fwd=gen_fwd, enc_fwd=cyc_out, batch=batch, train=True
-            # )
-            # self.log(f"{Stage.fit}/enc/recon_mmd", mmd_results.recon)
-            # self.log(f"{Stage.fit}/enc/cf_recon_mmd", mmd_results.cf_recon)
-            # self.log(f"{Stage.fit}/enc/s0_dist_mmd", mmd_results.s0_dist)
-            # self.log(f"{Stage.fit}/enc/s1_dist_mmd", mmd_results.s1_dist)
-
-            # No need to calculate the gradients for Discriminators' parameters
-            # self.set_requires_grad([self.d_s0, self.d_s1], requires_grad=False)
-            with torch.no_grad():
-                d_s0_pred_fake_data = self.d_s0(self.soft_invert(cyc_out.fake_s0))
-                d_s1_pred_fake_data = self.d_s1(self.soft_invert(cyc_out.fake_s1))
-
-            gen_loss = self.loss.get_gen_loss(
-                real_s0=real_s0,
-                real_s1=real_s1,
-                gen_fwd=gen_fwd,
-                d_s0_pred_fake_data=d_s0_pred_fake_data,
-                d_s1_pred_fake_data=d_s1_pred_fake_data,
-            )
+    def gen_step_loss(self, *, real_s0: Tensor, real_s1: Tensor, cyc_out: CycleFwd) -> Tensor:
+        gen_fwd = self.forward_gen(
+            real_s0=real_s0, real_s1=real_s1, fake_s0=cyc_out.fake_s0, fake_s1=cyc_out.fake_s1
+        )
+        # if self.s_as_input:
+        #     gen_fwd = GenFwd(
+        #         cyc_s0=gen_fwd.cyc_s0[:, :-1],
+        #         idt_s0=gen_fwd.idt_s0[:, :-1],
+        #         cyc_s1=gen_fwd.cyc_s1[:, :-1],
+        #         idt_s1=gen_fwd.idt_s1[:, :-1],
+        #     )
+
+        # mmd_results = self.mmd_reporting(
+        #     gen_fwd=gen_fwd, enc_fwd=cyc_out, batch=batch, train=True
+        # )
+        # self.log(f"{Stage.fit}/enc/recon_mmd", mmd_results.recon)
+        # self.log(f"{Stage.fit}/enc/cf_recon_mmd", mmd_results.cf_recon)
+        # self.log(f"{Stage.fit}/enc/s0_dist_mmd", mmd_results.s0_dist)
+        # self.log(f"{Stage.fit}/enc/s1_dist_mmd", mmd_results.s1_dist)
+
+        # No need to calculate the gradients for Discriminators' parameters
+        # self.set_requires_grad([self.d_s0, self.d_s1], requires_grad=False)
+        with torch.no_grad():
+            d_s0_pred_fake_data = self.d_s0(self.soft_invert(cyc_out.fake_s0))
+            d_s1_pred_fake_data = self.d_s1(self.soft_invert(cyc_out.fake_s1))
+
+        gen_loss = self.loss.get_gen_loss(
+            real_s0=real_s0,
+            real_s1=real_s1,
+            gen_fwd=gen_fwd,
+            d_s0_pred_fake_data=d_s0_pred_fake_data,
+            d_s1_pred_fake_data=d_s1_pred_fake_data,
+        )
 
-            self.log(f"{Stage.fit}/enc/g_tot_loss", gen_loss.tot)
-            self.log(f"{Stage.fit}/enc/g_A2B_loss", gen_loss.s0_2_s1)
-            self.log(f"{Stage.fit}/enc/g_B2A_loss", gen_loss.s1_2_s0)
-            self.log(f"{Stage.fit}/enc/cycle_loss", gen_loss.cycle_loss)
-            self.log(f"{Stage.fit}/enc/s0_idt_loss", gen_loss.s0_idt)
-            self.log(f"{Stage.fit}/enc/s1_idt_loss", gen_loss.s1_idt)
-            self.log(f"{Stage.fit}/enc/s0_cyc_loss", gen_loss.s0_cyc)
-            self.log(f"{Stage.fit}/enc/s1_cyc_loss", gen_loss.s1_cyc)
+        self.log(f"{Stage.fit}/enc/g_tot_loss", gen_loss.tot)
+        self.log(f"{Stage.fit}/enc/g_A2B_loss", gen_loss.s0_2_s1)
+        self.log(f"{Stage.fit}/enc/g_B2A_loss", gen_loss.s1_2_s0)
+        self.log(f"{Stage.fit}/enc/cycle_loss", gen_loss.cycle_loss)
+        self.log(f"{Stage.fit}/enc/s0_idt_loss", gen_loss.s0_idt)
+        self.log(f"{Stage.fit}/enc/s1_idt_loss", gen_loss.s1_idt)
+        self.log(f"{Stage.fit}/enc/s0_cyc_loss", gen_loss.s0_cyc)
+        self.log(f"{Stage.fit}/enc/s1_cyc_loss", gen_loss.s1_cyc)
 
-            return gen_loss.tot
+        return gen_loss.tot
 
-        if optimizer_idx == 1:
-            # self.set_requires_grad([self.d_s0], requires_grad=True)
-            with torch.no_grad():
-                fake_s0 = self.fake_pool_s0.push_and_pop(
-                    self.invert(cyc_out.fake_s0, cyc_out.fake_s0)
-                )
-            dis_out = self.forward_dis(dis=self.d_s0, real_data=real_s0, fake_data=fake_s0)
-
-            # GAN loss
-            d_s0_loss = self.loss.get_dis_loss(
-                dis_pred_real_data=dis_out.real, dis_pred_fake_data=dis_out.fake
-            )
-            self.log(f"{Stage.fit}/enc/d_A_loss", d_s0_loss)
-            return d_s0_loss
+    def d_s0_step_loss(self, *, real_s0: Tensor, real_s1: Tensor, cyc_out: CycleFwd) -> Tensor:
+        _ = (real_s1,)
+        # self.set_requires_grad([self.d_s0], requires_grad=True)
+        with torch.no_grad():
+            fake_s0 = self.fake_pool_s0.push_and_pop(self.invert(cyc_out.fake_s0, cyc_out.fake_s0))
+        dis_out = self.forward_dis(dis=self.d_s0, real_data=real_s0, fake_data=fake_s0)
 
-        if optimizer_idx == 2:
-            # self.set_requires_grad([self.d_s1], requires_grad=True)
-            with torch.no_grad():
-                fake_s1 = self.fake_pool_s1.push_and_pop(
-                    self.invert(cyc_out.fake_s1, cyc_out.fake_s1)
-                )
-            dis_s1_out = self.forward_dis(dis=self.d_s1, real_data=real_s1, fake_data=fake_s1)
-
-            # GAN loss
-            d_s1_loss = self.loss.get_dis_loss(
-                dis_pred_real_data=dis_s1_out.real, dis_pred_fake_data=dis_s1_out.fake
-            )
-            self.log(f"{Stage.fit}/enc/d_B_loss", d_s1_loss)
-            return d_s1_loss
-        raise NotImplementedError("There should only be 3 optimizers.")
+        # GAN loss
+        d_s0_loss = self.loss.get_dis_loss(
+            dis_pred_real_data=dis_out.real, dis_pred_fake_data=dis_out.fake
+        )
+        self.log(f"{Stage.fit}/enc/d_A_loss", d_s0_loss)
+        return d_s0_loss
+
+    def d_s1_step_loss(self, *, real_s0: Tensor, real_s1: Tensor, cyc_out: CycleFwd) -> Tensor:
+        _ = (real_s0,)
+        # self.set_requires_grad([self.d_s1], requires_grad=True)
+        with torch.no_grad():
+            fake_s1 = self.fake_pool_s1.push_and_pop(self.invert(cyc_out.fake_s1, cyc_out.fake_s1))
+        dis_s1_out = self.forward_dis(dis=self.d_s1, real_data=real_s1, fake_data=fake_s1)
+
+        # GAN loss
+        d_s1_loss = self.loss.get_dis_loss(
+            dis_pred_real_data=dis_s1_out.real, dis_pred_fake_data=dis_s1_out.fake
+        )
+        self.log(f"{Stage.fit}/enc/d_B_loss", d_s1_loss)
+        return d_s1_loss
+
+    def training_epoch_end(self, outputs: Any) -> None:
+        _ = (outputs,)
+        if not self.automatic_optimization:
+            # Lightning only steps the schedulers itself under automatic optimisation
+            for sch in self.lr_schedulers():
+                sch.step()
 
     @torch.no_grad()
-    def shared_step(self, batch: Batch | CfBatch | TernarySample, *, stage: Stage) -> SharedStepOut:
+    def shared_step(self, batch: Batch | CfBatch | TernarySample, *, stage: Stage) -> None:
         real_s0 = (
             torch.cat([batch.x, batch.s.unsqueeze(dim=-1)], dim=1) if self.s_as_input else batch.x
         )
@@ -654,7 +649,7 @@ class CycleGan(CommonModel):
                 idt_s1=gen_fwd.idt_s1[:, :-1],
             )
 
-        return SharedStepOut(
+        step_out = SharedStepOut(
             x=batch.x,
             s=batch.s,
             recon=self.invert(recon[:, :-1] if self.s_as_input else recon),
@@ -674,24 +669,26 @@ class CycleGan(CommonModel):
             idt_recon=self.invert(index_by_s([gen_fwd.idt_s0, gen_fwd.idt_s1], batch.s)),
             cyc_recon=self.invert(index_by_s([gen_fwd.cyc_s0, gen_fwd.cyc_s1], batch.s)),
         )
-
-    def test_epoch_end(self, outputs: list[SharedStepOut]) -> None:
-        self.shared_epoch_end(outputs, stage=Stage.test)
-
-    def validation_epoch_end(self, outputs: list[SharedStepOut]) -> None:
-        self.shared_epoch_end(outputs, stage=Stage.validate)
-
-    def shared_epoch_end(self, outputs: list[SharedStepOut], *, stage: Stage) -> None:
-        self.all_x = torch.cat([_r.x for _r in outputs], 0)
-        self.all_s = torch.cat([_r.s for _r in outputs], 0)
-        self.all_recon = torch.cat([_r.recon for _r in outputs], 0)
-        self.all_cf_pred = torch.cat([_r.recon for _r in outputs], 0)
-        all_idt = torch.cat([_r.idt_recon for _r in outputs], 0)
-        all_cyc = torch.cat([_r.cyc_recon for _r in outputs], 0)
-        real_s0 = torch.cat([_r.real_s0 for _r in outputs], 0)
-        real_s1 = torch.cat([_r.real_s1 for _r in outputs], 0)
-        fake_s0 = torch.cat([_r.recons_0 for _r in outputs], 0)
-        fake_s1 = torch.cat([_r.recons_1 for _r in outputs], 0)
+        self.step_outputs.append(**step_out._asdict())
+
+    def test_epoch_end(self, outputs: list[None]) -> None:
+        self.shared_epoch_end(stage=Stage.test)
+
+    def validation_epoch_end(self, outputs: list[None]) -> None:
+        self.shared_epoch_end(stage=Stage.validate)
+
+    def shared_epoch_end(self, *, stage: Stage) -> None:
+        outputs = self.step_outputs
+        self.all_x = outputs["x"]
+        self.all_s = outputs["s"]
+        self.all_recon = outputs["recon"]
+        self.all_cf_pred = outputs["recon"]
+        all_idt = outputs["idt_recon"]
+        all_cyc = outputs["cyc_recon"]
+        real_s0 = outputs["real_s0"]
+        real_s1 = outputs["real_s1"]
+        fake_s0 = outputs["recons_0"]
+        fake_s1 = outputs["recons_1"]
 
         if self.debug and self.current_epoch % 25 == 0:
             make_plot(
@@ -758,11 +755,11 @@ class CycleGan(CommonModel):
                 cols=self.data_cols,
             )
 
-    def validation_step(self, batch: Batch | CfBatch | TernarySample, *_: Any) -> SharedStepOut:
-        return self.shared_step(batch=batch, stage=Stage.validate)
+    def validation_step(self, batch: Batch | CfBatch | TernarySample, *_: Any) -> None:
+        self.shared_step(batch=batch, stage=Stage.validate)
 
-    def test_step(self, batch: Batch | CfBatch | TernarySample, *_: Any) -> SharedStepOut:
-        return self.shared_step(batch=batch, stage=Stage.test)
+    def test_step(self, batch: Batch | CfBatch | TernarySample, *_: Any) -> None:
+        self.shared_step(batch=batch, stage=Stage.test)
 
     def configure_optimizers(
         self,
@@ -1,6 +1,6 @@
 """Encoder model."""
 from __future__ import annotations
-from typing import Any, NamedTuple, Union
+from typing import Any, NamedTuple, Sequence, Union
 
 from conduit.data import TernarySample
 from conduit.types import Stage
@@ -20,18 +20,18 @@ __all__ = ["BaseModel", "Adversary", "Clf", "ClfInferenceOut", "ClfFwd"]
 from torchmetrics import Accuracy
 
 from paf.base_templates import Batch, CfBatch
-from paf.mmd import KernelType, mmd2
+from paf.mmd import KernelType, RandomFourierFeatures, mmd2
 from paf.plotting import make_plot
 from paf.utils import HistoryPool, Stratifier
 
-from .common_model import Adversary, BaseModel, CommonModel, Decoder, Encoder
+from .common_model import Adversary, BaseModel, CommonModel, Encoder, MultiHeadDecoder
 from .model_utils import index_by_s
 
 
 class ClfFwd(NamedTuple):
     z: Tensor
     s: Tensor
-    y: list[Tensor]
+    y: Tensor  # (num_s, batch, 1)
 
 
 class ClfInferenceOut(NamedTuple):
@@ -52,11 +52,13 @@ class Loss:
         pred_weight: float = 1.0,
         mmd_weight: float = 1.0,
         kernel: KernelType = KernelType.LINEAR,
+        mmd_features: int = 1024,
     ):
         self._adv_weight = adv_weight
         self._pred_weight = pred_weight
         self._mmd_weight = mmd_weight
         self._kernel = kernel
+        self.rff = RandomFourierFeatures(num_features=mmd_features)
 
         self._pred_loss_fn = nn.BCEWithLogitsLoss
         self._adv_loss_fn = nn.BCEWithLogitsLoss
@@ -69,7 +71,9 @@ class Loss:
     def mmd_loss(self, clf_fwd: ClfFwd, s: Tensor) -> Tensor:
         if self._mmd_weight == 0.0:
             return torch.tensor(0.0)
-        return self._mmd_weight * mmd2(clf_fwd.z[s == 0], clf_fwd.z[s == 1], kernel=self._kernel)
+        return self._mmd_weight * mmd2(
+            clf_fwd.z[s == 0], clf_fwd.z[s == 1], kernel=self._kernel, features=self.rff
+        )
 
     def adv_loss(self, clf_fwd: ClfFwd, s: Tensor) -> Tensor:
         return self._adv_loss_fn(reduction="mean")(clf_fwd.s.squeeze(-1), s)  # * self._adv_weight
@@ -81,7 +85,7 @@ class Clf(CommonModel):
     cf_model: bool
     outcome_cols: list[str]
     enc: nn.Module
-    decoders: nn.ModuleList
+    decoders: MultiHeadDecoder
     built: bool
     adv: Adversary
 
@@ -104,6 +108,10 @@ class Clf(CommonModel):
         latent_multiplier: int,
         batch_size: int,
         debug: bool,
+        pool_batches: bool = True,
+        fuse_mixup: bool = False,
+        mmd_features: int = 1024,
+        mmd_resample_every: int = 1,
     ):
         """Classifier."""
         super().__init__(name="Clf")
@@ -119,6 +127,9 @@ class Clf(CommonModel):
         self.decoder_blocks = decoder_blocks
         self.latent_multiplier = latent_multiplier
         self.debug = debug
+        self.pool_batches = pool_batches
+        self.fuse_mixup = fuse_mixup
+        self.mmd_resample_every = mmd_resample_every
 
         self.fit_acc = Accuracy()
         self.fit_cf_acc = Accuracy()
@@ -132,6 +143,7 @@ class Clf(CommonModel):
             pred_weight=pred_weight,
             mmd_weight=mmd_weight,
             kernel=str_to_enum(mmd_kernel, enum=KernelType),
+            mmd_features=mmd_features,
         )
 
         self.mixup = RandomMixUp(
@@ -193,16 +205,12 @@ class Clf(CommonModel):
             hid_multiplier=self.latent_multiplier,
             weight=0.1,
         )
-        self.decoders = nn.ModuleList(
-            [
-                Decoder(
-                    latent_dim=self.latent_dims,
-                    in_size=1,
-                    blocks=self.decoder_blocks,
-                    hid_multiplier=self.latent_multiplier,
-                )
-                for _ in range(num_s)
-            ]
+        self.decoders = MultiHeadDecoder(
+            num_heads=num_s,
+            latent_dim=self.latent_dims,
+            in_size=1,
+            blocks=self.decoder_blocks,
+            hid_multiplier=self.latent_multiplier,
         )
         # self.decoders = Decoder(
         #     latent_dim=self.latent_dims + s_dim,
@@ -218,50 +226,71 @@ class Clf(CommonModel):
         _x = torch.cat([x, s[..., None]], dim=1) if self.s_as_input else x
         z = self.enc.forward(_x)
         s_pred = self.adv.forward(z)
-        preds = [dec(z) for dec in self.decoders]
+        preds = self.decoders(z)
         # preds = [
         #     self.decoders(torch.cat([z, torch.ones_like(s[..., None]) * i], dim=1))
         #     for i in range(2)
         # ]
         return ClfFwd(z=z, s=s_pred, y=preds)
 
+    def stacked_forward(self, xs: Sequence[Tensor], *, ss: Sequence[Tensor]) -> list[ClfFwd]:
+        """Run the inputs through a single forward pass and split the outputs again.
+
+        Every layer acts row-wise, so this matches calling :meth:`forward` on each input.
+        """
+        sizes = [len(x) for x in xs]
+        clf_out = self.forward(x=torch.cat(list(xs), dim=0), s=torch.cat(list(ss), dim=0))
+        return [
+            ClfFwd(z=z, s=s_pred, y=y)
+            for z, s_pred, y in zip(
+                clf_out.z.split(sizes, dim=0),
+                clf_out.s.split(sizes, dim=0),
+                clf_out.y.split(sizes, dim=1),
+            )
+        ]
+
     @implements(pl.LightningModule)
     def training_step(self, batch: Batch | CfBatch | TernarySample, *_: Any) -> Tensor:
         assert self.built
 
-        x_s0y0 = self.pool_x_s0y0.push_and_pop(batch.x[(batch.s == 0) & (batch.y == 0)])
-        x_s0y1 = self.pool_x_s0y1.push_and_pop(batch.x[(batch.s == 0) & (batch.y == 1)])
-        assert len(x_s0y0) == len(x_s0y1)
-
-        s_s0y0 = batch.x.new_zeros((x_s0y0.shape[0]))
-        s_s0y1 = batch.x.new_zeros((x_s0y1.shape[0]))
-        assert len(s_s0y0) == len(s_s0y1)
-
-        y_s0y0 = batch.x.new_zeros((x_s0y0.shape[0]))
-        y_s0y1 = batch.x.new_ones((x_s0y1.shape[0]))
-        x_s1y0 = self.pool_x_s1y0.push_and_pop(batch.x[(batch.s == 1) & (batch.y == 0)])
-        x_s1y1 = self.pool_x_s1y1.push_and_pop(batch.x[(batch.s == 1) & (batch.y == 1)])
-        s_s1y0 = batch.x.new_ones((x_s1y0.shape[0]))
-        s_s1y1 = batch.x.new_ones((x_s1y1.shape[0]))
-        y_s1y0 = batch.x.new_zeros((x_s1y0.shape[0]))
-        y_s1y1 = batch.x.new_ones((x_s1y1.shape[0]))
-
-        x_s0 = torch.cat([x_s0y0, x_s0y1], dim=0)
-        s_s0 = torch.cat([s_s0y0, s_s0y1], dim=0)
-        y_s0 = torch.cat([y_s0y0, y_s0y1], dim=0)
-        # mixed_s0 = self.mixup_s0(x_s0, targets=y_s0.long())
-
-        x_s1 = torch.cat([x_s1y0, x_s1y1], dim=0)
-        s_s1 = torch.cat([s_s1y0, s_s1y1], dim=0)
-        y_s1 = torch.cat([y_s1y0, y_s1y1], dim=0)
-        # mixed_s1 = self.mixup_s1(x_s1, targets=y_s1.long())
-
-        # mixed_x = torch.cat([mixed_s0.inputs, mixed_s1.inputs], dim=0)
-        s = torch.cat([s_s0, s_s1], dim=0)
-        # mixed_y = torch.cat([mixed_s0.targets[:, 1], mixed_s1.targets[:, 1]], dim=0)
-
-        x = torch.cat([x_s0, x_s1], dim=0)
-        y = torch.cat([y_s0, y_s1], dim=0)
+        if self.pool_batches:
+            x_s0y0 = self.pool_x_s0y0.push_and_pop(batch.x[(batch.s == 0) & (batch.y == 0)])
+            x_s0y1 = self.pool_x_s0y1.push_and_pop(batch.x[(batch.s == 0) & (batch.y == 1)])
+            assert len(x_s0y0) == len(x_s0y1)
+
+            s_s0y0 = batch.x.new_zeros((x_s0y0.shape[0]))
+            s_s0y1 = batch.x.new_zeros((x_s0y1.shape[0]))
+            assert len(s_s0y0) == len(s_s0y1)
+
+            y_s0y0 = batch.x.new_zeros((x_s0y0.shape[0]))
+            y_s0y1 = batch.x.new_ones((x_s0y1.shape[0]))
+            x_s1y0 = self.pool_x_s1y0.push_and_pop(batch.x[(batch.s == 1) & (batch.y == 0)])
+            x_s1y1 = self.pool_x_s1y1.push_and_pop(batch.x[(batch.s == 1) & (batch.y == 1)])
+            s_s1y0 = batch.x.new_ones((x_s1y0.shape[0]))
+            s_s1y1 = batch.x.new_ones((x_s1y1.shape[0]))
+            y_s1y0 = batch.x.new_zeros((x_s1y0.shape[0]))
+            y_s1y1 = batch.x.new_ones((x_s1y1.shape[0]))
+
+            x_s0 = torch.cat([x_s0y0, x_s0y1], dim=0)
+            s_s0 = torch.cat([s_s0y0, s_s0y1], dim=0)
+            y_s0 = torch.cat([y_s0y0, y_s0y1], dim=0)
+            # mixed_s0 = self.mixup_s0(x_s0, targets=y_s0.long())
+
+            x_s1 = torch.cat([x_s1y0, x_s1y1], dim=0)
+            s_s1 = torch.cat([s_s1y0, s_s1y1], dim=0)
+            y_s1 = torch.cat([y_s1y0, y_s1y1], dim=0)
+            # mixed_s1 = self.mixup_s1(x_s1, targets=y_s1.long())
+
+            # mixed_x = torch.cat([mixed_s0.inputs, mixed_s1.inputs], dim=0)
+            s = torch.cat([s_s0, s_s1], dim=0)
+            # mixed_y = torch.cat([mixed_s0.targets[:, 1], mixed_s1.targets[:, 1]], dim=0)
+
+            x = torch.cat([x_s0, x_s1], dim=0)
+            y = torch.cat([y_s0, y_s1], dim=0)
+        else:  # the batches are already balanced by the data module
+            x = batch.x
+            s = batch.s
+            y = batch.y
 
         # mixed_out = self.forward(x=batch.x, s=batch.s)
         # mixed_pred_loss = torch.nn.functional.mse_loss(
@@ -272,11 +301,9 @@ class Clf(CommonModel):
         # s = batch.s
         # y = batch.y
 
-        clf_out = self.forward(x=x, s=s)
         _iw = batch.iw if self.use_iw and isinstance(batch, (Batch, CfBatch)) else None
-        pred_loss = self.loss.pred_loss(clf_out, s=s, y=y, weight=_iw)
-        adv_loss = self.loss.adv_loss(clf_out, s=s)
-        mmd_loss = self.loss.mmd_loss(clf_out, s=s)
+        clf_out, losses = self.training_losses(x=x, s=s, y=y, iw=_iw)
+        pred_loss, adv_loss, mmd_loss, mixed_pred_loss = losses
 
         # x_s0y0 = batch.x[(batch.s == 0) & (batch.y == 0)]
         # x_s0y1 = batch.x[(batch.s == 0) & (batch.y == 1)]
@@ -303,12 +330,6 @@ class Clf(CommonModel):
         # mixed_s = torch.cat([s_s0, s_s1], dim=0)
         # mixed_y = torch.cat([mixed_s0.targets[:, 1], mixed_s1.targets[:, 1]], dim=0)
 
-        mixed = self.mixup(x, targets=y.long(), group_labels=s.long())
-        mixed_out = self.forward(x=mixed.inputs, s=s)
-        mixed_pred_loss = torch.nn.functional.binary_cross_entropy_with_logits(
-            index_by_s(mixed_out.y, s).squeeze(), mixed.targets[:, 1]
-        )
-
         loss = mixed_pred_loss + adv_loss + mmd_loss + pred_loss
 
         # x0_adv = torch.nn.functional.binary_cross_entropy_with_logits(
@@ -375,6 +396,24 @@ class Clf(CommonModel):
 
         return loss
 
+    def training_losses(
+        self, *, x: Tensor, s: Tensor, y: Tensor, iw: Tensor | None
+    ) -> tuple[ClfFwd, tuple[Tensor, Tensor, Tensor, Tensor]]:
+        """Forward pass on the batch and its mixup, with the pred, adv, mmd and mixup losses."""
+        mixed = self.mixup(x, targets=y.long(), group_labels=s.long())
+        if self.fuse_mixup:
+            clf_out, mixed_out = self.stacked_forward([x, mixed.inputs], ss=[s, s])
+        else:
+            clf_out = self.forward(x=x, s=s)
+            mixed_out = self.forward(x=mixed.inputs, s=s)
+        pred_loss = self.loss.pred_loss(clf_out, s=s, y=y, weight=iw)
+        adv_loss = self.loss.adv_loss(clf_out, s=s)
+        mmd_loss = self.loss.mmd_loss(clf_out, s=s)
+        mixed_pred_loss = torch.nn.functional.binary_cross_entropy_with_logits(
+            index_by_s(mixed_out.y, s).squeeze(), mixed.targets[:, 1]
+        )
+        return clf_out, (pred_loss, adv_loss, mmd_loss, mixed_pred_loss)
+
     @staticmethod
     def threshold(z: Tensor) -> Tensor:
         """Go from soft to discrete features."""
@@ -382,16 +421,20 @@ class Clf(CommonModel):
             return z.sigmoid().round()
 
     @implements(pl.LightningModule)
-    def validation_step(self, batch: Batch | CfBatch | TernarySample, *_: Any) -> ClfInferenceOut:
-        return self.shared_step(batch, stage=Stage.validate)
+    def on_train_epoch_start(self) -> None:
+        # `mmd_resample_every=0` keeps the first random features for the whole run
+        if self.mmd_resample_every > 0 and self.current_epoch % self.mmd_resample_every == 0:
+            self.loss.rff.resample()
 
     @implements(pl.LightningModule)
-    def test_step(self, batch: Batch | CfBatch | TernarySample, *_: Any) -> ClfInferenceOut:
-        return self.shared_step(batch, stage=Stage.test)
+    def validation_step(self, batch: Batch | CfBatch | TernarySample, *_: Any) -> None:
+        self.shared_step(batch, stage=Stage.validate)
 
-    def shared_step(
-        self, batch: Batch | CfBatch | TernarySample, *, stage: Stage
-    ) -> ClfInferenceOut:
+    @implements(pl.LightningModule)
+    def test_step(self, batch: Batch | CfBatch | TernarySample, *_: Any) -> None:
+        self.shared_step(batch, stage=Stage.test)
+
+    def shared_step(self, batch: Batch | CfBatch | TernarySample, *, stage: Stage) -> None:
         assert self.built
         clf_out = self.forward(x=batch.x, s=batch.s)
         acc = self.val_acc if stage is Stage.validate else self.test_acc
@@ -400,7 +443,7 @@ class Clf(CommonModel):
             acc(self.threshold(index_by_s(clf_out.y, batch.s).squeeze(-1)), batch.y.int()),
         )
 
-        return ClfInferenceOut(
+        step_out = ClfInferenceOut(
             y=batch.y,
             z=clf_out.z,
             s=batch.s,
@@ -410,22 +453,24 @@ class Clf(CommonModel):
             cf_y=batch.cfy if isinstance(batch, CfBatch) else None,
             cf_preds=index_by_s(clf_out.y, 1 - batch.s).sigmoid(),
         )
+        self.step_outputs.append(**step_out._asdict())
 
     @implements(pl.LightningModule)
-    def validation_epoch_end(self, outputs: list[ClfInferenceOut]) -> None:
-        return self.shared_epoch_end(outputs, stage=Stage.test)
+    def validation_epoch_end(self, outputs: list[None]) -> None:
+        return self.shared_epoch_end(stage=Stage.test)
 
     @implements(pl.LightningModule)
-    def test_epoch_end(self, outputs: list[ClfInferenceOut]) -> None:
-        return self.shared_epoch_end(outputs, stage=Stage.test)
-
-    def shared_epoch_end(self, outputs: list[ClfInferenceOut], *, stage: Stage) -> None:
-        all_y = torch.cat([_r.y for _r in outputs], 0)
-        all_z = torch.cat([_r.z for _r in outputs], 0)
-        all_s = torch.cat([_r.s for _r in outputs], 0)
-        all_preds = torch.cat([_r.preds for _r in outputs], 0)
-        preds_0 = torch.cat([_r.preds_0 for _r in outputs], 0)
-        preds_1 = torch.cat([_r.preds_1 for _r in outputs], 0)
+    def test_epoch_end(self, outputs: list[None]) -> None:
+        return self.shared_epoch_end(stage=Stage.test)
+
+    def shared_epoch_end(self, *, stage: Stage) -> None:
+        outputs = self.step_outputs
+        all_y = outputs["y"]
+        all_z = outputs["z"]
+        all_s = outputs["s"]
+        all_preds = outputs["preds"]
+        preds_0 = outputs["preds_0"]
+        preds_1 = outputs["preds_1"]
 
         if self.debug and self.current_epoch % 25 == 0:
             make_plot(
@@ -451,7 +496,7 @@ class Clf(CommonModel):
                 name="z",
                 cols=[str(i) for i in range(self.latent_dims)],
             )
-            cf_preds = torch.cat([_r.cf_preds for _r in outputs], 0)
+            cf_preds = outputs["cf_preds"]
             make_plot(
                 x=cf_preds,
                 s=all_s,
@@ -461,7 +506,7 @@ class Clf(CommonModel):
             )
 
         if self.cf_model:
-            all_cf_y = torch.cat([_r.cf_y for _r in outputs if _r.cf_y is not None], 0)
+            all_cf_y = outputs["cf_y"]
             if self.debug:
                 make_plot(
                     x=all_cf_y.unsqueeze(-1),
@@ -494,12 +539,14 @@ class Clf(CommonModel):
         _preds = torch.cat(preds, dim=0)
         return _preds.detach().cpu().numpy()
 
-    def from_recons(self, recons: list[Tensor]) -> dict[str, tuple[Tensor, ...]]:
+    def from_recons(self, recons: list[Tensor] | Tensor) -> dict[str, tuple[Tensor, ...]]:
         """Given recons, give all possible predictions."""
         preds_dict: dict[str, tuple[Tensor, ...]] = {}
 
-        for i, rec in enumerate(recons):
-            z, s_pred, preds = self.forward(x=rec, s=torch.ones_like(rec[:, 0]) * i)
+        clf_outs = self.stacked_forward(
+            recons, ss=[torch.ones_like(rec[:, 0]) * i for i, rec in enumerate(recons)]
+        )
+        for i, (z, s_pred, preds) in enumerate(clf_outs):
             for _s in range(2):
                 preds_dict[f"{i}_{_s}"] = (z, s_pred, self.threshold(preds[_s]))
         return preds_dict
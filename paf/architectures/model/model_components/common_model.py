@@ -1,6 +1,8 @@
 """Common methods for models."""
 from __future__ import annotations
 from abc import abstractmethod
+import math
+from typing import Any
 
 from conduit.fair.data import EthicMlDataModule
 import numpy as np
@@ -8,19 +10,23 @@ import pytorch_lightning as pl
 from ranzen import implements
 import torch
 from torch import Tensor, nn
+import torch.nn.functional as F
 from torch.utils.data import DataLoader
 
-__all__ = ["CommonModel", "BaseModel", "Encoder", "Adversary", "Decoder"]
+__all__ = ["CommonModel", "BaseModel", "Encoder", "Adversary", "Decoder", "MultiHeadDecoder"]
 
 from paf.base_templates import BaseDataModule
+from paf.utils import Accumulator
 
 from .blocks import block, mid_blocks
-from .model_utils import grad_reverse, init_weights, to_discrete
+from .model_utils import grad_reverse, init_weights
 
 
 class CommonModel(pl.LightningModule):
     """Base Model for each component."""
 
+    step_outputs: Accumulator
+
     def __init__(self, name: str) -> None:
         super().__init__()
         self.model_name = name
@@ -44,6 +50,19 @@ class CommonModel(pl.LightningModule):
         latent = torch.cat(latent, dim=0)
         return latent.detach().cpu().numpy()
 
+    @implements(pl.LightningModule)
+    def on_validation_epoch_start(self) -> None:
+        num_batches = (
+            self.trainer.num_sanity_val_batches
+            if self.trainer.sanity_checking
+            else self.trainer.num_val_batches
+        )
+        self.step_outputs = Accumulator(num_batches=sum(num_batches))
+
+    @implements(pl.LightningModule)
+    def on_test_epoch_start(self) -> None:
+        self.step_outputs = Accumulator(num_batches=sum(self.trainer.num_test_batches))
+
     @abstractmethod
     def get_recon(self, dataloader: DataLoader) -> np.ndarray:
         """Get Reconstructions to be used post train/test."""
@@ -66,21 +85,7 @@ class CommonModel(pl.LightningModule):
     @torch.no_grad()
     def invert(self, z: Tensor, x: Tensor | None = None) -> Tensor:
         """Go from soft to discrete features."""
-        k = z.detach().clone()
-        if self.loss.feature_groups["discrete"]:
-            for i in range(
-                k[:, slice(self.loss.feature_groups["discrete"][-1].stop, k.shape[1])].shape[1]
-            ):
-                k[:, slice(self.loss.feature_groups["discrete"][-1].stop, k.shape[1])][:, i] = k[
-                    :, slice(self.loss.feature_groups["discrete"][-1].stop, k.shape[1])
-                ][:, i].sigmoid()
-            for i, group_slice in enumerate(self.loss.feature_groups["discrete"]):
-                one_hot = to_discrete(inputs=k[:, group_slice])
-                k[:, group_slice] = one_hot
-        else:
-            k = k.sigmoid()
-
-        return k
+        return self.loss.feature_layout.invert(z.detach())
 
 
 class BaseModel(nn.Module):
@@ -157,3 +162,82 @@ class Decoder(BaseModel):
             out_size=in_size,
             blocks=blocks,
         )
+
+
+class MultiHeadDecoder(nn.Module):
+    """A stack of decoders with the same architecture, one per sensitive group.
+
+    The weights of every layer are stacked over the heads so that all heads are evaluated
+    with one batched matmul per layer. The output has shape ``(heads, batch, in_size)``.
+    State dicts of the ``nn.ModuleList`` of :class:`Decoder` s that this replaces can still
+    be loaded.
+    """
+
+    def __init__(
+        self, *, num_heads: int, latent_dim: int, in_size: int, blocks: int, hid_multiplier: int
+    ) -> None:
+        super().__init__()
+        self.num_heads = num_heads
+        self.blocks = blocks
+        hid_size = latent_dim * hid_multiplier
+        dims = [latent_dim] + [hid_size] * blocks
+        self.hid_weights = nn.ParameterList(
+            [
+                nn.Parameter(torch.empty(num_heads, d_in, d_out))
+                for d_in, d_out in zip(dims, dims[1:])
+            ]
+        )
+        self.hid_biases = nn.ParameterList(
+            [nn.Parameter(torch.empty(num_heads, 1, d_out)) for d_out in dims[1:]]
+        )
+        self.norm_weights = nn.ParameterList(
+            [nn.Parameter(torch.ones(num_heads, 1, d_out)) for d_out in dims[1:]]
+        )
+        self.norm_biases = nn.ParameterList(
+            [nn.Parameter(torch.zeros(num_heads, 1, d_out)) for d_out in dims[1:]]
+        )
+        self.out_weight = nn.Parameter(torch.empty(num_heads, dims[-1], in_size))
+        self.out_bias = nn.Parameter(torch.empty(num_heads, 1, in_size))
+        self.reset_parameters()
+
+    def reset_parameters(self) -> None:
+        """Initialise every head like an `init_weights`-initialised `nn.Linear`."""
+        for weight, bias in zip(
+            list(self.hid_weights) + [self.out_weight], list(self.hid_biases) + [self.out_bias]
+        ):
+            bound = 1 / math.sqrt(weight.shape[1])
+            for head in range(self.num_heads):
+                nn.init.xavier_uniform_(weight[head])
+            nn.init.uniform_(bias, -bound, bound)
+
+    @implements(nn.Module)
+    def forward(self, input_: Tensor) -> Tensor:
+        hidden = input_.unsqueeze(0).expand(self.num_heads, -1, -1)
+        for weight, bias, norm_weight, norm_bias in zip(
+            self.hid_weights, self.hid_biases, self.norm_weights, self.norm_biases
+        ):
+            hidden = F.selu(torch.baddbmm(bias, hidden, weight))
+            hidden = F.layer_norm(hidden, hidden.shape[-1:]) * norm_weight + norm_bias
+        return torch.baddbmm(self.out_bias, hidden, self.out_weight)
+
+    def _load_from_state_dict(  # type: ignore[override]
+        self, state_dict: dict[str, Tensor], prefix: str, *args: Any, **kwargs: Any
+    ) -> None:
+        if f"{prefix}0.out.weight" in state_dict:
+            self._convert_legacy_state_dict(state_dict, prefix)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    def _convert_legacy_state_dict(self, state_dict: dict[str, Tensor], prefix: str) -> None:
+        """Stack the keys of a `nn.ModuleList` of `Decoder` s into the stacked parameters."""
+
+        def _pop(key: str) -> Tensor:
+            heads = range(self.num_heads)
+            return torch.stack([state_dict.pop(f"{prefix}{head}.{key}") for head in heads])
+
+        for i in range(self.blocks):
+            state_dict[f"{prefix}hid_weights.{i}"] = _pop(f"hid.{i}.0.weight").transpose(1, 2)
+            state_dict[f"{prefix}hid_biases.{i}"] = _pop(f"hid.{i}.0.bias").unsqueeze(1)
+            state_dict[f"{prefix}norm_weights.{i}"] = _pop(f"hid.{i}.2.weight").unsqueeze(1)
+            state_dict[f"{prefix}norm_biases.{i}"] = _pop(f"hid.{i}.2.bias").unsqueeze(1)
+        state_dict[f"{prefix}out_weight"] = _pop("out.weight").transpose(1, 2)
+        state_dict[f"{prefix}out_bias"] = _pop("out.bias").unsqueeze(1)
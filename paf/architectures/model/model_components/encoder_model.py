@@ -1,6 +1,6 @@
 """Encoder model."""
 from __future__ import annotations
-from dataclasses import asdict, dataclass
+from dataclasses import dataclass
 import logging
 from typing import Any, NamedTuple
 
@@ -21,12 +21,12 @@ from torchmetrics import MeanSquaredError
 
 from paf.base_templates import BaseDataModule
 from paf.base_templates.dataset_utils import Batch, CfBatch
-from paf.mmd import KernelType, mmd2
+from paf.mmd import KernelType, RandomFourierFeatures, mmd2
 from paf.plotting import make_plot
 from paf.utils import HistoryPool, Stratifier
 
-from .common_model import Adversary, BaseModel, CommonModel, Decoder, Encoder
-from .model_utils import index_by_s
+from .common_model import Adversary, BaseModel, CommonModel, Encoder, MultiHeadDecoder
+from .model_utils import FeatureLayout, index_by_s
 
 __all__ = [
     "SharedStepOut",
@@ -69,7 +69,7 @@ class RunThroughOut(NamedTuple):
 class EncFwd(NamedTuple):
     z: Tensor
     s: Tensor
-    x: list[Tensor]
+    x: Tensor  # (num_s, batch, features)
     # cyc_x: list[Tensor]
     # cyc_z: Tensor
 
@@ -84,39 +84,21 @@ class Loss:
         cycle_weight: float = 1.0,
         recon_weight: float = 1.0,
         proxy_weight: float = 1.0,
+        mmd_features: int = 1024,
     ):
-        self._recon_loss_fn = nn.L1Loss(reduction="mean")
         self.feature_groups = feature_groups if feature_groups is not None else {}
+        self.feature_layout = FeatureLayout(self.feature_groups.get("discrete", []))
         self._adv_weight = adv_weight
         self._mmd_weight = mmd_weight
         self._cycle_weight = cycle_weight
         self._recon_weight = recon_weight
         self._proxy_weight = proxy_weight
+        self.rff = RandomFourierFeatures(num_features=mmd_features)
         self._cycle_loss_fn = nn.L1Loss(reduction="mean")
         self._proxy_loss_fn = nn.L1Loss(reduction="none")
-        self._disc_loss_fn = nn.CrossEntropyLoss(reduction="mean")
 
     def recon_loss(self, recons: list[Tensor], *, x: Tensor, s: Tensor) -> Tensor:
-        z = index_by_s(recons, s)
-        if self.feature_groups["discrete"]:
-            recon_loss = x.new_tensor(0.0)
-            for i in range(
-                x[:, slice(self.feature_groups["discrete"][-1].stop, x.shape[1])].shape[1]
-            ):
-                recon_loss += self._recon_loss_fn(
-                    z[:, slice(self.feature_groups["discrete"][-1].stop, x.shape[1])][
-                        :, i
-                    ].sigmoid(),
-                    x[:, slice(self.feature_groups["discrete"][-1].stop, x.shape[1])][:, i],
-                )
-            for group_slice in self.feature_groups["discrete"]:
-                recon_loss += self._disc_loss_fn(
-                    z[:, group_slice], torch.argmax(x[:, group_slice], dim=-1)
-                )
-        else:
-            recon_loss = self._recon_loss_fn(index_by_s(recons, s).sigmoid(), x)
-
-        return recon_loss * self._recon_weight
+        return self.feature_layout.recon_loss(index_by_s(recons, s), x) * self._recon_weight
 
     def proxy_loss(
         self, enc_fwd: EncFwd, *, batch: Batch | CfBatch | TernarySample, mask: Tensor | None
@@ -138,7 +120,10 @@ class Loss:
         if self._mmd_weight == 0.0:
             return torch.tensor(0.0)
 
-        return mmd2(enc_fwd.z[s == 0], enc_fwd.z[s == 1], kernel=kernel) * self._mmd_weight
+        return (
+            mmd2(enc_fwd.z[s == 0], enc_fwd.z[s == 1], kernel=kernel, features=self.rff)
+            * self._mmd_weight
+        )
 
     def cycle_loss(
         self, cyc_x: list[Tensor], *, batch: Batch | CfBatch | TernarySample
@@ -159,7 +144,7 @@ class AE(CommonModel):
     all_s: Tensor
     all_recon: Tensor
     all_cf_pred: Tensor
-    decoders: Decoder  # nn.ModuleList
+    decoders: MultiHeadDecoder
     loss: Loss
     indices: Tensor
     feature_groups: dict[str, list[slice]]
@@ -185,6 +170,9 @@ class AE(CommonModel):
         weight_decay: float,
         debug: bool,
         batch_size: int,
+        pool_batches: bool = True,
+        mmd_features: int = 1024,
+        mmd_resample_every: int = 1,
     ):
         super().__init__(name="Enc")
 
@@ -204,6 +192,9 @@ class AE(CommonModel):
         self.adv_blocks = adv_blocks
         self.decoder_blocks = decoder_blocks
         self.debug = debug
+        self.pool_batches = pool_batches
+        self.mmd_features = mmd_features
+        self.mmd_resample_every = mmd_resample_every
         self.built = False
 
         self.fit_mse = MeanSquaredError()
@@ -260,16 +251,12 @@ class AE(CommonModel):
             blocks=self.encoder_blocks,
             hid_multiplier=self.latent_multiplier,
         )
-        self.decoders = nn.ModuleList(
-            [
-                Decoder(
-                    latent_dim=self.latent_dims,
-                    in_size=self.data_dim,
-                    blocks=self.decoder_blocks,
-                    hid_multiplier=self.latent_multiplier,
-                )
-                for _ in range(num_s)
-            ]
+        self.decoders = MultiHeadDecoder(
+            num_heads=num_s,
+            latent_dim=self.latent_dims,
+            in_size=self.data_dim,
+            blocks=self.decoder_blocks,
+            hid_multiplier=self.latent_multiplier,
         )
         # self.decoders = Decoder(
         #     latent_dim=self.latent_dims + s_dim,
@@ -284,6 +271,7 @@ class AE(CommonModel):
             cycle_weight=self._cycle_weight,
             recon_weight=self._recon_weight,
             proxy_weight=self._proxy_weight,
+            mmd_features=self.mmd_features,
         )
         self.built = True
 
@@ -295,10 +283,7 @@ class AE(CommonModel):
 
         s_pred = self.adv.forward(z)
         # _mask = torch.zeros_like(x) if constraint_mask is None else constraint_mask
-        recons = [
-            dec(z)  # self.decoders(torch.cat([z, torch.ones_like(s[..., None]) * i], dim=1))
-            for i, dec in enumerate(self.decoders)
-        ]
+        recons = self.decoders(z)
 
         # cycle_x = (
         #     torch.cat([index_by_s(recons, 1 - s), 1 - s[..., None]], dim=1)
@@ -310,40 +295,23 @@ class AE(CommonModel):
         return EncFwd(z=z, s=s_pred, x=recons)  # , cyc_z=cycle_z, cyc_x=cycle_dec)
 
     def make_mask(self, x: Tensor) -> Tensor:
-
-        mask = []
-        if self.feature_groups["discrete"]:
-            for group in self.feature_groups["discrete"]:
-                prob = torch.bernoulli(torch.rand((x.shape[0], 1), device=self.device))
-                probs = torch.cat([prob for _ in range(group.start, group.stop)], dim=1)
-                mask.append(probs)
-            mask.append(
-                torch.bernoulli(
-                    torch.rand(
-                        (
-                            x.shape[0],
-                            self.data_dim - self.feature_groups["discrete"][-1].stop,
-                        ),
-                        device=self.device,
-                    )
-                )
-            )
-        else:
-            mask.append(torch.bernoulli(torch.rand_like(x)))
-        return torch.cat(mask, dim=1)
+        num_columns = self.data_dim if self.feature_groups["discrete"] else x.shape[1]
+        return self.loss.feature_layout.bernoulli_mask(x.shape[0], num_columns, device=x.device)
 
     @implements(pl.LightningModule)
     def training_step(self, batch: Batch | CfBatch | TernarySample, *_: Any) -> Tensor:
         assert self.built
 
-        x0 = self.pool_x0.push_and_pop(batch.x[batch.s == 0])
-        s0 = batch.x.new_zeros((x0.shape[0]))
-        x1 = self.pool_x1.push_and_pop(batch.x[batch.s == 1])
-        s1 = batch.x.new_ones((x1.shape[0]))
-        x = torch.cat([x0, x1], dim=0)
-        s = torch.cat([s0, s1], dim=0)
-        # x = batch.x
-        # s = batch.s
+        if self.pool_batches:
+            x0 = self.pool_x0.push_and_pop(batch.x[batch.s == 0])
+            s0 = batch.x.new_zeros((x0.shape[0]))
+            x1 = self.pool_x1.push_and_pop(batch.x[batch.s == 1])
+            s1 = batch.x.new_ones((x1.shape[0]))
+            x = torch.cat([x0, x1], dim=0)
+            s = torch.cat([s0, s1], dim=0)
+        else:  # the batches are already balanced by the data module
+            x = batch.x
+            s = batch.s
 
         # constraint_mask = torch.ones_like(batch.x) * torch.bernoulli(torch.rand_like(batch.x[0]))
         constraint_mask = self.make_mask(x) if self._proxy_weight > 0.0 else None
@@ -425,20 +393,20 @@ class AE(CommonModel):
         return loss
 
     @implements(pl.LightningModule)
-    def test_step(
-        self, batch: Batch | CfBatch | TernarySample, *_: Any
-    ) -> SharedStepOut | CfSharedStepOut:
-        return self.shared_step(batch, stage=Stage.test)
+    def on_train_epoch_start(self) -> None:
+        # `mmd_resample_every=0` keeps the first random features for the whole run
+        if self.mmd_resample_every > 0 and self.current_epoch % self.mmd_resample_every == 0:
+            self.loss.rff.resample()
 
     @implements(pl.LightningModule)
-    def validation_step(
-        self, batch: Batch | CfBatch | TernarySample, *_: Any
-    ) -> SharedStepOut | CfSharedStepOut:
-        return self.shared_step(batch, stage=Stage.validate)
-
-    def shared_step(
-        self, batch: Batch | CfBatch | TernarySample, *, stage: Stage
-    ) -> SharedStepOut | CfSharedStepOut:
+    def test_step(self, batch: Batch | CfBatch | TernarySample, *_: Any) -> None:
+        self.shared_step(batch, stage=Stage.test)
+
+    @implements(pl.LightningModule)
+    def validation_step(self, batch: Batch | CfBatch | TernarySample, *_: Any) -> None:
+        self.shared_step(batch, stage=Stage.validate)
+
+    def shared_step(self, batch: Batch | CfBatch | TernarySample, *, stage: Stage) -> None:
         assert self.built
         constraint_mask = torch.zeros_like(batch.x)
         constraint_mask[:, self.indices] += 1
@@ -481,27 +449,26 @@ class AE(CommonModel):
             to_return = CfSharedStepOut(
                 cf_x=batch.cfx,
                 cf_recon=self.invert(index_by_s(enc_fwd.x, batch.cfs), batch.x),
-                **asdict(to_return),
+                **vars(to_return),
             )
 
-        return to_return
+        self.step_outputs.append(**vars(to_return))
 
     @implements(pl.LightningModule)
-    def test_epoch_end(self, outputs: list[SharedStepOut | CfSharedStepOut]) -> None:
-        self.shared_epoch_end(outputs, stage=Stage.test)
+    def test_epoch_end(self, outputs: list[None]) -> None:
+        self.shared_epoch_end(stage=Stage.test)
 
     @implements(pl.LightningModule)
-    def validation_epoch_end(self, outputs: list[SharedStepOut | CfSharedStepOut]) -> None:
-        self.shared_epoch_end(outputs, stage=Stage.validate)
+    def validation_epoch_end(self, outputs: list[None]) -> None:
+        self.shared_epoch_end(stage=Stage.validate)
 
-    def shared_epoch_end(
-        self, output_results: list[SharedStepOut | CfSharedStepOut], *, stage: Stage
-    ) -> None:
-        self.all_x = torch.cat([_r.x for _r in output_results], 0)
-        all_z = torch.cat([_r.z for _r in output_results], 0)
-        self.all_s = torch.cat([_r.s for _r in output_results], 0)
-        self.all_recon = torch.cat([_r.recon for _r in output_results], 0)
-        self.all_cf_pred = torch.cat([_r.cf_pred for _r in output_results], 0)
+    def shared_epoch_end(self, *, stage: Stage) -> None:
+        output_results = self.step_outputs
+        self.all_x = output_results["x"]
+        all_z = output_results["z"]
+        self.all_s = output_results["s"]
+        self.all_recon = output_results["recon"]
+        self.all_cf_pred = output_results["cf_pred"]
 
         if self.debug and self.current_epoch % 25 == 0:
             make_plot(
@@ -525,7 +492,7 @@ class AE(CommonModel):
                 name=f"{stage}_z",
                 cols=[str(i) for i in range(self.latent_dims)],
             )
-            self.cf_recon = torch.cat([_r.cf_pred for _r in output_results], 0)  # type: ignore[union-attr]
+            self.cf_recon = output_results["cf_pred"]
             make_plot(
                 x=self.cf_recon.clone(),
                 s=self.all_s.clone(),
@@ -534,8 +501,8 @@ class AE(CommonModel):
                 cols=self.data_cols,
             )
 
-        if isinstance(output_results[0], CfSharedStepOut):
-            self.all_cf_x = torch.cat([_r.cf_x for _r in output_results], 0)  # type: ignore[union-attr]
+        if "cf_x" in output_results:
+            self.all_cf_x = output_results["cf_x"]
             if self.debug:
                 make_plot(
                     x=self.all_cf_x.clone(),
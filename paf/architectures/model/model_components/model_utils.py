@@ -1,11 +1,13 @@
 """Model related utiltiy functions."""
 from __future__ import annotations
+from typing import NamedTuple
 
 import torch
 from torch import Tensor, arange, autograd, nn, stack
 import torch.nn.functional as F
 
 __all__ = [
+    "FeatureLayout",
     "init_weights",
     "index_by_s",
     "augment_recons",
@@ -15,22 +17,125 @@ __all__ = [
 ]
 
 
+class _LayoutTensors(NamedTuple):
+    group_ids: Tensor
+    position_in_group: Tensor
+    padded_index: Tensor
+    padding: Tensor
+    singleton: Tensor
+
+
+class FeatureLayout:
+    """Layout of the one-hot discrete feature groups, which are followed by continuous columns.
+
+    The group of every discrete column and a padded ``(groups, max group size)`` gather index
+    are computed once, so that per-group operations run as a handful of batched kernels instead
+    of one per group or column.
+    """
+
+    def __init__(self, discrete: list[slice]) -> None:
+        self.discrete = discrete
+        self.num_groups = len(discrete)
+        self.disc_stop = discrete[-1].stop if discrete else 0
+        sizes = torch.tensor([group.stop - group.start for group in discrete], dtype=torch.long)
+        starts = torch.tensor([group.start for group in discrete], dtype=torch.long)
+        max_size = int(sizes.max()) if discrete else 0
+        group_ids = torch.repeat_interleave(torch.arange(self.num_groups), sizes)
+        positions = torch.arange(max_size)
+        self._cpu = _LayoutTensors(
+            group_ids=group_ids,
+            position_in_group=torch.arange(self.disc_stop) - starts[group_ids],
+            padded_index=(starts[:, None] + positions).clamp(max=max(self.disc_stop - 1, 0)),
+            padding=positions >= sizes[:, None],
+            singleton=(sizes == 1)[group_ids],
+        )
+        self._on_device: dict[torch.device, _LayoutTensors] = {}
+
+    def _tensors(self, device: torch.device) -> _LayoutTensors:
+        if device not in self._on_device:
+            self._on_device[device] = _LayoutTensors(*(t.to(device) for t in self._cpu))
+        return self._on_device[device]
+
+    def padded(self, z: Tensor) -> Tensor:
+        """Gather the discrete columns into ``(batch, groups, max size)``, padded with -inf."""
+        tensors = self._tensors(z.device)
+        return z[:, tensors.padded_index].masked_fill(tensors.padding, float("-inf"))
+
+    def segment_softmax(self, z: Tensor) -> Tensor:
+        """Softmax over the columns of every discrete group."""
+        tensors = self._tensors(z.device)
+        probs = self.padded(z).softmax(dim=-1)
+        return probs[:, tensors.group_ids, tensors.position_in_group]
+
+    def segment_one_hot(self, z: Tensor) -> Tensor:
+        """One-hot encode the argmax of every discrete group, rounding single-column groups."""
+        tensors = self._tensors(z.device)
+        argmax = self.padded(z).argmax(dim=-1)
+        one_hot = (argmax[:, tensors.group_ids] == tensors.position_in_group).to(z.dtype)
+        return torch.where(tensors.singleton, z[:, : self.disc_stop].round(), one_hot)
+
+    def invert(self, z: Tensor) -> Tensor:
+        """Go from logits to one-hot discrete features and sigmoided continuous features."""
+        if not self.discrete:
+            return z.sigmoid()
+        cont = z[:, self.disc_stop :].sigmoid()
+        return torch.cat([self.segment_one_hot(z[:, : self.disc_stop]), cont], dim=1)
+
+    def soft_invert(self, z: Tensor) -> Tensor:
+        """Go from logits to per-group probabilities and sigmoided continuous features."""
+        if not self.discrete:
+            return z.sigmoid()
+        cont = z[:, self.disc_stop :].sigmoid()
+        return torch.cat([self.segment_softmax(z[:, : self.disc_stop]), cont], dim=1)
+
+    def recon_loss(self, z: Tensor, x: Tensor) -> Tensor:
+        """Reconstruction loss of logits ``z`` against the data ``x``.
+
+        This is the sum of the mean L1 loss of every sigmoided continuous column and the
+        cross-entropy of every discrete group, computed with one reduction each.
+        """
+        if not self.discrete:
+            return F.l1_loss(z.sigmoid(), x)
+        cont = z[:, self.disc_stop : x.shape[1]].sigmoid() - x[:, self.disc_stop :]
+        cont_loss = cont.abs().mean(dim=0).sum()
+        log_probs = self.padded(z).log_softmax(dim=-1)
+        targets = self.padded(x).argmax(dim=-1, keepdim=True)
+        disc_loss = -log_probs.gather(-1, targets).mean(dim=0).sum()
+        return cont_loss + disc_loss
+
+    def bernoulli_mask(self, num_rows: int, num_columns: int, device: torch.device) -> Tensor:
+        """Random 0/1 mask with one draw per discrete group and one per continuous column."""
+        if not self.discrete:
+            return torch.bernoulli(torch.rand((num_rows, num_columns), device=device))
+        group_mask = torch.bernoulli(torch.rand((num_rows, self.num_groups), device=device))
+        cont_mask = torch.bernoulli(
+            torch.rand((num_rows, num_columns - self.disc_stop), device=device)
+        )
+        return torch.cat([group_mask[:, self._tensors(device).group_ids], cont_mask], dim=1)
+
+
 def init_weights(module: nn.Module) -> None:
     """Make Linear layer weights initialised with Xavier Norm."""
     if isinstance(module, nn.Linear):
         nn.init.xavier_uniform_(module.weight)
 
 
-def index_by_s(recons: list[Tensor], s: Tensor) -> Tensor:
-    """Get recon by the index of S."""
+def index_by_s(recons: list[Tensor] | Tensor, s: Tensor) -> Tensor:
+    """Get recon by the index of S.
+
+    ``recons`` is either a list with one tensor per value of S, or those tensors stacked along
+    the first dimension.
+    """
+    if isinstance(recons, Tensor):
+        return recons[s.long(), arange(recons.shape[1])]
     _recons = stack(recons, dim=1)
     return _recons[arange(_recons.shape[0]), s.long()]
 
 
 def augment_recons(x: Tensor, cf_x: Tensor, s: Tensor) -> list[Tensor]:
     """Given real data and counterfactuial data, return in recon format based on S index."""
-    aug_list = [(x[i], cf_x[i]) if _s == 0 else (cf_x[i], x[i]) for i, _s in enumerate(s)]
-    return list((torch.stack([d[0] for d in aug_list]), torch.stack([d[1] for d in aug_list])))
+    s_is_0 = (s.to(x.device) == 0).reshape(-1, *(1,) * (x.dim() - 1))
+    return [torch.where(s_is_0, x, cf_x), torch.where(s_is_0, cf_x, x)]
 
 
 def to_discrete(*, inputs: Tensor) -> Tensor:
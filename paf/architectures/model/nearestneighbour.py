@@ -77,6 +77,7 @@ class Knn(nn.Module):
         any comparison of vectors, and furthermore avoids the potentially expensive trigonometric
         operations required to yield a proper metric.
     """
+    _index: faiss.IndexFlat | None = attr.field(default=None, init=False)
 
     def __attrs_pre_init__(self) -> None:
         super().__init__()
@@ -91,6 +92,28 @@ class Knn(nn.Module):
         # make it a flat GPU index
         return faiss.index_cpu_to_gpu(res, x.device.index, index)  # type: ignore
 
+    def fit(self, y: Tensor) -> None:
+        """Build an index over ``y`` that :meth:`query` searches until the next call."""
+        if self.normalize:
+            y = F.normalize(y, dim=1, p=self.p)
+        y_np = y.detach().cpu().numpy()
+        index = self._build_index(d=y.size(1))
+        if y.is_cuda:
+            index = self._index_to_gpu(x=y, index=index)
+        if not index.is_trained:
+            index.train(x=y_np)  # type: ignore
+        index.add(x=y_np)  # type: ignore
+        self._index = index
+
+    def query(self, x: Tensor) -> Tensor:
+        """Indices of the ``k`` nearest fitted vectors for each row of ``x``."""
+        if self._index is None:
+            raise RuntimeError("The index has to be built with `fit` before it can be queried.")
+        if self.normalize:
+            x = F.normalize(x, dim=1, p=self.p)
+        _, indices_np = self._index.search(x=x.detach().cpu().numpy(), k=self.k)  # type: ignore
+        return torch.as_tensor(indices_np, device=x.device)
+
     @overload
     def forward(
         self,
@@ -210,22 +233,27 @@ class NearestNeighbour(CommonModel):
         self.train_features = torch.as_tensor(data.train_datatuple.x.values, dtype=torch.float32)
         self.train_sens = torch.as_tensor(data.train_datatuple.s.values, dtype=torch.long)
 
+        # one index per sensitive value, over the training points of the other group
+        self.group_inds: list[Tensor] = []
+        self.knns: list[KnnExact] = []
+        for s_val in range(2):
+            mask_inds = (self.train_sens != s_val).squeeze().nonzero(as_tuple=False).squeeze(-1)
+            knn = KnnExact(k=1, normalize=False)
+            knn.fit(self.train_features[mask_inds])
+            self.group_inds.append(mask_inds)
+            self.knns.append(knn)
+
         # self.train_features = nn.Parameter(
         #     F.normalize(self.train_features.detach(), dim=1, p=2), requires_grad=False
         # ).float()
 
     def forward(self, *, x: Tensor, s: Tensor) -> NnFwd:
         # x = F.normalize(x, dim=1, p=2)
-        knn = KnnExact(k=1, normalize=False)
-
         features = torch.empty_like(x)
-        for s_val in range(2):
-            s_val = torch.tensor(s_val).to(self.train_sens.device)
-            mask = (self.train_sens != s_val).squeeze()
-            mask_inds = mask.nonzero(as_tuple=False).squeeze()
-            knn_inds = knn(x=x[(s_val == s).squeeze()], y=self.train_features[mask_inds])
-            abs_indices = mask_inds[knn_inds].squeeze()
-            features[(s_val == s).squeeze()] = self.train_features[abs_indices]
+        for s_val, (knn, group_inds) in enumerate(zip(self.knns, self.group_inds)):
+            in_group = (s == s_val).view(-1)
+            knn_inds = knn.query(x[in_group]).squeeze(-1).to(group_inds.device)
+            features[in_group] = self.train_features[group_inds[knn_inds]].to(x)
 
         _x = augment_recons(x=x, cf_x=features, s=s)
         return NnFwd(x=[index_by_s(_x, torch.zeros_like(s)), index_by_s(_x, torch.ones_like(s))])
@@ -251,37 +279,38 @@ class NearestNeighbour(CommonModel):
         ...
 
     @implements(pl.LightningModule)
-    def test_step(self, batch: Batch | CfBatch | TernarySample, *_: Any) -> NnStepOut:
-        return self.shared_step(batch, stage=Stage.test)
+    def test_step(self, batch: Batch | CfBatch | TernarySample, *_: Any) -> None:
+        self.shared_step(batch, stage=Stage.test)
 
     @implements(pl.LightningModule)
-    def validation_step(self, batch: Batch | CfBatch | TernarySample, *_: Any) -> NnStepOut:
-        return self.shared_step(batch, stage=Stage.validate)
+    def validation_step(self, batch: Batch | CfBatch | TernarySample, *_: Any) -> None:
+        self.shared_step(batch, stage=Stage.validate)
 
-    def shared_step(self, batch: Batch | CfBatch | TernarySample, *, stage: Stage) -> NnStepOut:
+    def shared_step(self, batch: Batch | CfBatch | TernarySample, *, stage: Stage) -> None:
         recon_list = self.forward(x=batch.x, s=batch.s)
 
-        return NnStepOut(
+        step_out = NnStepOut(
             cf_x=index_by_s(recon_list.x, 1 - batch.s),
             x=index_by_s(recon_list.x, batch.s),
             s=batch.s,
             recons_0=recon_list.x[0],
             recons_1=recon_list.x[1],
         )
+        self.step_outputs.append(**vars(step_out))
 
     @implements(pl.LightningModule)
-    def test_epoch_end(self, outputs: list[NnStepOut]) -> None:
-        self.shared_epoch_end(outputs, stage=Stage.test)
+    def test_epoch_end(self, outputs: list[None]) -> None:
+        self.shared_epoch_end(stage=Stage.test)
 
     @implements(pl.LightningModule)
-    def validation_epoch_end(self, outputs: list[NnStepOut]) -> None:
-        self.shared_epoch_end(outputs, stage=Stage.validate)
-
-    def shared_epoch_end(self, output_results: list[NnStepOut], *, stage: Stage) -> None:
-        self.all_x = torch.cat([_r.x for _r in output_results], 0)
-        self.all_s = torch.cat([_r.s for _r in output_results], 0)
-        self.all_recon = torch.cat([_r.x for _r in output_results], 0)
-        self.all_cf_pred = torch.cat([_r.cf_x for _r in output_results], 0)
+    def validation_epoch_end(self, outputs: list[None]) -> None:
+        self.shared_epoch_end(stage=Stage.validate)
+
+    def shared_epoch_end(self, *, stage: Stage) -> None:
+        self.all_x = self.step_outputs["x"]
+        self.all_s = self.step_outputs["s"]
+        self.all_recon = self.step_outputs["x"]
+        self.all_cf_pred = self.step_outputs["cf_x"]
 
     def predict_step(
         self, batch: Batch | CfBatch | TernarySample, batch_idx: int, *_: Any
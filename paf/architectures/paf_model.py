@@ -4,11 +4,13 @@ from dataclasses import dataclass
 from typing import Any
 
 from conduit.data import TernarySample
+import numpy as np
 import pandas as pd
 import pytorch_lightning as pl
 from ranzen import implements
 import torch
 from torch import Tensor, nn
+import torch.nn.functional as F
 from torch.optim.lr_scheduler import ExponentialLR
 
 __all__ = ["PafModel", "TestStepOut"]
@@ -16,6 +18,7 @@ __all__ = ["PafModel", "TestStepOut"]
 from tqdm import tqdm
 
 from paf.base_templates import Batch, CfBatch
+from paf.utils import Accumulator
 
 from . import PafResults
 from .model import CycleGan, NearestNeighbour
@@ -45,6 +48,8 @@ class TestStepOut:
 class PafModel(pl.LightningModule):
     """Model."""
 
+    predictions: Accumulator
+
     def __init__(self, *, encoder: AE | CycleGan, classifier: Clf):
         super().__init__()
         self.enc = encoder
@@ -57,7 +62,7 @@ class PafModel(pl.LightningModule):
     @implements(nn.Module)
     @torch.no_grad()
     def forward(self, *, x: Tensor, s: Tensor) -> dict[str, tuple[Tensor, ...]]:
-        recons: list[Tensor] | None = None
+        recons: list[Tensor] | Tensor | None = None
         if isinstance(self.enc, AE):
             enc_fwd = self.enc.forward(x=x, s=s)
             recons = enc_fwd.x
@@ -76,7 +81,15 @@ class PafModel(pl.LightningModule):
         """Empty as we do not train the model end to end."""
 
     @implements(pl.LightningModule)
-    def predict_step(self, batch: Batch | CfBatch | TernarySample, *_: Any) -> TestStepOut:
+    def on_predict_epoch_start(self) -> None:
+        self.predictions = Accumulator(
+            num_batches=sum(self.trainer.num_predict_batches),
+            num_rows=_num_rows(self.trainer.predict_dataloaders),
+            row_dims={"clf_z": 1, "recons": 1},
+        )
+
+    @implements(pl.LightningModule)
+    def predict_step(self, batch: Batch | CfBatch | TernarySample, *_: Any) -> None:
         if isinstance(self.enc, AE):
             constraint_mask = torch.zeros_like(batch.x)
             constraint_mask[:, self.enc.indices] += 1
@@ -119,81 +132,73 @@ class PafModel(pl.LightningModule):
             "cf_recon": index_by_s(augmented_recons, 1 - batch.s),
             "recons_0": self.enc.invert(recons[0], batch.x),
             "recons_1": self.enc.invert(recons[1], batch.x),
-            "preds": self.clf.threshold(
-                index_by_s(self.clf.forward(x=batch.x, s=batch.s)[-1], batch.s)
-            ),
         }
 
-        for i, recon in enumerate(augmented_recons):
-            clf_out = self.clf.forward(x=recon, s=torch.ones_like(batch.s) * i)
-            vals[f"clf_z{i}"] = clf_out.z
-            vals.update({f"preds_{i}_{j}": self.clf.threshold(clf_out.y[j]) for j in range(2)})
-        return TestStepOut(**vals)
-
-    def collate_results(self, outputs: list[TestStepOut], *, cycle_steps: int = 0) -> PafResults:
-        preds_0_0 = torch.cat([_r.preds_0_0 for _r in outputs], 0)
-        preds_0_1 = torch.cat([_r.preds_0_1 for _r in outputs], 0)
-        preds_1_0 = torch.cat([_r.preds_1_0 for _r in outputs], 0)
-        preds_1_1 = torch.cat([_r.preds_1_1 for _r in outputs], 0)
-        x = torch.cat([_r.x for _r in outputs], 0)
-        s = torch.cat([_r.s for _r in outputs], 0)
-        preds = torch.cat([_r.preds for _r in outputs], 0)
-        clf_z0 = torch.cat([_r.clf_z0 for _r in outputs], 0)
-        clf_z1 = torch.cat([_r.clf_z1 for _r in outputs], 0)
-
-        recons = torch.cat([_r.recon for _r in outputs], 0)
-        recons_0 = torch.cat([_r.recons_0 for _r in outputs], 0)
-        recons_1 = torch.cat([_r.recons_1 for _r in outputs], 0)
-
-        mse_loss_fn = nn.MSELoss(reduction="none")
-        _recons = [recons_0.clone(), recons_1.clone()]
-        torch.tensor(0.0)
-        cyc_dict = {}
+        # the factual batch and both augmented reconstructions share one classifier pass
+        clf_out, *recon_outs = self.clf.stacked_forward(
+            [batch.x, *augmented_recons],
+            ss=[batch.s] + [torch.ones_like(batch.s) * i for i in range(len(augmented_recons))],
+        )
+        vals["preds"] = self.clf.threshold(index_by_s(clf_out.y, batch.s))
+        for i, recon_out in enumerate(recon_outs):
+            vals[f"clf_z{i}"] = recon_out.z
+            vals.update({f"preds_{i}_{j}": self.clf.threshold(recon_out.y[j]) for j in range(2)})
+        step_out = TestStepOut(**vals)
 
-        cycle_loss = None
-        for i in tqdm(range(cycle_steps), desc="Cycle Measure"):
-            _cfx = self.enc.invert(index_by_s(_recons, 1 - s), x).cpu()
-            if isinstance(self.enc, (AE, NearestNeighbour)):
-                cf_fwd = self.enc.forward(x=_cfx, s=1 - s.cpu())
-                _og = self.enc.invert(index_by_s(cf_fwd.x, s), x)
-            else:
-                cf_fwd = self.enc.forward(
-                    real_s0=torch.cat([_cfx, s.unsqueeze(dim=-1)], dim=1)
-                    if self.enc.s_as_input
-                    else _cfx,
-                    real_s1=torch.cat([_cfx, s.unsqueeze(dim=-1)], dim=1)
-                    if self.enc.s_as_input
-                    else _cfx,
-                )
-                recon = index_by_s(cf_fwd.x, s)
-                _og = self.enc.invert(recon[:, :-1] if self.enc.s_as_input else recon)
-            cycle_loss = mse_loss_fn(_og, x.cpu())
-            cyc_dict[f"Cycle_loss/{i}"] = cycle_loss.detach().mean(dim=-1).cpu().numpy().tolist()
-            if isinstance(self.enc, (AE, NearestNeighbour)):
-                _fwd = self.enc.forward(x=_og, s=1 - s.cpu())
-                _recons = _fwd.x
-            else:
-                _fwd = self.enc.forward(
-                    real_s0=torch.cat([_og, s.unsqueeze(dim=-1)], dim=1)
-                    if self.enc.s_as_input
-                    else _og,
-                    real_s1=torch.cat([_og, s.unsqueeze(dim=-1)], dim=1)
-                    if self.enc.s_as_input
-                    else _og,
-                )
-                _recons = [_fwd.x[0][:, :-1], _fwd.x[1][:, :-1]] if self.enc.s_as_input else _fwd.x
+        # both groups are kept in one buffer each, so that the stacked results are views
+        fields = vars(step_out).copy()
+        clf_z = torch.stack([fields.pop("clf_z0"), fields.pop("clf_z1")])
+        recons_01 = torch.stack([fields.pop("recons_0"), fields.pop("recons_1")])
+        self.predictions.append(clf_z=clf_z, recons=recons_01, **fields)
+
+    def collate_results(
+        self,
+        outputs: list[None] | None = None,
+        *,
+        cycle_steps: int = 0,
+        cycle_batch_size: int | None = None,
+        cycle_tol: float = 0.0,
+        cycle_subsample: int | None = None,
+    ) -> PafResults:
+        """Gather the outputs that the predict steps wrote into ``self.predictions``.
+
+        ``outputs`` is what ``Trainer.predict`` returns; the steps return nothing, so it is unused.
+        """
+        _ = (outputs,)
+        predictions = self.predictions
+        preds_0_0 = predictions["preds_0_0"]
+        preds_0_1 = predictions["preds_0_1"]
+        preds_1_0 = predictions["preds_1_0"]
+        preds_1_1 = predictions["preds_1_1"]
+        x = predictions["x"]
+        s = predictions["s"]
+        preds = predictions["preds"]
+        clf_z0, clf_z1 = predictions["clf_z"]
+
+        recons = predictions["recon"]
+        recons_0, recons_1 = predictions["recons"]
+
+        cycle_loss, cyc_vals = self.measure_cycle(
+            x,
+            s,
+            predictions["recons"],
+            steps=cycle_steps,
+            batch_size=cycle_batch_size,
+            tol=cycle_tol,
+            subsample=cycle_subsample,
+        )
 
         return PafResults(
-            enc_z=torch.cat([_r.enc_z for _r in outputs], 0),
-            enc_s_pred=torch.cat([_r.enc_s_pred for _r in outputs], 0),
+            enc_z=predictions["enc_z"],
+            enc_s_pred=predictions["enc_s_pred"],
             clf_z0=clf_z0,
             clf_z1=clf_z1,
-            clf_z=torch.cat([clf_z0, clf_z1], dim=0),
+            clf_z=predictions["clf_z"].flatten(0, 1),
             s=s,
             x=x,
-            y=torch.cat([_r.y for _r in outputs], 0),
+            y=predictions["y"],
             recon=recons,
-            cf_x=torch.cat([_r.cf_recon for _r in outputs], 0),
+            cf_x=predictions["cf_recon"],
             recons_0=recons_0,
             recons_1=recons_1,
             preds=preds,
@@ -219,5 +224,83 @@ class PafModel(pl.LightningModule):
                 columns=["s1_0_s2_0", "s1_0_s2_1", "s1_1_s2_0", "s1_1_s2_1", "true_s", "actual"],
             ),
             cycle_loss=cycle_loss,
-            cyc_vals=pd.DataFrame.from_dict(cyc_dict),
+            cyc_vals=cyc_vals,
         )
+
+    @torch.no_grad()
+    def measure_cycle(
+        self,
+        x: Tensor,
+        s: Tensor,
+        recons: Tensor,
+        *,
+        steps: int,
+        batch_size: int | None = None,
+        tol: float = 0.0,
+        subsample: int | None = None,
+        seed: int = 0,
+    ) -> tuple[Tensor | None, pd.DataFrame]:
+        """Repeatedly map ``x`` to the other group and back, and measure how far it drifts.
+
+        ``recons`` holds the reconstructions for s=0 and s=1 stacked along the first dimension.
+        Rows are processed on the model's device in batches of ``batch_size``, optionally on a
+        random subsample of ``subsample`` rows, and the loop stops early once the mean loss
+        changes by less than ``tol`` between two steps. Each step is summarised by the mean and
+        the 5%, 50% and 95% quantiles of the per-row MSE.
+        """
+        if subsample is not None and subsample < len(x):
+            gen = torch.Generator().manual_seed(seed)
+            rows = torch.randperm(len(x), generator=gen)[:subsample].to(x.device)
+            x, s, recons = x[rows], s[rows], recons[:, rows]
+        else:
+            recons = recons.clone()
+        batch_size = len(x) if batch_size is None else batch_size
+
+        cycle_loss = None
+        stats: dict[str, list[float]] = {}
+        last_mean: float | None = None
+        for i in tqdm(range(steps), desc="Cycle Measure"):
+            cycle_loss = torch.empty_like(x)
+            for start in range(0, len(x), batch_size):
+                rows = slice(start, start + batch_size)
+                _x = x[rows].to(self.device)
+                _og, _recons = self._cycle_step(
+                    _x, s[rows].to(self.device), recons[:, rows].to(self.device)
+                )
+                cycle_loss[rows] = F.mse_loss(_og, _x, reduction="none").to(x.device)
+                recons[:, rows] = _recons.to(recons.device)
+            row_losses = cycle_loss.mean(dim=-1).cpu().numpy()
+            mean = float(row_losses.mean())
+            stats[f"Cycle_loss/{i}"] = [mean, *np.quantile(row_losses, [0.05, 0.5, 0.95])]
+            if last_mean is not None and abs(mean - last_mean) < tol:
+                break
+            last_mean = mean
+        return cycle_loss, pd.DataFrame(stats, index=["mean", "q05", "q50", "q95"])
+
+    def _cycle_step(self, x: Tensor, s: Tensor, recons: Tensor) -> tuple[Tensor, Tensor]:
+        """Map the counterfactuals back to the factual group and reconstruct them again."""
+        _cfx = self.enc.invert(index_by_s(recons, 1 - s), x)
+        if isinstance(self.enc, (AE, NearestNeighbour)):
+            cf_fwd = self.enc.forward(x=_cfx, s=1 - s)
+            _og = self.enc.invert(index_by_s(cf_fwd.x, s), x)
+            _fwd = self.enc.forward(x=_og, s=1 - s)
+            return _og, _stack(_fwd.x)
+        assert isinstance(self.enc, CycleGan)
+        _in = torch.cat([_cfx, s.unsqueeze(dim=-1)], dim=1) if self.enc.s_as_input else _cfx
+        recon = index_by_s(self.enc.forward(real_s0=_in, real_s1=_in).x, s)
+        _og = self.enc.invert(recon[:, :-1] if self.enc.s_as_input else recon)
+        _in = torch.cat([_og, s.unsqueeze(dim=-1)], dim=1) if self.enc.s_as_input else _og
+        _recons = _stack(self.enc.forward(real_s0=_in, real_s1=_in).x)
+        return _og, _recons[..., :-1] if self.enc.s_as_input else _recons
+
+
+def _num_rows(dataloaders: list[Any] | None) -> int | None:
+    """The number of rows in the dataloaders' datasets, if they all have a length."""
+    try:
+        return sum(len(loader.dataset) for loader in dataloaders)  # type: ignore[union-attr]
+    except (AttributeError, TypeError):
+        return None
+
+
+def _stack(recons: list[Tensor] | Tensor) -> Tensor:
+    return recons if isinstance(recons, Tensor) else torch.stack(list(recons))
@@ -1,7 +1,11 @@
 """Base Data Module."""
 from __future__ import annotations
 from abc import abstractmethod
-from typing import NamedTuple
+import os
+from pathlib import Path
+import pickle
+import shutil
+from typing import Any, NamedTuple, Sequence
 import warnings
 
 import ethicml as em
@@ -14,7 +18,16 @@ from ranzen import implements
 from sklearn.preprocessing import MinMaxScaler
 from torch.utils.data import DataLoader
 
-from paf.base_templates.dataset_utils import grouped_features_indexes
+from paf.base_templates.data_cache import cache_key, load_datatuple, save_datatuple
+from paf.base_templates.dataset_utils import (
+    CFDataTupleDataset,
+    DataTupleDataset,
+    DataTupleDatasetBase,
+    InMemoryLoader,
+    StratifiedBatchSampler,
+    batched_loader,
+    grouped_features_indexes,
+)
 from paf.plotting import label_plot
 
 __all__ = ["BaseDataModule", "DataGroup", "CfOutcomes"]
@@ -50,10 +63,34 @@ class BaseDataModule(pl.LightningDataModule):
     scaler: MinMaxScaler | None
     cf_outcomes: CfOutcomes | None
 
-    def __init__(self, *, cf_available: bool, seed: int, scaler: MinMaxScaler | None) -> None:
+    def __init__(
+        self,
+        *,
+        cf_available: bool,
+        seed: int,
+        scaler: MinMaxScaler | None,
+        in_memory_loader: bool = False,
+        in_memory_device: str = "cpu",
+        cache_dir: str | None = None,
+        memory_map: bool = False,
+        stratified_batches: bool = False,
+        stratify_by_y: bool = False,
+        batch_quotas: list[int] | None = None,
+    ) -> None:
         super().__init__()
         self.cf_available = cf_available
         self.seed = seed
+        self.in_memory_loader = in_memory_loader
+        self.in_memory_device = in_memory_device
+        self.stratified_batches = stratified_batches
+        self.stratify_by_y = stratify_by_y
+        self.batch_quotas = batch_quotas
+        self._split_datasets: dict[tuple[str, bool], DataTupleDatasetBase] = {}
+        if memory_map and cache_dir is None:
+            raise ValueError("`memory_map` needs a `cache_dir` to write the mapped files to.")
+        self.cache_dir = cache_dir
+        self.memory_map = memory_map
+        self._memory_mapped = False
         self.train_indices: pd.Index[int] | None = None
         self.val_indices: pd.Index[int] | None = None
         self.test_indices: pd.Index[int] | None = None
@@ -84,6 +121,130 @@ class BaseDataModule(pl.LightningDataModule):
         self.cf_data_group = cf_dts if cf_dts is not None else None
         self.cf_outcomes = cf_outcomes
         self.make_feature_groups(dataset=dataset, data=factual_data)
+        self._split_datasets.clear()
+
+    def cache_params(self) -> dict[str, Any]:
+        """Parameters that determine the prepared data, used to key the on-disk cache."""
+        raise NotImplementedError(f"{type(self).__name__} does not support caching.")
+
+    @property
+    def cache_path(self) -> Path | None:
+        """Directory holding the cached data for the current parameters."""
+        if self.cache_dir is None:
+            return None
+        name = type(self).__name__
+        params = self.cache_params()
+        if self.memory_map:
+            params = {**params, "memory_map": True}
+        return Path(self.cache_dir) / f"{name}-{cache_key(name, params)}"
+
+    def load_from_cache(self) -> bool:
+        """Set the data values from the on-disk cache, returning whether there was a hit."""
+        path = self.cache_path
+        if path is None or not path.exists():
+            return False
+        with (path / "state.pkl").open("rb") as state_file:
+            state = pickle.load(state_file)
+
+        def _load_group(name: str) -> DataGroup | None:
+            if not (path / name).exists():
+                return None
+            return DataGroup(*(load_datatuple(path / name / split) for split in DataGroup._fields))
+
+        cf_outcomes = None
+        if (path / "cf_outcomes").exists():
+            cf_outcomes = CfOutcomes(
+                *(load_datatuple(path / "cf_outcomes" / world) for world in CfOutcomes._fields)
+            )
+        dts = _load_group("dts")
+        assert dts is not None
+        self.scaler = state["scaler"]
+        self.train_indices, self.val_indices, self.test_indices = state["indices"]
+        self.set_data_values(
+            dataset=state["dataset"],
+            factual_data=load_datatuple(path / "factual_data"),
+            dts=dts,
+            best_guess=state["best_guess"],
+            true_dts=_load_group("true_dts"),
+            cf_dts=_load_group("cf_dts"),
+            cf_outcomes=cf_outcomes,
+        )
+        self._memory_mapped = True
+        return True
+
+    def save_to_cache(self) -> None:
+        """Write the prepared data to the on-disk cache, if one is configured.
+
+        With ``memory_map`` the features are stored as float32 in the column order used by
+        :class:`DataTupleDatasetBase`, so that the torch datasets can share their memory.
+        """
+        path = self.cache_path
+        if path is None or path.exists():
+            return
+        tmp_path = path.with_name(f"{path.name}.tmp-{os.getpid()}")
+        features = self.disc_features + self.cont_features
+
+        def _save(datatuple: DataTuple, dt_path: Path) -> None:
+            if self.memory_map:
+                columns = features + [col for col in datatuple.x.columns if col not in features]
+                datatuple = datatuple.replace(x=datatuple.x[columns])
+            save_datatuple(
+                datatuple, dt_path, x_dtype=np.dtype(np.float32) if self.memory_map else None
+            )
+
+        groups = {
+            "dts": self.data_group,
+            "true_dts": self.true_data_group,
+            "cf_dts": self.cf_data_group,
+        }
+        for name, group in groups.items():
+            if group is not None:
+                for split, datatuple in zip(DataGroup._fields, group):
+                    _save(datatuple, tmp_path / name / split)
+        if self.cf_outcomes is not None:
+            for world, datatuple in zip(CfOutcomes._fields, self.cf_outcomes):
+                _save(datatuple, tmp_path / "cf_outcomes" / world)
+        _save(self.factual_data, tmp_path / "factual_data")
+        state = {
+            "dataset": self.dataset,
+            "best_guess": self.best_guess,
+            "scaler": self.scaler,
+            "indices": (self.train_indices, self.val_indices, self.test_indices),
+        }
+        with (tmp_path / "state.pkl").open("wb") as state_file:
+            pickle.dump(state, state_file)
+        try:
+            tmp_path.rename(path)
+        except OSError:  # another job has written the same cache in the meantime
+            shutil.rmtree(tmp_path)
+
+    @implements(pl.LightningDataModule)
+    def setup(self, stage: str | None = None) -> None:
+        if self.memory_map and not self._memory_mapped:
+            # swap the data prepared in memory for views of the files written by `prepare_data`
+            self.load_from_cache()
+        self._split_datasets.clear()
+
+    def split_dataset(self, split: str, *, cf: bool) -> DataTupleDatasetBase:
+        """Get the torch dataset for a split, building it only on first use."""
+        key = (split, cf)
+        if key not in self._split_datasets:
+            datatuple = getattr(self.data_group, split)
+            if cf:
+                assert self.cf_data_group is not None
+                self._split_datasets[key] = CFDataTupleDataset(
+                    datatuple,
+                    cf_dataset=getattr(self.cf_data_group, split),
+                    disc_features=self.dataset.discrete_features,
+                    cont_features=self.dataset.continuous_features,
+                )
+            else:
+                self._split_datasets[key] = DataTupleDataset(
+                    dataset=datatuple,
+                    disc_features=self.dataset.discrete_features,
+                    cont_features=self.dataset.continuous_features,
+                )
+        return self._split_datasets[key]
 
     def make_feature_groups(self, *, dataset: Dataset, data: DataTuple) -> None:
         """Make feature groups for reconstruction."""
@@ -94,28 +255,81 @@ class BaseDataModule(pl.LightningDataModule):
         self.cont_features = cont_features
         self.feature_groups = dict(discrete=grouped_features_indexes(self.disc_features))
 
+    def make_dataloader(
+        self,
+        dataset: DataTupleDatasetBase,
+        *,
+        batch_size: int,
+        shuffle: bool,
+        drop_last: bool,
+        num_workers: int = 0,
+    ) -> DataLoader | InMemoryLoader:
+        """Make a loader over a split, keeping the split resident in memory if requested.
+
+        With ``stratified_batches``, shuffled loaders draw batches that are balanced by s (and y
+        if ``stratify_by_y``), according to ``batch_quotas``.
+        """
+        batch_sampler = None
+        if self.stratified_batches and shuffle:
+            batch_sampler = StratifiedBatchSampler(
+                s=dataset.s,
+                y=dataset.y if self.stratify_by_y else None,
+                batch_size=batch_size,
+                quotas=self.batch_quotas,
+                seed=self.seed,
+            )
+        if self.in_memory_loader:
+            return InMemoryLoader(
+                dataset,
+                batch_size=batch_size,
+                shuffle=shuffle,
+                drop_last=drop_last,
+                device=self.in_memory_device,
+                batch_sampler=batch_sampler,
+            )
+        return batched_loader(
+            dataset,
+            batch_size=batch_size,
+            shuffle=shuffle,
+            drop_last=drop_last,
+            num_workers=num_workers,
+            batch_sampler=batch_sampler,
+        )
+
     @abstractmethod
-    def _train_dataloader(self, *, shuffle: bool = True, drop_last: bool = True) -> DataLoader:
+    def _train_dataloader(
+        self, *, shuffle: bool = True, drop_last: bool = True
+    ) -> DataLoader | InMemoryLoader:
         ...
 
     @abstractmethod
-    def _val_dataloader(self, *, shuffle: bool = True, drop_last: bool = True) -> DataLoader:
+    def _val_dataloader(
+        self, *, shuffle: bool = True, drop_last: bool = True
+    ) -> DataLoader | InMemoryLoader:
         ...
 
     @abstractmethod
-    def _test_dataloader(self, *, shuffle: bool = True, drop_last: bool = True) -> DataLoader:
+    def _test_dataloader(
+        self, *, shuffle: bool = True, drop_last: bool = True
+    ) -> DataLoader | InMemoryLoader:
         ...
 
     @implements(pl.LightningDataModule)
-    def train_dataloader(self, *, shuffle: bool = True, drop_last: bool = True) -> DataLoader:
+    def train_dataloader(
+        self, *, shuffle: bool = True, drop_last: bool = True
+    ) -> DataLoader | InMemoryLoader:
         return self._train_dataloader(shuffle=shuffle, drop_last=drop_last)
 
     @implements(pl.LightningDataModule)
-    def val_dataloader(self, *, shuffle: bool = False, drop_last: bool = False) -> DataLoader:
+    def val_dataloader(
+        self, *, shuffle: bool = False, drop_last: bool = False
+    ) -> DataLoader | InMemoryLoader:
         return self._val_dataloader(shuffle=shuffle, drop_last=drop_last)
 
     @implements(pl.LightningDataModule)
-    def test_dataloader(self, *, shuffle: bool = False, drop_last: bool = False) -> DataLoader:
+    def test_dataloader(
+        self, *, shuffle: bool = False, drop_last: bool = False
+    ) -> DataLoader | InMemoryLoader:
         return self._test_dataloader(shuffle=shuffle, drop_last=drop_last)
 
     def scale_and_split(
@@ -124,48 +338,41 @@ class BaseDataModule(pl.LightningDataModule):
         dataset: Dataset,
     ) -> DataGroup:
         """Scale a datatuple and split to train/test."""
-
-        num_train = int(datatuple.x.shape[0] * 0.7)
-        num_val = int(datatuple.x.shape[0] * 0.1)
+        return self.scale_and_split_worlds([datatuple], dataset)[0]
+
+    def scale_and_split_worlds(
+        self, datatuples: Sequence[DataTuple], dataset: Dataset
+    ) -> list[DataGroup]:
+        """Split several aligned datatuples with the same indices and scale them.
+
+        The first datatuple is the factual one: the scaler is fitted once on its train split and
+        then applied to every world.
+        """
+        num_samples = datatuples[0].x.shape[0]
+        num_train = int(num_samples * 0.7)
+        num_val = int(num_samples * 0.1)
         rng = np.random.RandomState(self.seed)
-        idx = rng.permutation(datatuple.x.index)
+        idx = rng.permutation(datatuples[0].x.index)
         if self.train_indices is None:
             self.train_indices = idx[:num_train]
         if self.val_indices is None:
             self.val_indices = idx[num_train : num_train + num_val]
         if self.test_indices is None:
             self.test_indices = idx[num_train + num_val :]
-
-        train = DataTuple(
-            x=datatuple.x.iloc[self.train_indices].reset_index(drop=True),  # type: ignore[union-attr, index]
-            s=datatuple.s.iloc[self.train_indices].reset_index(drop=True),  # type: ignore[union-attr, index]
-            y=datatuple.y.iloc[self.train_indices].reset_index(drop=True),  # type: ignore[union-attr, index]
-        )
-        val = DataTuple(
-            x=datatuple.x.iloc[self.val_indices].reset_index(drop=True),  # type: ignore[union-attr, index]
-            s=datatuple.s.iloc[self.val_indices].reset_index(drop=True),  # type: ignore[union-attr, index]
-            y=datatuple.y.iloc[self.val_indices].reset_index(drop=True),  # type: ignore[union-attr, index]
-        )
-        test = DataTuple(
-            x=datatuple.x.iloc[self.test_indices].reset_index(drop=True),  # type: ignore[union-attr, index]
-            s=datatuple.s.iloc[self.test_indices].reset_index(drop=True),  # type: ignore[union-attr, index]
-            y=datatuple.y.iloc[self.test_indices].reset_index(drop=True),  # type: ignore[union-attr, index]
-        )
-
-        if self.scaler is not None:
-            self.scaler = self.scaler.fit(train.x[dataset.continuous_features])
-            train.x[dataset.continuous_features] = self.scaler.transform(
-                train.x[dataset.continuous_features]
-            )
-            val.x[dataset.continuous_features] = (
-                self.scaler.transform(val.x[dataset.continuous_features])
-                if val.x.shape[0] > 0
-                else val.x[dataset.continuous_features]
-            )
-            test.x[dataset.continuous_features] = self.scaler.transform(
-                test.x[dataset.continuous_features]
-            )
-        return DataGroup(train=train, val=val, test=test)
+        splits = (self.train_indices, self.val_indices, self.test_indices)
+
+        cont_features = dataset.continuous_features
+        groups = []
+        for world, datatuple in enumerate(datatuples):
+            group = DataGroup(*(_take(datatuple, indices) for indices in splits))
+            if self.scaler is not None:
+                if world == 0:
+                    self.scaler = self.scaler.fit(group.train.x[cont_features])
+                for split in group:
+                    if split.x.shape[0] > 0:
+                        split.x[cont_features] = self.scaler.transform(split.x[cont_features])
+            groups.append(group)
+        return groups
 
     def make_data_plots(self, *, cf_available: bool, logger: pll.WandbLogger) -> None:
         """Make plots of the data."""
@@ -183,8 +390,8 @@ class BaseDataModule(pl.LightningDataModule):
             try:
                 label_plot(
                     em.DataTuple(
-                        x=self.factual_data.x.copy(),
-                        s=self.factual_data.s.copy(),
+                        x=self.factual_data.x,
+                        s=self.factual_data.s,
                         y=self.best_guess.hard.to_frame(),
                     ),
                     logger,
@@ -245,6 +452,17 @@ class BaseDataModule(pl.LightningDataModule):
         return self.cf_data_group.test
 
 
+def _take(datatuple: DataTuple, indices: np.ndarray) -> DataTuple:
+    """Gather rows of a datatuple by position, giving them a fresh ``RangeIndex``."""
+    frames = []
+    for frame in (datatuple.x, datatuple.s, datatuple.y):
+        frame = frame.take(indices)
+        frame.index = pd.RangeIndex(len(frame))
+        frames.append(frame)
+    x, s, y = frames
+    return DataTuple(x=x, s=s, y=y, name=datatuple.name)
+
+
 class DataGroup(NamedTuple):
     train: DataTuple
     val: DataTuple
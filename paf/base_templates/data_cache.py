@@ -0,0 +1,136 @@
+"""On-disk cache for prepared data."""
+from __future__ import annotations
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Final, Mapping
+
+from ethicml import DataTuple
+import numpy as np
+import pandas as pd
+
+__all__ = [
+    "CACHE_VERSION",
+    "DataTupleWriter",
+    "cache_key",
+    "load_datatuple",
+    "load_frame",
+    "save_datatuple",
+    "save_frame",
+]
+
+
+# bump whenever data generation, scaling or the on-disk layout changes, so that caches written
+# by older code are no longer hit
+CACHE_VERSION: Final[int] = 2
+
+
+def cache_key(name: str, params: Mapping[str, Any]) -> str:
+    """Hash the name of a data generator together with its parameters and the cache version."""
+    payload = json.dumps(
+        {"version": CACHE_VERSION, "name": name, "params": dict(params)},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def _frame_dtype(frame: pd.DataFrame) -> np.dtype:
+    return np.result_type(*frame.dtypes) if frame.shape[1] > 0 else np.dtype(np.float64)
+
+
+def _save_frame_meta(frame: pd.DataFrame, path: Path) -> None:
+    meta = {"columns": [str(col) for col in frame.columns], "dtypes": list(map(str, frame.dtypes))}
+    path.with_suffix(".json").write_text(json.dumps(meta))
+
+
+def save_frame(frame: pd.DataFrame, path: Path, *, dtype: np.dtype | None = None) -> None:
+    """Save a dataframe as a single ``.npy`` array plus a json file with its columns and dtypes.
+
+    The index is not stored; frames are expected to have a default ``RangeIndex``. If ``dtype``
+    is given, every column is stored (and later loaded) with that dtype.
+    """
+    if dtype is not None:
+        frame = frame.astype(dtype)
+    # row-major, so that a memory-mapped split becomes a tensor without a copy
+    values = np.ascontiguousarray(frame.to_numpy(dtype=_frame_dtype(frame)))
+    np.save(path.with_suffix(".npy"), values, allow_pickle=False)
+    _save_frame_meta(frame, path)
+
+
+def load_frame(path: Path, *, mmap: bool = True) -> pd.DataFrame:
+    """Load a dataframe saved by :func:`save_frame`.
+
+    With ``mmap=True`` the array is memory-mapped copy-on-write, so the file on disk is never
+    modified and pages are only read when they are accessed.
+    """
+    meta = json.loads(path.with_suffix(".json").read_text())
+    values = np.load(path.with_suffix(".npy"), mmap_mode="c" if mmap else None)
+    frame = pd.DataFrame(values, columns=meta["columns"], copy=False)
+    to_cast = {
+        col: dtype for col, dtype in zip(meta["columns"], meta["dtypes"]) if dtype != values.dtype
+    }
+    return frame.astype(to_cast, copy=False) if to_cast else frame
+
+
+def save_datatuple(datatuple: DataTuple, path: Path, *, x_dtype: np.dtype | None = None) -> None:
+    """Save the x, s and y frames of a datatuple into a directory."""
+    path.mkdir(parents=True, exist_ok=True)
+    save_frame(datatuple.x, path / "x", dtype=x_dtype)
+    save_frame(datatuple.s, path / "s")
+    save_frame(datatuple.y, path / "y")
+    (path / "name.json").write_text(json.dumps(datatuple.name))
+
+
+def load_datatuple(path: Path, *, mmap: bool = True) -> DataTuple:
+    """Load a datatuple saved by :func:`save_datatuple`."""
+    return DataTuple(
+        x=load_frame(path / "x", mmap=mmap),
+        s=load_frame(path / "s", mmap=mmap),
+        y=load_frame(path / "y", mmap=mmap),
+        name=json.loads((path / "name.json").read_text()),
+    )
+
+
+class DataTupleWriter:
+    """Write a datatuple of known length to disk one chunk at a time.
+
+    The arrays are preallocated with :func:`numpy.lib.format.open_memmap` when the first chunk
+    arrives, so the result has the same layout as :func:`save_datatuple` and can be read back
+    with :func:`load_datatuple`.
+    """
+
+    def __init__(self, path: Path, *, num_rows: int) -> None:
+        self.path = path
+        self.num_rows = num_rows
+        self.num_written = 0
+        self._arrays: dict[str, np.memmap] = {}
+
+    def write(self, datatuple: DataTuple) -> None:
+        """Append the rows of ``datatuple``."""
+        stop = self.num_written + len(datatuple.x)
+        if stop > self.num_rows:
+            raise ValueError(f"Cannot write more than {self.num_rows} rows to {self.path}.")
+        if not self._arrays:
+            self.path.mkdir(parents=True, exist_ok=True)
+            for key, frame in zip("xsy", (datatuple.x, datatuple.s, datatuple.y)):
+                self._arrays[key] = np.lib.format.open_memmap(
+                    self.path / f"{key}.npy",
+                    mode="w+",
+                    dtype=_frame_dtype(frame),
+                    shape=(self.num_rows, frame.shape[1]),
+                )
+                _save_frame_meta(frame, self.path / key)
+            (self.path / "name.json").write_text(json.dumps(datatuple.name))
+        for key, frame in zip("xsy", (datatuple.x, datatuple.s, datatuple.y)):
+            array = self._arrays[key]
+            array[self.num_written : stop] = frame.to_numpy(dtype=array.dtype)
+        self.num_written = stop
+
+    def close(self) -> None:
+        """Flush the arrays to disk."""
+        if self.num_written != self.num_rows:
+            raise ValueError(f"Expected {self.num_rows} rows but {self.num_written} were written.")
+        for array in self._arrays.values():
+            array.flush()
+        self._arrays = {}
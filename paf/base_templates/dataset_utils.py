@@ -1,14 +1,22 @@
 """Torch Dataset wrapper for EthicML."""
 from __future__ import annotations
 from itertools import groupby
-from typing import Iterator, NamedTuple
+import math
+from typing import Iterator, List, NamedTuple, Sequence, Union
 
 from ethicml import DataTuple, compute_instance_weights
-from ethicml.implementations.pytorch_common import _get_info
 import numpy as np
+import pandas as pd
 import torch
 from torch import Tensor
-from torch.utils.data import Dataset
+from torch.utils.data import (
+    BatchSampler,
+    DataLoader,
+    Dataset,
+    RandomSampler,
+    Sampler,
+    SequentialSampler,
+)
 
 __all__ = [
     "Batch",
@@ -18,8 +26,13 @@ __all__ = [
     "DataTupleDataset",
     "DataTupleDatasetBase",
     "CFDataTupleDataset",
+    "batched_loader",
+    "InMemoryLoader",
+    "StratifiedBatchSampler",
 ]
 
+Index = Union[int, slice, List[int], Tensor]
+
 
 class Batch(NamedTuple):
     x: Tensor
@@ -65,8 +78,21 @@ def grouped_features_indexes(disc_feats: list[str]) -> list[slice]:
     return feature_slices
 
 
+def _as_tensor(frame: pd.DataFrame) -> Tensor:
+    """Convert a frame to a float32 tensor, sharing memory when it is already float32.
+
+    This makes the tensors of a memory-mapped split views of the files on disk.
+    """
+    return torch.from_numpy(np.ascontiguousarray(frame.to_numpy(dtype=np.float32)))
+
+
 class DataTupleDatasetBase(Dataset):
-    """Wrapper for EthicML datasets."""
+    """Wrapper for EthicML datasets.
+
+    Each split is converted once into contiguous float32 tensors, so that indexing with a
+    sequence of indices returns a whole batch with a single gather per field. Frames that are
+    already float32, such as memory-mapped ones, are used without a copy.
+    """
 
     def __init__(self, *, dataset: DataTuple, disc_features: list[str], cont_features: list[str]):
         """Create DataTupleDataset."""
@@ -77,12 +103,15 @@ class DataTupleDatasetBase(Dataset):
         self.cont_features = cont_features
         self.feature_groups = dict(discrete=grouped_features_indexes(self.disc_features))
 
-        self.x_disc = dataset.x[self.disc_features].astype("float32").to_numpy()
-        self.x_cont = dataset.x[self.cont_features].astype("float32").to_numpy()
+        self.x = self._make_x(dataset)
+        self.s = _as_tensor(dataset.s).squeeze(-1)
+        self.y = _as_tensor(dataset.y).squeeze(-1)
 
-        _, self.s, self.num, self.xdim, self.sdim, self.x_names, self.s_names = _get_info(dataset)
-
-        self.y = dataset.y.astype("float32").to_numpy()
+        self.num = dataset.s.shape[0]
+        self.xdim = dataset.x.shape[1]
+        self.sdim = dataset.s.shape[1]
+        self.x_names = dataset.x.columns
+        self.s_names = dataset.s.columns
 
         self.ydim = dataset.y.shape[1]
         self.y_names = dataset.y.columns
@@ -90,20 +119,11 @@ class DataTupleDatasetBase(Dataset):
     def __len__(self) -> int:
         return self.s.shape[0]
 
-    def _x(self, index: int) -> Tensor:
-        x_disc = self.x_disc[index]
-        x_cont = self.x_cont[index]
-        x = np.concatenate([x_disc, x_cont], axis=0, dtype=np.float32)
-        x = torch.from_numpy(x)
-        return x
-
-    def _s(self, index: int) -> Tensor:
-        s = self.s[index]
-        return torch.from_numpy(s).squeeze()
-
-    def _y(self, index: int) -> Tensor:
-        y = self.y[index]
-        return torch.from_numpy(y).squeeze()
+    def _make_x(self, datatuple: DataTuple) -> Tensor:
+        """Concatenate the discrete and continuous features of a datatuple, in that order."""
+        features = self.disc_features + self.cont_features
+        x = datatuple.x
+        return _as_tensor(x if list(x.columns) == features else x[features])
 
 
 class DataTupleDataset(DataTupleDatasetBase):
@@ -115,9 +135,9 @@ class DataTupleDataset(DataTupleDatasetBase):
             compute_instance_weights(dataset)["instance weights"].values
         )
 
-    def __getitem__(self, index: int) -> Batch:
+    def __getitem__(self, index: Index) -> Batch:
         return Batch(
-            x=self._x(index), s=self._s(index), y=self._y(index), iw=self.instance_weight[index]
+            x=self.x[index], s=self.s[index], y=self.y[index], iw=self.instance_weight[index]
         )
 
 
@@ -133,50 +153,152 @@ class CFDataTupleDataset(DataTupleDatasetBase):
     ):
         """Create DataTupleDataset."""
         super().__init__(dataset=dataset, disc_features=disc_features, cont_features=cont_features)
-        self.cf_x_disc, self.cf_x_cont, self.cf_s, self.cf_y = self.split_tuple(cf_dataset)
+        self.cf_x, self.cf_s, self.cf_y = self.split_tuple(cf_dataset)
         self.instance_weight = torch.tensor(
             compute_instance_weights(dataset)["instance weights"].values
         )
 
-    def split_tuple(
-        self, datatuple: DataTuple
-    ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    def split_tuple(self, datatuple: DataTuple) -> tuple[Tensor, Tensor, Tensor]:
         """Split a datatuple to components."""
-        x_disc = datatuple.x[self.disc_features].astype("float32").to_numpy()
-        x_cont = datatuple.x[self.cont_features].astype("float32").to_numpy()
-        s = datatuple.s.astype("float32").to_numpy()
-        y = datatuple.y.astype("float32").to_numpy()
-        return x_disc, x_cont, s, y
-
-    @staticmethod
-    def _make_from_arr(np_array: np.ndarray, index: int) -> Tensor:
-        np_a = np_array[index]
-        return torch.from_numpy(np_a).squeeze()
-
-    @staticmethod
-    def _make_x(disc: np.ndarray, cont: np.ndarray, index: int) -> Tensor:
-        x_disc = disc[index]
-        x_cont = cont[index]
-        x = np.concatenate([x_disc, x_cont], axis=0, dtype=np.float32)
-        x = torch.from_numpy(x)
-        return x
-
-    def _cf_x(self, index: int) -> Tensor:
-        return self._make_x(self.cf_x_disc, self.cf_x_cont, index)
-
-    def _cf_s(self, index: int) -> Tensor:
-        return self._make_from_arr(self.cf_s, index)
-
-    def _cf_y(self, index: int) -> Tensor:
-        return self._make_from_arr(self.cf_y, index)
-
-    def __getitem__(self, index: int) -> CfBatch:
+        x = self._make_x(datatuple)
+        s = _as_tensor(datatuple.s).squeeze(-1)
+        y = _as_tensor(datatuple.y).squeeze(-1)
+        return x, s, y
+
+    def __getitem__(self, index: Index) -> CfBatch:
         return CfBatch(
-            x=super()._x(index),
-            s=super()._s(index),
-            y=super()._y(index),
-            cfx=self._cf_x(index),
-            cfs=self._cf_s(index),
-            cfy=self._cf_y(index),
+            x=self.x[index],
+            s=self.s[index],
+            y=self.y[index],
+            cfx=self.cf_x[index],
+            cfs=self.cf_s[index],
+            cfy=self.cf_y[index],
             iw=self.instance_weight[index],
         )
+
+
+class StratifiedBatchSampler(Sampler[List[int]]):
+    """Yield batches that contain a fixed number of rows from every s (or (s, y)) stratum.
+
+    Every stratum is walked through in a random order that is redrawn once it is exhausted, so
+    that small strata are oversampled. By default each stratum gets an equal share of the batch,
+    with the remainder going one row each to the first strata.
+    """
+
+    def __init__(
+        self,
+        *,
+        s: Tensor,
+        y: Tensor | None,
+        batch_size: int,
+        quotas: Sequence[int] | None = None,
+        seed: int = 0,
+    ):
+        keys = s.long()[:, None] if y is None else torch.stack([s.long(), y.long()], dim=1)
+        _, stratum = torch.unique(keys, dim=0, return_inverse=True)
+        num_strata = int(stratum.max()) + 1
+        self.strata = [(stratum == i).nonzero(as_tuple=True)[0] for i in range(num_strata)]
+        if quotas is None:
+            share, remainder = divmod(batch_size, num_strata)
+            quotas = [share + 1] * remainder + [share] * (num_strata - remainder)
+        if len(quotas) != num_strata:
+            raise ValueError(f"Expected {num_strata} quotas, one per stratum, got {len(quotas)}.")
+        if min(quotas) < 1:
+            raise ValueError(
+                f"Every stratum needs a quota of at least 1, got {list(quotas)}; "
+                f"the batch size must be at least the number of strata ({num_strata})."
+            )
+        self.quotas = list(quotas)
+        self.num_batches = max(s.shape[0] // batch_size, 1)
+        self.generator = torch.Generator().manual_seed(seed)
+
+    def __len__(self) -> int:
+        return self.num_batches
+
+    def __iter__(self) -> Iterator[List[int]]:
+        orders = [members[:0] for members in self.strata]
+        for _ in range(self.num_batches):
+            batch = []
+            for i, (members, quota) in enumerate(zip(self.strata, self.quotas)):
+                while orders[i].shape[0] < quota:
+                    perm = torch.randperm(members.shape[0], generator=self.generator)
+                    orders[i] = torch.cat([orders[i], members[perm]])
+                batch.append(orders[i][:quota])
+                orders[i] = orders[i][quota:]
+            yield torch.cat(batch).tolist()
+
+
+def batched_loader(
+    dataset: DataTupleDatasetBase,
+    *,
+    batch_size: int,
+    shuffle: bool,
+    drop_last: bool,
+    num_workers: int = 0,
+    batch_sampler: Sampler[List[int]] | None = None,
+) -> DataLoader:
+    """Make a DataLoader that fetches whole batches from the dataset with one index per field.
+
+    The batch sampler hands a list of indices to ``dataset.__getitem__``, so no per-row
+    collation happens. A custom ``batch_sampler`` replaces the default random or sequential one.
+    """
+    if batch_sampler is None:
+        sampler: Sampler[int] = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+        batch_sampler = BatchSampler(sampler, batch_size=batch_size, drop_last=drop_last)
+    return DataLoader(
+        dataset,
+        sampler=batch_sampler,
+        batch_size=None,
+        num_workers=num_workers,
+    )
+
+
+class InMemoryLoader:
+    """Iterate over a split that is held as tensors on a single device.
+
+    The whole split is gathered once; each epoch then only draws a permutation and indexes into
+    the resident tensors, so there are no worker processes and no collation.
+    """
+
+    def __init__(
+        self,
+        dataset: DataTupleDatasetBase,
+        *,
+        batch_size: int,
+        shuffle: bool,
+        drop_last: bool,
+        device: torch.device | str = "cpu",
+        batch_sampler: Sampler[List[int]] | None = None,
+    ):
+        self.dataset = dataset
+        self.batch_sampler = batch_sampler
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.device = torch.device(device)
+        data = dataset[:]
+        self.data = type(data)(*(field.to(self.device) for field in data))
+
+    def __len__(self) -> int:
+        if self.batch_sampler is not None:
+            return len(self.batch_sampler)  # type: ignore[arg-type]
+        num_rows = len(self.dataset)
+        if self.drop_last:
+            return num_rows // self.batch_size
+        return math.ceil(num_rows / self.batch_size)
+
+    def __iter__(self) -> Iterator[Batch | CfBatch]:
+        if self.batch_sampler is not None:
+            for indices in self.batch_sampler:
+                index = torch.as_tensor(indices, device=self.device)
+                yield type(self.data)(*(field[index] for field in self.data))
+            return
+        num_rows = len(self.dataset)
+        perm = torch.randperm(num_rows, device=self.device) if self.shuffle else None
+        for i in range(len(self)):
+            start, stop = i * self.batch_size, min((i + 1) * self.batch_size, num_rows)
+            if perm is None:
+                yield type(self.data)(*(field[start:stop] for field in self.data))
+            else:
+                index = perm[start:stop]
+                yield type(self.data)(*(field[index] for field in self.data))
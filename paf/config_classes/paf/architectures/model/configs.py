@@ -26,6 +26,8 @@ class CycleGanConf:
     adv_weight: float = 1.0
     lambda_: float = 10.0
     s_as_input: bool = False
+    pool_batches: bool = True
+    manual_optimisation: bool = False
 
 
 @dataclass
@@ -30,6 +30,9 @@ class AEConf:
     weight_decay: float = MISSING
     debug: bool = MISSING
     batch_size: int = MISSING
+    pool_batches: bool = True
+    mmd_features: int = 1024
+    mmd_resample_every: int = 1
 
 
 @dataclass
@@ -51,3 +54,7 @@ class ClfConf:
     latent_multiplier: int = MISSING
     batch_size: int = MISSING
     debug: bool = MISSING
+    pool_batches: bool = True
+    fuse_mixup: bool = False
+    mmd_features: int = 1024
+    mmd_resample_every: int = 1
@@ -6,6 +6,7 @@
 
 from dataclasses import dataclass, field
 from omegaconf import MISSING
+from typing import List
 from typing import Optional
 from typing import Tuple
 
@@ -22,6 +23,13 @@ class LilliputDataModuleConf:
     eval_batch_size: int = MISSING
     cf_available: bool = True
     train_dims: Optional[Tuple[int, ...]] = None
+    in_memory_loader: bool = False
+    in_memory_device: str = "cpu"
+    cache_dir: Optional[str] = None
+    memory_map: bool = False
+    stratified_batches: bool = False
+    stratify_by_y: bool = False
+    batch_quotas: Optional[List[int]] = None
 
 
 @dataclass
@@ -40,6 +48,13 @@ class ThirdWayDataModuleConf:
     num_hidden_features: int = MISSING
     cf_available: bool = True
     train_dims: Optional[Tuple[int, ...]] = None
+    in_memory_loader: bool = False
+    in_memory_device: str = "cpu"
+    cache_dir: Optional[str] = None
+    memory_map: bool = False
+    stratified_batches: bool = False
+    stratify_by_y: bool = False
+    batch_quotas: Optional[List[int]] = None
 
 
 @dataclass
@@ -53,6 +68,13 @@ class SimpleXDataModuleConf:
     batch_size: int = MISSING
     cf_available: bool = True
     train_dims: Optional[Tuple[int, ...]] = None
+    in_memory_loader: bool = False
+    in_memory_device: str = "cpu"
+    cache_dir: Optional[str] = None
+    memory_map: bool = False
+    stratified_batches: bool = False
+    stratify_by_y: bool = False
+    batch_quotas: Optional[List[int]] = None
 
 
 @dataclass
@@ -65,3 +87,10 @@ class SemiAdultDataModuleConf:
     num_workers: int = MISSING
     sens: str = MISSING
     cf_available: bool = False
+    in_memory_loader: bool = False
+    in_memory_device: str = "cpu"
+    cache_dir: Optional[str] = None
+    memory_map: bool = False
+    stratified_batches: bool = False
+    stratify_by_y: bool = False
+    batch_quotas: Optional[List[int]] = None
@@ -1,6 +1,6 @@
 """Data Module for simple data."""
 from __future__ import annotations
-from typing import Optional, Tuple
+from typing import Any, List, Optional, Tuple
 
 import pytorch_lightning as pl
 from ranzen import implements, parsable
@@ -8,7 +8,7 @@ from sklearn.preprocessing import MinMaxScaler
 from torch.utils.data import DataLoader
 
 from paf.base_templates.base_module import BaseDataModule, CfOutcomes
-from paf.base_templates.dataset_utils import CFDataTupleDataset
+from paf.base_templates.dataset_utils import InMemoryLoader
 from paf.datasets.lilliput import lilliput
 
 __all__ = ["LilliputDataModule"]
@@ -29,11 +29,25 @@ class LilliputDataModule(BaseDataModule):
         eval_batch_size: int,
         cf_available: bool = True,
         train_dims: Optional[Tuple[int, ...]] = None,
+        in_memory_loader: bool = False,
+        in_memory_device: str = "cpu",
+        cache_dir: Optional[str] = None,
+        memory_map: bool = False,
+        stratified_batches: bool = False,
+        stratify_by_y: bool = False,
+        batch_quotas: Optional[List[int]] = None,
     ):
         super().__init__(
             cf_available=cf_available,
             seed=seed,
             scaler=MinMaxScaler(clip=True),
+            in_memory_loader=in_memory_loader,
+            in_memory_device=in_memory_device,
+            cache_dir=cache_dir,
+            memory_map=memory_map,
+            stratified_batches=stratified_batches,
+            stratify_by_y=stratify_by_y,
+            batch_quotas=batch_quotas,
         )
         self.alpha = alpha
         self.gamma = gamma
@@ -43,16 +57,27 @@ class LilliputDataModule(BaseDataModule):
         self.train_batch_size = train_batch_size
         self.eval_batch_size = eval_batch_size
 
+    @implements(BaseDataModule)
+    def cache_params(self) -> dict[str, Any]:
+        return dict(
+            alpha=self.alpha,
+            gamma=self.gamma,
+            seed=self.seed,
+            num_samples=self.num_samples,
+        )
+
     @implements(pl.LightningDataModule)
     def prepare_data(self) -> None:
         # called only on 1 GPU
+        if self.load_from_cache():
+            return
         cf_data = lilliput(
             seed=self.seed, alpha=self.alpha, num_samples=self.num_samples, gamma=self.gamma
         )
 
-        dts = self.scale_and_split(cf_data.data, cf_data.dataset)
-        true_dts = self.scale_and_split(cf_data.data_true_outcome, cf_data.dataset)
-        cf_dts = self.scale_and_split(cf_data.cf_data, cf_data.dataset)
+        dts, true_dts, cf_dts = self.scale_and_split_worlds(
+            [cf_data.data, cf_data.data_true_outcome, cf_data.cf_data], cf_data.dataset
+        )
 
         cf_outcomes = CfOutcomes(
             s0_s0=cf_data.data_xs0_ys0,
@@ -70,51 +95,40 @@ class LilliputDataModule(BaseDataModule):
             best_guess=cf_data.cf_groups,
             cf_outcomes=cf_outcomes,
         )
+        self.save_to_cache()
 
     @implements(BaseDataModule)
-    def _train_dataloader(self, *, shuffle: bool = True, drop_last: bool = True) -> DataLoader:
-        assert self.cf_data_group is not None
-        return DataLoader(
-            CFDataTupleDataset(
-                dataset=self.data_group.train,
-                cf_dataset=self.cf_data_group.train,
-                disc_features=self.dataset.discrete_features,
-                cont_features=self.dataset.continuous_features,
-            ),
+    def _train_dataloader(
+        self, *, shuffle: bool = True, drop_last: bool = True
+    ) -> DataLoader | InMemoryLoader:
+        return self.make_dataloader(
+            self.split_dataset("train", cf=True),
             batch_size=self.train_batch_size,
-            num_workers=self.num_workers,
             shuffle=shuffle,
             drop_last=drop_last,
+            num_workers=self.num_workers,
         )
 
     @implements(BaseDataModule)
-    def _val_dataloader(self, *, shuffle: bool = False, drop_last: bool = False) -> DataLoader:
-        assert self.cf_data_group is not None
-        return DataLoader(
-            CFDataTupleDataset(
-                dataset=self.data_group.val,
-                cf_dataset=self.cf_data_group.val,
-                disc_features=self.dataset.discrete_features,
-                cont_features=self.dataset.continuous_features,
-            ),
+    def _val_dataloader(
+        self, *, shuffle: bool = False, drop_last: bool = False
+    ) -> DataLoader | InMemoryLoader:
+        return self.make_dataloader(
+            self.split_dataset("val", cf=True),
             batch_size=self.eval_batch_size,
-            num_workers=self.num_workers,
             shuffle=shuffle,
             drop_last=drop_last,
+            num_workers=self.num_workers,
         )
 
     @implements(BaseDataModule)
-    def _test_dataloader(self, *, shuffle: bool = False, drop_last: bool = False) -> DataLoader:
-        assert self.cf_data_group is not None
-        return DataLoader(
-            CFDataTupleDataset(
-                dataset=self.data_group.test,
-                cf_dataset=self.cf_data_group.test,
-                disc_features=self.dataset.discrete_features,
-                cont_features=self.dataset.continuous_features,
-            ),
+    def _test_dataloader(
+        self, *, shuffle: bool = False, drop_last: bool = False
+    ) -> DataLoader | InMemoryLoader:
+        return self.make_dataloader(
+            self.split_dataset("test", cf=True),
             batch_size=self.eval_batch_size,
-            num_workers=self.num_workers,
             shuffle=shuffle,
             drop_last=drop_last,
+            num_workers=self.num_workers,
         )
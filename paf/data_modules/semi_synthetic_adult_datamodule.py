@@ -1,5 +1,6 @@
 """Adult Dataset DataModule."""
 from __future__ import annotations
+from typing import Any, List, Optional
 
 import pytorch_lightning as pl
 from ranzen import implements, parsable
@@ -7,7 +8,7 @@ from sklearn.preprocessing import MinMaxScaler
 from torch.utils.data import DataLoader
 
 from paf.base_templates.base_module import BaseDataModule
-from paf.base_templates.dataset_utils import DataTupleDataset
+from paf.base_templates.dataset_utils import InMemoryLoader
 from paf.datasets.ethicml_datasets import semi_adult_data
 
 __all__ = ["SemiAdultDataModule"]
@@ -26,16 +27,40 @@ class SemiAdultDataModule(BaseDataModule):
         num_workers: int,
         sens: str,
         cf_available: bool = False,
+        in_memory_loader: bool = False,
+        in_memory_device: str = "cpu",
+        cache_dir: Optional[str] = None,
+        memory_map: bool = False,
+        stratified_batches: bool = False,
+        stratify_by_y: bool = False,
+        batch_quotas: Optional[List[int]] = None,
     ):
-        super().__init__(cf_available=cf_available, seed=seed, scaler=MinMaxScaler())
+        super().__init__(
+            cf_available=cf_available,
+            seed=seed,
+            scaler=MinMaxScaler(),
+            in_memory_loader=in_memory_loader,
+            in_memory_device=in_memory_device,
+            cache_dir=cache_dir,
+            memory_map=memory_map,
+            stratified_batches=stratified_batches,
+            stratify_by_y=stratify_by_y,
+            batch_quotas=batch_quotas,
+        )
         self.batch_size = batch_size
         self.bin_nat = bin_nat
         self.bin_race = bin_race
         self.num_workers = num_workers
         self.sens = sens
 
+    @implements(BaseDataModule)
+    def cache_params(self) -> dict[str, Any]:
+        return dict(seed=self.seed)
+
     @implements(pl.LightningDataModule)
     def prepare_data(self) -> None:
+        if self.load_from_cache():
+            return
         dataset, factual_data = semi_adult_data()
 
         self.set_data_values(
@@ -46,45 +71,40 @@ class SemiAdultDataModule(BaseDataModule):
             cf_dts=None,
             true_dts=None,
         )
+        self.save_to_cache()
 
     @implements(BaseDataModule)
-    def _train_dataloader(self, *, shuffle: bool = False, drop_last: bool = False) -> DataLoader:
-        return DataLoader(
-            DataTupleDataset(
-                dataset=self.data_group.train,
-                disc_features=self.dataset.discrete_features,
-                cont_features=self.dataset.continuous_features,
-            ),
+    def _train_dataloader(
+        self, *, shuffle: bool = False, drop_last: bool = False
+    ) -> DataLoader | InMemoryLoader:
+        return self.make_dataloader(
+            self.split_dataset("train", cf=False),
             batch_size=self.batch_size,
-            num_workers=self.num_workers,
             shuffle=shuffle,
             drop_last=drop_last,
+            num_workers=self.num_workers,
         )
 
     @implements(BaseDataModule)
-    def _val_dataloader(self, *, shuffle: bool = False, drop_last: bool = False) -> DataLoader:
-        return DataLoader(
-            DataTupleDataset(
-                dataset=self.data_group.val,
-                disc_features=self.dataset.discrete_features,
-                cont_features=self.dataset.continuous_features,
-            ),
+    def _val_dataloader(
+        self, *, shuffle: bool = False, drop_last: bool = False
+    ) -> DataLoader | InMemoryLoader:
+        return self.make_dataloader(
+            self.split_dataset("val", cf=False),
             batch_size=self.batch_size,
-            num_workers=self.num_workers,
             shuffle=shuffle,
             drop_last=drop_last,
+            num_workers=self.num_workers,
         )
 
     @implements(BaseDataModule)
-    def _test_dataloader(self, *, shuffle: bool = False, drop_last: bool = False) -> DataLoader:
-        return DataLoader(
-            DataTupleDataset(
-                dataset=self.data_group.test,
-                disc_features=self.dataset.discrete_features,
-                cont_features=self.dataset.continuous_features,
-            ),
+    def _test_dataloader(
+        self, *, shuffle: bool = False, drop_last: bool = False
+    ) -> DataLoader | InMemoryLoader:
+        return self.make_dataloader(
+            self.split_dataset("test", cf=False),
             batch_size=self.batch_size,
-            num_workers=self.num_workers,
             shuffle=shuffle,
             drop_last=drop_last,
+            num_workers=self.num_workers,
         )
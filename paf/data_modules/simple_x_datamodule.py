@@ -1,6 +1,6 @@
 """Data Module for simple data."""
 from __future__ import annotations
-from typing import Optional, Tuple
+from typing import Any, List, Optional, Tuple
 
 import pytorch_lightning as pl
 from ranzen import implements, parsable
@@ -8,7 +8,7 @@ from sklearn.preprocessing import MinMaxScaler
 from torch.utils.data import DataLoader
 
 from paf.base_templates.base_module import BaseDataModule
-from paf.base_templates.dataset_utils import CFDataTupleDataset
+from paf.base_templates.dataset_utils import InMemoryLoader
 from paf.datasets.simple_x import simple_x_data
 
 __all__ = ["SimpleXDataModule"]
@@ -28,8 +28,26 @@ class SimpleXDataModule(BaseDataModule):
         batch_size: int,
         cf_available: bool = True,
         train_dims: Optional[Tuple[int, ...]] = None,
+        in_memory_loader: bool = False,
+        in_memory_device: str = "cpu",
+        cache_dir: Optional[str] = None,
+        memory_map: bool = False,
+        stratified_batches: bool = False,
+        stratify_by_y: bool = False,
+        batch_quotas: Optional[List[int]] = None,
     ):
-        super().__init__(cf_available=cf_available, seed=seed, scaler=MinMaxScaler())
+        super().__init__(
+            cf_available=cf_available,
+            seed=seed,
+            scaler=MinMaxScaler(),
+            in_memory_loader=in_memory_loader,
+            in_memory_device=in_memory_device,
+            cache_dir=cache_dir,
+            memory_map=memory_map,
+            stratified_batches=stratified_batches,
+            stratify_by_y=stratify_by_y,
+            batch_quotas=batch_quotas,
+        )
         self.alpha = alpha
         self.gamma = gamma
         self.num_samples = num_samples
@@ -37,9 +55,20 @@ class SimpleXDataModule(BaseDataModule):
         self.num_workers = num_workers
         self.batch_size = batch_size
 
+    @implements(BaseDataModule)
+    def cache_params(self) -> dict[str, Any]:
+        return dict(
+            alpha=self.alpha,
+            gamma=self.gamma,
+            seed=self.seed,
+            num_samples=self.num_samples,
+        )
+
     @implements(pl.LightningDataModule)
     def prepare_data(self) -> None:
         # called only on 1 GPU
+        if self.load_from_cache():
+            return
         data = simple_x_data(
             seed=self.seed,
             num_samples=self.num_samples,
@@ -49,9 +78,9 @@ class SimpleXDataModule(BaseDataModule):
             binary_s=1,
         )
 
-        dts = self.scale_and_split(data.true, data.dataset)
-        true_dts = self.scale_and_split(data.true_outcomes, data.dataset)
-        cf_dts = self.scale_and_split(data.cf, data.dataset)
+        dts, true_dts, cf_dts = self.scale_and_split_worlds(
+            [data.true, data.true_outcomes, data.cf], data.dataset
+        )
 
         self.set_data_values(
             dataset=data.dataset,
@@ -61,51 +90,40 @@ class SimpleXDataModule(BaseDataModule):
             true_dts=true_dts,
             cf_dts=cf_dts,
         )
+        self.save_to_cache()
 
     @implements(BaseDataModule)
-    def _train_dataloader(self, *, shuffle: bool = True, drop_last: bool = True) -> DataLoader:
-        assert self.cf_data_group is not None
-        return DataLoader(
-            CFDataTupleDataset(
-                self.data_group.train,
-                cf_dataset=self.cf_data_group.train,
-                disc_features=self.dataset.discrete_features,
-                cont_features=self.dataset.continuous_features,
-            ),
+    def _train_dataloader(
+        self, *, shuffle: bool = True, drop_last: bool = True
+    ) -> DataLoader | InMemoryLoader:
+        return self.make_dataloader(
+            self.split_dataset("train", cf=True),
             batch_size=self.batch_size,
-            num_workers=self.num_workers,
             shuffle=shuffle,
             drop_last=drop_last,
+            num_workers=self.num_workers,
         )
 
     @implements(BaseDataModule)
-    def _val_dataloader(self, *, shuffle: bool = False, drop_last: bool = False) -> DataLoader:
-        assert self.cf_data_group is not None
-        return DataLoader(
-            CFDataTupleDataset(
-                self.data_group.val,
-                cf_dataset=self.cf_data_group.val,
-                disc_features=self.dataset.discrete_features,
-                cont_features=self.dataset.continuous_features,
-            ),
+    def _val_dataloader(
+        self, *, shuffle: bool = False, drop_last: bool = False
+    ) -> DataLoader | InMemoryLoader:
+        return self.make_dataloader(
+            self.split_dataset("val", cf=True),
             batch_size=self.batch_size,
-            num_workers=self.num_workers,
             shuffle=shuffle,
             drop_last=drop_last,
+            num_workers=self.num_workers,
         )
 
     @implements(BaseDataModule)
-    def _test_dataloader(self, *, shuffle: bool = False, drop_last: bool = False) -> DataLoader:
-        assert self.cf_data_group is not None
-        return DataLoader(
-            CFDataTupleDataset(
-                self.data_group.test,
-                cf_dataset=self.cf_data_group.test,
-                disc_features=self.dataset.discrete_features,
-                cont_features=self.dataset.continuous_features,
-            ),
+    def _test_dataloader(
+        self, *, shuffle: bool = False, drop_last: bool = False
+    ) -> DataLoader | InMemoryLoader:
+        return self.make_dataloader(
+            self.split_dataset("test", cf=True),
             batch_size=self.batch_size,
-            num_workers=self.num_workers,
             shuffle=shuffle,
             drop_last=drop_last,
+            num_workers=self.num_workers,
         )
@@ -1,7 +1,7 @@
 """Data Module for simple data."""
 from __future__ import annotations
 import logging
-from typing import Optional, Tuple
+from typing import Any, List, Optional, Tuple
 
 from ethicml import Dataset, DataTuple
 import pandas as pd
@@ -11,7 +11,7 @@ from sklearn.preprocessing import MinMaxScaler
 from torch.utils.data import DataLoader
 
 from paf.base_templates.base_module import BaseDataModule
-from paf.base_templates.dataset_utils import CFDataTupleDataset
+from paf.base_templates.dataset_utils import InMemoryLoader
 from paf.datasets.third_way import third_way_data
 from paf.selection import selection_rules
 from paf.utils import facct_mapper
@@ -59,8 +59,26 @@ class ThirdWayDataModule(BaseDataModule):
         num_hidden_features: int,
         cf_available: bool = True,
         train_dims: Optional[Tuple[int, ...]] = None,
+        in_memory_loader: bool = False,
+        in_memory_device: str = "cpu",
+        cache_dir: Optional[str] = None,
+        memory_map: bool = False,
+        stratified_batches: bool = False,
+        stratify_by_y: bool = False,
+        batch_quotas: Optional[List[int]] = None,
     ):
-        super().__init__(cf_available=cf_available, seed=seed, scaler=MinMaxScaler())
+        super().__init__(
+            cf_available=cf_available,
+            seed=seed,
+            scaler=MinMaxScaler(),
+            in_memory_loader=in_memory_loader,
+            in_memory_device=in_memory_device,
+            cache_dir=cache_dir,
+            memory_map=memory_map,
+            stratified_batches=stratified_batches,
+            stratify_by_y=stratify_by_y,
+            batch_quotas=batch_quotas,
+        )
         self.acceptance_rate = acceptance_rate
         self.alpha = alpha
         self.beta = beta
@@ -73,9 +91,25 @@ class ThirdWayDataModule(BaseDataModule):
         self.xi = xi
         self.num_hidden_features = num_hidden_features
 
+    @implements(BaseDataModule)
+    def cache_params(self) -> dict[str, Any]:
+        return dict(
+            acceptance_rate=self.acceptance_rate,
+            alpha=self.alpha,
+            beta=self.beta,
+            gamma=self.gamma,
+            seed=self.seed,
+            num_samples=self.num_samples,
+            num_features=self.num_features,
+            xi=self.xi,
+            num_hidden_features=self.num_hidden_features,
+        )
+
     @implements(pl.LightningDataModule)
     def prepare_data(self) -> None:
         # called only on 1 GPU
+        if self.load_from_cache():
+            return
         data = third_way_data(
             seed=self.seed,
             num_samples=self.num_samples,
@@ -90,9 +124,26 @@ class ThirdWayDataModule(BaseDataModule):
             num_hidden_features=self.num_hidden_features,
         )
 
-        dts = self.scale_and_split(data.data, data.dataset)
-        true_dts = self.scale_and_split(data.data_true_outcome, data.dataset)
-        cf_dts = self.scale_and_split(data.cf_data, data.dataset)
+        (
+            dts,
+            true_dts,
+            cf_dts,
+            s10s20_dts,
+            s10s21_dts,
+            s11s20_dts,
+            s11s21_dts,
+        ) = self.scale_and_split_worlds(
+            [
+                data.data,
+                data.data_true_outcome,
+                data.cf_data,
+                data.data_xs0_ys0,
+                data.data_xs0_ys1,
+                data.data_xs1_ys0,
+                data.data_xs1_ys1,
+            ],
+            data.dataset,
+        )
 
         self.set_data_values(
             dataset=data.dataset,
@@ -103,13 +154,9 @@ class ThirdWayDataModule(BaseDataModule):
             dts=dts,
         )
 
-        s10s20_dts = self.scale_and_split(data.data_xs0_ys0, data.dataset)
         s1_0_s2_0_test = s10s20_dts.test
-        s10s21_dts = self.scale_and_split(data.data_xs0_ys1, data.dataset)
         s1_0_s2_1_test = s10s21_dts.test
-        s11s20_dts = self.scale_and_split(data.data_xs1_ys0, data.dataset)
         s1_1_s2_0_test = s11s20_dts.test
-        s11s21_dts = self.scale_and_split(data.data_xs1_ys1, data.dataset)
         s1_1_s2_1_test = s11s21_dts.test
 
         pd_results = pd.concat(
@@ -128,48 +175,40 @@ class ThirdWayDataModule(BaseDataModule):
         pd_results["decision"] = selection_rules(pd_results)
         log.info(pd_results["decision"].value_counts())
         log.info(facct_mapper(pd.Series(pd_results["decision"])))
+        self.save_to_cache()
 
     @implements(BaseDataModule)
-    def _train_dataloader(self, *, shuffle: bool = False, drop_last: bool = False) -> DataLoader:
-        return DataLoader(
-            CFDataTupleDataset(
-                self.train_datatuple,
-                cf_dataset=self.cf_train_datatuple,
-                disc_features=self.dataset.discrete_features,
-                cont_features=self.dataset.continuous_features,
-            ),
-            num_workers=self.num_workers,
+    def _train_dataloader(
+        self, *, shuffle: bool = False, drop_last: bool = False
+    ) -> DataLoader | InMemoryLoader:
+        return self.make_dataloader(
+            self.split_dataset("train", cf=True),
             batch_size=self.batch_size,
             shuffle=shuffle,
             drop_last=drop_last,
+            num_workers=self.num_workers,
         )
 
     @implements(BaseDataModule)
-    def _val_dataloader(self, *, shuffle: bool = False, drop_last: bool = False) -> DataLoader:
-        return DataLoader(
-            CFDataTupleDataset(
-                dataset=self.val_datatuple,
-                cf_dataset=self.cf_val_datatuple,
-                cont_features=self.dataset.continuous_features,
-                disc_features=self.dataset.discrete_features,
-            ),
+    def _val_dataloader(
+        self, *, shuffle: bool = False, drop_last: bool = False
+    ) -> DataLoader | InMemoryLoader:
+        return self.make_dataloader(
+            self.split_dataset("val", cf=True),
             batch_size=self.batch_size,
-            num_workers=self.num_workers,
-            drop_last=drop_last,
             shuffle=shuffle,
+            drop_last=drop_last,
+            num_workers=self.num_workers,
         )
 
     @implements(BaseDataModule)
-    def _test_dataloader(self, *, shuffle: bool = False, drop_last: bool = False) -> DataLoader:
-        return DataLoader(
-            CFDataTupleDataset(
-                self.data_group.test,
-                cf_dataset=self.cf_test_datatuple,
-                disc_features=self.dataset.discrete_features,
-                cont_features=self.dataset.continuous_features,
-            ),
+    def _test_dataloader(
+        self, *, shuffle: bool = False, drop_last: bool = False
+    ) -> DataLoader | InMemoryLoader:
+        return self.make_dataloader(
+            self.split_dataset("test", cf=True),
             batch_size=self.batch_size,
-            num_workers=self.num_workers,
             shuffle=shuffle,
             drop_last=drop_last,
+            num_workers=self.num_workers,
         )
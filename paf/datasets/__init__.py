@@ -2,4 +2,5 @@
 from .ethicml_datasets import *
 from .lilliput import *
 from .simple_x import *
+from .streaming import *
 from .third_way import *
@@ -12,7 +12,7 @@ from scipy import stats
 
 from paf.selection import produce_selection_groups
 
-__all__ = ["CfData", "lilliput"]
+__all__ = ["CfData", "lilliput", "lilliput_dataset"]
 
 LOGGER = logging.getLogger(__name__)
 
@@ -29,15 +29,64 @@ class CfData(NamedTuple):
     data_xs1_ys1: DataTuple
 
 
-def lilliput(*, seed: int, num_samples: int, alpha: float, gamma: float) -> CfData:
-    """Make the `lilliput` dataset."""
-    num_gen = np.random.default_rng(seed)
-
+def _round2(values: np.ndarray) -> np.ndarray:
+    """Round to two decimal places in the same way as the builtin ``round``.
+
+    ``np.round`` scales by 100 before rounding, so it can disagree with ``round`` for values
+    within floating point error of a tie. Those few entries fall back to the builtin.
+    """
+    rounded = values.round(2)
+    scaled = values * 100
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    rounded[near_tie] = [round(value, 2) for value in values[near_tie].tolist()]
+    return rounded
+
+
+def _screen(admittance_score: np.ndarray) -> tuple[np.ndarray, float]:
+    """Accept the top 20% by admittance score, returning the decisions and the cut-off."""
+    score = pd.Series(admittance_score)
+    passed_initial_screening = score.nlargest(n=int(score.shape[0] * 0.2))
+    passed = np.zeros(score.shape[0], dtype=bool)
+    passed[passed_initial_screening.index.to_numpy()] = True
+    accepted = (passed & (admittance_score > 0)).astype(int)
+    return accepted, passed_initial_screening.min()
+
+
+class _LilliputArrays(NamedTuple):
+    """Features of the factual, counterfactual, all s=0 and all s=1 worlds, in that order."""
+
+    s: np.ndarray
+    potions_score: np.ndarray
+    potions_bane: np.ndarray
+    potions_wolf: np.ndarray
+    video_score: np.ndarray
+    video_bane: np.ndarray
+    video_wolf: np.ndarray
+    essay_score: np.ndarray
+    essay_bane: np.ndarray
+    essay_wolf: np.ndarray
+    admittance_score: np.ndarray  # factual and counterfactual worlds only
+    sy0_admittance_score: np.ndarray  # all s=0 and all s=1 worlds only
+    sy1_admittance_score: np.ndarray  # all s=0 and all s=1 worlds only
+    graduation_grade: np.ndarray
+
+
+SY0_AD_SCORE = "Sy=0_admittance_score"
+SY1_AD_SCORE = "Sy=1_admittance_score"
+GRAD_MT_60 = "graduation_grade>60%"
+GRAD_MT_70 = "graduation_grade>70%"
+
+
+def _lilliput_arrays(
+    num_gen: np.random.Generator, *, num_samples: int, alpha: float, gamma: float
+) -> _LilliputArrays:
+    """Draw the lilliput features for every world at once; axis 0 indexes the worlds."""
     # Green is 1, Blue is 0
     s = num_gen.binomial(1, alpha, num_samples)
     cf_s: npt.NDArray[np.int_] = np.ones_like(s) - s
     s_all_0 = np.zeros_like(s)
     s_all_1 = np.ones_like(s)
+    s_worlds = np.stack([s, cf_s, s_all_0, s_all_1])
 
     potions_percent = num_gen.random(len(s))
 
@@ -47,54 +96,24 @@ def lilliput(*, seed: int, num_samples: int, alpha: float, gamma: float) -> CfDa
     potions_score_skw = (
         stats.johnsonsu.ppf(potions_percent, a=-2, b=3, loc=0.35, scale=0.2).round(2).clip(0, 1)
     )
-
-    potions_score = np.where(s == 0, potions_score_skw, potions_score_nrm)
-    cf_potions_score = np.where(s == 1, potions_score_skw, potions_score_nrm)
-    potions_score_all_0 = potions_score_skw
-    potions_score_all_1 = potions_score_nrm
+    potions_score = np.where(s_worlds == 0, potions_score_skw, potions_score_nrm)
 
     pot_bane_err = num_gen.normal(0.03, 0.02, len(s)).clip(0, 1)
-    potions_bane = (potions_score + pot_bane_err * ((2 * s) - 1)).round(2).clip(0, 1)
-    cf_potions_bane = (cf_potions_score + pot_bane_err * ((2 * cf_s) - 1)).round(2).clip(0, 1)
-    potions_bane_all_0 = (
-        (potions_score_all_0 + pot_bane_err * ((2 * s_all_0) - 1)).round(2).clip(0, 1)
-    )
-    potions_bane_all_1 = (
-        (potions_score_all_1 + pot_bane_err * ((2 * s_all_1) - 1)).round(2).clip(0, 1)
-    )
+    potions_bane = (potions_score + pot_bane_err * ((2 * s_worlds) - 1)).round(2).clip(0, 1)
 
     pot_wolf_err = num_gen.normal(0.01, 0.04, len(s)).clip(0, 1)
-    potions_wolf = (potions_score + pot_wolf_err * ((2 * s) - 1)).round(2).clip(0, 1)
-    cf_potions_wolf = (cf_potions_score + pot_wolf_err * ((2 * cf_s) - 1)).round(2).clip(0, 1)
-    potions_wolf_all_0 = (
-        (potions_score_all_0 + pot_wolf_err * ((2 * s_all_0) - 1)).round(2).clip(0, 1)
-    )
-    potions_wolf_all_1 = (
-        (potions_score_all_1 + pot_wolf_err * ((2 * s_all_1) - 1)).round(2).clip(0, 1)
-    )
+    potions_wolf = (potions_score + pot_wolf_err * ((2 * s_worlds) - 1)).round(2).clip(0, 1)
 
-    video_mean = 0.4 + 0.01 * (s * 2 - 1)
-    cf_video_mean = 0.4 + 0.01 * (cf_s * 2 - 1)
-    video_mean_all_0 = 0.4 + 0.01 * (s_all_0 * 2 - 1)
-    video_mean_all_1 = 0.4 + 0.01 * (s_all_1 * 2 - 1)
+    video_mean = 0.4 + 0.01 * (s_worlds * 2 - 1)
 
     vid_score_nrm = num_gen.normal(0, 0.2, len(s))
     video_score: np.ndarray = video_mean + vid_score_nrm
-    cf_video_score: np.ndarray = cf_video_mean + vid_score_nrm
-    video_score_all_0: np.ndarray = video_mean_all_0 + vid_score_nrm
-    video_score_all_1: np.ndarray = video_mean_all_1 + vid_score_nrm
 
     vid_bane_err = num_gen.normal(0, 0.02, len(s)).clip(0, 1)
     video_bane = (video_score + vid_bane_err).round(2).clip(0, 1)
-    cf_video_bane = (cf_video_score + vid_bane_err).round(2).clip(0, 1)
-    video_bane_all_0 = (video_score_all_0 + vid_bane_err).round(2).clip(0, 1)
-    video_bane_all_1 = (video_score_all_1 + vid_bane_err).round(2).clip(0, 1)
 
     vid_wolf_err = num_gen.normal(0, 0.05, len(s)).clip(0, 1)
     video_wolf = (video_score + vid_wolf_err).round(2).clip(0, 1)
-    cf_video_wolf = (cf_video_score + vid_wolf_err).round(2).clip(0, 1)
-    video_wolf_all_0 = (video_score_all_0 + vid_wolf_err).round(2).clip(0, 1)
-    video_wolf_all_1 = (video_score_all_1 + vid_wolf_err).round(2).clip(0, 1)
 
     random_nums = num_gen.random(len(s))
 
@@ -102,278 +121,105 @@ def lilliput(*, seed: int, num_samples: int, alpha: float, gamma: float) -> CfDa
         scipy.stats.t.ppf(random_nums, df=100, loc=0.4, scale=0.15).round(2).clip(0, 1)
     )
     essay_score_lap = scipy.stats.laplace.ppf(random_nums, loc=0.5, scale=0.075).round(2).clip(0, 1)
-
-    essay_score = np.where(s == 1, essay_score_lap, essay_score_vnm)
-    cf_essay_score = np.where(s == 0, essay_score_lap, essay_score_vnm)
-    essay_score_all_0 = essay_score_lap
-    essay_score_all_1 = essay_score_vnm
+    essay_score = np.stack(
+        [
+            np.where(s == 1, essay_score_lap, essay_score_vnm),
+            np.where(s == 0, essay_score_lap, essay_score_vnm),
+            essay_score_lap,
+            essay_score_vnm,
+        ]
+    )
 
     ess_bane_err = num_gen.normal(0.03, 0.01, len(s)).clip(0, 1)
     essay_bane = (essay_score + ess_bane_err).round(2).clip(0, 1)
-    cf_essay_bane = (cf_essay_score + ess_bane_err).round(2).clip(0, 1)
-    essay_bane_all_0 = (essay_score_all_0 + ess_bane_err).round(2).clip(0, 1)
-    essay_bane_all_1 = (essay_score_all_1 + ess_bane_err).round(2).clip(0, 1)
 
     ess_wolf_err = num_gen.normal(0.01, 0.02, len(s)).clip(0, 1)
     essay_wolf = (essay_score + ess_wolf_err).round(2).clip(0, 1)
-    cf_essay_wolf = (cf_essay_score + ess_wolf_err).round(2).clip(0, 1)
-    essay_wolf_all_0 = (essay_score_all_0 + ess_wolf_err).round(2).clip(0, 1)
-    essay_wolf_all_1 = (essay_score_all_1 + ess_wolf_err).round(2).clip(0, 1)
-
-    potions_score = pd.DataFrame(potions_score, columns=["potions_score"])
-    potions_bane = pd.DataFrame(potions_bane, columns=["potions_bane"])
-    potions_wolf = pd.DataFrame(potions_wolf, columns=["potions_wolf"])
-
-    potions_score_all_0 = pd.DataFrame(potions_score_all_0, columns=["potions_score"])
-    potions_bane_all_0 = pd.DataFrame(potions_bane_all_0, columns=["potions_bane"])
-    potions_wolf_all_0 = pd.DataFrame(potions_wolf_all_0, columns=["potions_wolf"])
-
-    potions_score_all_1 = pd.DataFrame(potions_score_all_1, columns=["potions_score"])
-    potions_bane_all_1 = pd.DataFrame(potions_bane_all_1, columns=["potions_bane"])
-    potions_wolf_all_1 = pd.DataFrame(potions_wolf_all_1, columns=["potions_wolf"])
-
-    cf_potions_score = pd.DataFrame(cf_potions_score, columns=["potions_score"])
-    cf_potions_bane = pd.DataFrame(cf_potions_bane, columns=["potions_bane"])
-    cf_potions_wolf = pd.DataFrame(cf_potions_wolf, columns=["potions_wolf"])
-
-    video_score = pd.DataFrame(video_score, columns=["video_score"])
-    video_bane = pd.DataFrame(video_bane, columns=["video_bane"])
-    video_wolf = pd.DataFrame(video_wolf, columns=["video_wolf"])
-
-    video_score_all_0 = pd.DataFrame(video_score_all_0, columns=["video_score"])
-    video_bane_all_0 = pd.DataFrame(video_bane_all_0, columns=["video_bane"])
-    video_wolf_all_0 = pd.DataFrame(video_wolf_all_0, columns=["video_wolf"])
-
-    video_score_all_1 = pd.DataFrame(video_score_all_1, columns=["video_score"])
-    video_bane_all_1 = pd.DataFrame(video_bane_all_1, columns=["video_bane"])
-    video_wolf_all_1 = pd.DataFrame(video_wolf_all_1, columns=["video_wolf"])
-
-    cf_video_score = pd.DataFrame(cf_video_score, columns=["video_score"])
-    cf_video_bane = pd.DataFrame(cf_video_bane, columns=["video_bane"])
-    cf_video_wolf = pd.DataFrame(cf_video_wolf, columns=["video_wolf"])
-
-    essay_score = pd.DataFrame(essay_score, columns=["essay_score"])
-    essay_bane = pd.DataFrame(essay_bane, columns=["essay_bane"])
-    essay_wolf = pd.DataFrame(essay_wolf, columns=["essay_wolf"])
-
-    essay_score_all_0 = pd.DataFrame(essay_score_all_0, columns=["essay_score"])
-    essay_bane_all_0 = pd.DataFrame(essay_bane_all_0, columns=["essay_bane"])
-    essay_wolf_all_0 = pd.DataFrame(essay_wolf_all_0, columns=["essay_wolf"])
-
-    essay_score_all_1 = pd.DataFrame(essay_score_all_1, columns=["essay_score"])
-    essay_bane_all_1 = pd.DataFrame(essay_bane_all_1, columns=["essay_bane"])
-    essay_wolf_all_1 = pd.DataFrame(essay_wolf_all_1, columns=["essay_wolf"])
-
-    cf_essay_score = pd.DataFrame(cf_essay_score, columns=["essay_score"])
-    cf_essay_bane = pd.DataFrame(cf_essay_bane, columns=["essay_bane"])
-    cf_essay_wolf = pd.DataFrame(cf_essay_wolf, columns=["essay_wolf"])
-
-    s = pd.DataFrame(s, columns=["sens"])
-    s_all_0 = pd.DataFrame(s_all_0, columns=["sens"])
-    s_all_1 = pd.DataFrame(s_all_1, columns=["sens"])
-    cf_s = pd.DataFrame(cf_s, columns=["sens"])
-    data = pd.concat(
-        [
-            potions_score,
-            potions_bane,
-            potions_wolf,
-            s,
-            video_score,
-            video_bane,
-            video_wolf,
-            essay_score,
-            essay_bane,
-            essay_wolf,
-        ],
-        axis=1,
-    )
 
-    data_all_0 = pd.concat(
-        [
-            potions_score_all_0,
-            potions_bane_all_0,
-            potions_wolf_all_0,
-            s_all_0,
-            video_score_all_0,
-            video_bane_all_0,
-            video_wolf_all_0,
-            essay_score_all_0,
-            essay_bane_all_0,
-            essay_wolf_all_0,
-        ],
-        axis=1,
+    base_score = (
+        0.4 * ((potions_bane + potions_wolf) / 2)
+        + 0.4 * ((video_bane + video_wolf) / 2)
+        + 0.2 * ((essay_bane + essay_wolf) / 2)
     )
+    admittance_score = base_score[:2].round(2)
+    sy0_admittance_score = (base_score[2:] + gamma * ((2 * s_all_0) - 1)).round(2)
+    sy1_admittance_score = (base_score[2:] + gamma * ((2 * s_all_1) - 1)).round(2)
 
-    data_all_1 = pd.concat(
+    graduation_sy0 = 0.3 * potions_score + 0.25 * video_score + 0.45 * essay_score
+    graduation_sy1 = 0.1 * potions_score + 0.7 * video_score + 0.2 * essay_score
+    graduation_grade = np.concatenate(
         [
-            potions_score_all_1,
-            potions_bane_all_1,
-            potions_wolf_all_1,
-            s_all_1,
-            video_score_all_1,
-            video_bane_all_1,
-            video_wolf_all_1,
-            essay_score_all_1,
-            essay_bane_all_1,
-            essay_wolf_all_1,
-        ],
-        axis=1,
+            _round2(np.where(s_worlds[:2] == 0, graduation_sy0[:2], graduation_sy1[:2])),
+            graduation_sy0[2:3].round(2),
+            graduation_sy1[3:4].round(2),
+        ]
     )
 
-    cf_data = pd.concat(
-        [
-            cf_potions_score,
-            cf_potions_bane,
-            cf_potions_wolf,
-            cf_s,
-            cf_video_score,
-            cf_video_bane,
-            cf_video_wolf,
-            cf_essay_score,
-            cf_essay_bane,
-            cf_essay_wolf,
-        ],
-        axis=1,
+    return _LilliputArrays(
+        s=s_worlds,
+        potions_score=potions_score,
+        potions_bane=potions_bane,
+        potions_wolf=potions_wolf,
+        video_score=video_score,
+        video_bane=video_bane,
+        video_wolf=video_wolf,
+        essay_score=essay_score,
+        essay_bane=essay_bane,
+        essay_wolf=essay_wolf,
+        admittance_score=admittance_score,
+        sy0_admittance_score=sy0_admittance_score,
+        sy1_admittance_score=sy1_admittance_score,
+        graduation_grade=graduation_grade,
     )
 
-    data["admittance_score"] = (
-        0.4 * ((data["potions_bane"] + data["potions_wolf"]) / 2)
-        + 0.4 * ((data["video_bane"] + data["video_wolf"]) / 2)
-        + 0.2 * ((data["essay_bane"] + data["essay_wolf"]) / 2)
-        # + gamma * ((2 * data["sens"]) - 1)
-        # + gamma * data["sens"]
-    ).round(2)
-
-    cf_data["admittance_score"] = (
-        0.4 * ((cf_data["potions_bane"] + cf_data["potions_wolf"]) / 2)
-        + 0.4 * ((cf_data["video_bane"] + cf_data["video_wolf"]) / 2)
-        + 0.2 * ((cf_data["essay_bane"] + cf_data["essay_wolf"]) / 2)
-        # + gamma * ((2 * cf_data["sens"]) - 1)
-        # + gamma * cf_data["sens"]
-    ).round(2)
-    SY0_AD_SCORE = "Sy=0_admittance_score"
-    SY1_AD_SCORE = "Sy=1_admittance_score"
-    data_all_0[SY0_AD_SCORE] = (
-        0.4 * ((data_all_0["potions_bane"] + data_all_0["potions_wolf"]) / 2)
-        + 0.4 * ((data_all_0["video_bane"] + data_all_0["video_wolf"]) / 2)
-        + 0.2 * ((data_all_0["essay_bane"] + data_all_0["essay_wolf"]) / 2)
-        + gamma * ((2 * data_all_0["sens"]) - 1)
-        # + gamma * data_all_0["sens"]
-    ).round(2)
-
-    data_all_0[SY1_AD_SCORE] = (
-        0.4 * ((data_all_0["potions_bane"] + data_all_0["potions_wolf"]) / 2)
-        + 0.4 * ((data_all_0["video_bane"] + data_all_0["video_wolf"]) / 2)
-        + 0.2 * ((data_all_0["essay_bane"] + data_all_0["essay_wolf"]) / 2)
-        + gamma * ((2 * data_all_1["sens"]) - 1)
-        # + gamma * data_all_1["sens"]
-    ).round(2)
-
-    data_all_1[SY0_AD_SCORE] = (
-        0.4 * ((data_all_1["potions_bane"] + data_all_1["potions_wolf"]) / 2)
-        + 0.4 * ((data_all_1["video_bane"] + data_all_1["video_wolf"]) / 2)
-        + 0.2 * ((data_all_1["essay_bane"] + data_all_1["essay_wolf"]) / 2)
-        + gamma * ((2 * data_all_0["sens"]) - 1)
-        # + gamma * data_all_0["sens"]
-    ).round(2)
-
-    data_all_1[SY1_AD_SCORE] = (
-        0.4 * ((data_all_1["potions_bane"] + data_all_1["potions_wolf"]) / 2)
-        + 0.4 * ((data_all_1["video_bane"] + data_all_1["video_wolf"]) / 2)
-        + 0.2 * ((data_all_1["essay_bane"] + data_all_1["essay_wolf"]) / 2)
-        + gamma * ((2 * data_all_1["sens"]) - 1)
-        # + gamma * data_all_1["sens"]
-    ).round(2)
-
-    graduation = []
-    for (c, p, v, e) in zip(
-        data["sens"], data["potions_score"], data["video_score"], data["essay_score"]
-    ):
-        # graduation.append(round(0.4 * p + 0.25 * v + 0.45 * e, 2))
-        if c == 0:
-            graduation.append(round(0.3 * p + 0.25 * v + 0.45 * e, 2))
-        else:
-            graduation.append(round(0.1 * p + 0.7 * v + 0.2 * e, 2))
-    graduation_all_0 = round(  # type: ignore[call-overload]
-        0.3 * data_all_0["potions_score"]
-        + 0.25 * data_all_0["video_score"]
-        + 0.45 * data_all_0["essay_score"],
-        2,
-    )
-    graduation_all_1 = round(  # type: ignore[call-overload]
-        0.1 * data_all_1["potions_score"]
-        + 0.7 * data_all_1["video_score"]
-        + 0.2 * data_all_1["essay_score"],
-        2,
-    )
 
-    cf_graduation = []
-    for (c, p, v, e) in zip(
-        cf_data["sens"], cf_data["potions_score"], cf_data["video_score"], cf_data["essay_score"]
-    ):
-        if c == 0:
-            cf_graduation.append(round(0.3 * p + 0.25 * v + 0.45 * e, 2))
-        else:
-            cf_graduation.append(round(0.1 * p + 0.7 * v + 0.2 * e, 2))
-
-    g = pd.DataFrame(graduation, columns=["graduation_grade"])
-    g_all_0 = pd.DataFrame(graduation_all_0, columns=["graduation_grade"])
-    g_all_1 = pd.DataFrame(graduation_all_1, columns=["graduation_grade"])
-    cf_g = pd.DataFrame(cf_graduation, columns=["graduation_grade"])
-    data = pd.concat([data, g], axis=1)
-    data_all_0 = pd.concat([data_all_0, g_all_0], axis=1)
-    data_all_1 = pd.concat([data_all_1, g_all_1], axis=1)
-    cf_data = pd.concat([cf_data, cf_g], axis=1)
-
-    passed_initial_screening = data.nlargest(n=int(data.shape[0] * 0.2), columns="admittance_score")
-    cf_passed_initial_screening = cf_data.nlargest(
-        n=int(cf_data.shape[0] * 0.2), columns="admittance_score"
+def _ground_truth(arrays: _LilliputArrays, passed_threshold: float) -> pd.DataFrame:
+    """Acceptance in each of the four (Sx, Sy) worlds at the factual cut-off."""
+    return pd.DataFrame(
+        {
+            "s1_0_s2_0": (arrays.sy0_admittance_score[0] >= passed_threshold).astype(int),
+            "s1_0_s2_1": (arrays.sy1_admittance_score[0] >= passed_threshold).astype(int),
+            "s1_1_s2_0": (arrays.sy0_admittance_score[1] >= passed_threshold).astype(int),
+            "s1_1_s2_1": (arrays.sy1_admittance_score[1] >= passed_threshold).astype(int),
+            "true_s": arrays.s[0],
+        }
     )
 
-    passed_threshold = data.nlargest(n=int(data.shape[0] * 0.2), columns="admittance_score")[
-        "admittance_score"
-    ].min()
-
-    print(f"Passed threshold is: {passed_threshold}")
-
-    accepted_sx_0_sy_0 = data_all_0[SY0_AD_SCORE] >= passed_threshold
-    accepted_sx_0_sy_1 = data_all_0[SY1_AD_SCORE] >= passed_threshold
-    accepted_sx_1_sy_0 = data_all_1[SY0_AD_SCORE] >= passed_threshold
-    accepted_sx_1_sy_1 = data_all_1[SY1_AD_SCORE] >= passed_threshold
-
-    gt_results = pd.concat(
-        [
-            accepted_sx_0_sy_0.astype(int).rename("s1_0_s2_0"),
-            accepted_sx_0_sy_1.astype(int).rename("s1_0_s2_1"),
-            accepted_sx_1_sy_0.astype(int).rename("s1_1_s2_0"),
-            accepted_sx_1_sy_1.astype(int).rename("s1_1_s2_1"),
-            data["sens"].rename("true_s"),
-        ],
-        axis=1,
-    )
 
-    best_aim = produce_selection_groups(gt_results, data_name="GroundTruth")
-
-    data["accepted"] = (
-        data.where(passed_initial_screening.isin(data), 0)["admittance_score"] > 0
-    ).astype(int)
-
-    cf_data["accepted"] = (
-        cf_data.where(cf_passed_initial_screening.isin(cf_data), 0)["admittance_score"] > 0
-    ).astype(int)
-
-    GRAD_MT_60 = "graduation_grade>60%"
-    data[GRAD_MT_60] = (data["graduation_grade"] >= 0.60).astype(int)
-    data_all_0[GRAD_MT_60] = (data_all_0["graduation_grade"] >= 0.60).astype(int)
-    data_all_1[GRAD_MT_60] = (data_all_1["graduation_grade"] >= 0.60).astype(int)
-    cf_data[GRAD_MT_60] = (cf_data["graduation_grade"] >= 0.60).astype(int)
+def _world_frames(
+    arrays: _LilliputArrays, *, accepted: np.ndarray, cf_accepted: np.ndarray
+) -> list[pd.DataFrame]:
+    """Assemble one dataframe per world."""
+    worlds = []
+    for world in range(4):
+        columns = {
+            "potions_score": arrays.potions_score[world],
+            "potions_bane": arrays.potions_bane[world],
+            "potions_wolf": arrays.potions_wolf[world],
+            "sens": arrays.s[world],
+            "video_score": arrays.video_score[world],
+            "video_bane": arrays.video_bane[world],
+            "video_wolf": arrays.video_wolf[world],
+            "essay_score": arrays.essay_score[world],
+            "essay_bane": arrays.essay_bane[world],
+            "essay_wolf": arrays.essay_wolf[world],
+        }
+        if world < 2:
+            columns["admittance_score"] = arrays.admittance_score[world]
+            columns["graduation_grade"] = arrays.graduation_grade[world]
+            columns["accepted"] = (accepted, cf_accepted)[world]
+        else:
+            columns[SY0_AD_SCORE] = arrays.sy0_admittance_score[world - 2]
+            columns[SY1_AD_SCORE] = arrays.sy1_admittance_score[world - 2]
+            columns["graduation_grade"] = arrays.graduation_grade[world]
+        columns[GRAD_MT_60] = (arrays.graduation_grade[world] >= 0.60).astype(int)
+        columns[GRAD_MT_70] = (arrays.graduation_grade[world] >= 0.70).astype(int)
+        worlds.append(pd.DataFrame(columns))
+    return worlds
 
-    GRAD_MT_70 = "graduation_grade>70%"
-    data[GRAD_MT_70] = (data["graduation_grade"] >= 0.70).astype(int)
-    data_all_0[GRAD_MT_70] = (data_all_0["graduation_grade"] >= 0.70).astype(int)
-    data_all_1[GRAD_MT_70] = (data_all_1["graduation_grade"] >= 0.70).astype(int)
-    cf_data[GRAD_MT_70] = (cf_data["graduation_grade"] >= 0.70).astype(int)
 
+def lilliput_dataset(num_samples: int) -> Dataset:
+    """Describe the columns of the `lilliput` data."""
     features = [
         "potions_bane",
         "potions_wolf",
@@ -405,7 +251,7 @@ def lilliput(*, seed: int, num_samples: int, alpha: float, gamma: float) -> CfDa
     class_label = "accepted"
     class_prefix = ["accepted", "graduation", "admittance", "Sy=0", "Sy=1"]
 
-    dataset = Dataset(
+    return Dataset(
         name="University of Lilliput",
         num_samples=num_samples,
         filename_or_path="lilliput.csv",
@@ -418,11 +264,16 @@ def lilliput(*, seed: int, num_samples: int, alpha: float, gamma: float) -> CfDa
         discrete_only=False,
     )
 
-    print(f"OT/DATA P(Y=1|Sx=0,Sy=0): {gt_results['s1_0_s2_0'].mean()}")
-    print(f"OT/DATA P(Y=1|Sx=0,Sy=1): {gt_results['s1_0_s2_1'].mean()}")
-    print(f"OT/DATA P(Y=1|Sx=1,Sy=0): {gt_results['s1_1_s2_0'].mean()}")
-    print(f"OT/DATA P(Y=1|Sx=1,Sy=1): {gt_results['s1_1_s2_1'].mean()}")
 
+def _cf_data(
+    dataset: Dataset,
+    *,
+    worlds: list[pd.DataFrame],
+    gt_results: pd.DataFrame,
+    cf_groups: Prediction | None,
+) -> CfData:
+    """Select the columns of each world that make up the `lilliput` data tuples."""
+    data, cf_data, data_all_0, data_all_1 = worlds
     return CfData(
         dataset=dataset,
         data=DataTuple(
@@ -440,7 +291,7 @@ def lilliput(*, seed: int, num_samples: int, alpha: float, gamma: float) -> CfDa
             s=data[dataset.sens_attrs],
             y=data_all_0[[GRAD_MT_60]],  # data[[GRAD_MT_60]],
         ),
-        cf_groups=best_aim,
+        cf_groups=cf_groups,
         data_xs0_ys0=DataTuple(
             x=data_all_0[dataset.discrete_features + dataset.continuous_features],
             s=data_all_0[dataset.sens_attrs],
@@ -462,3 +313,26 @@ def lilliput(*, seed: int, num_samples: int, alpha: float, gamma: float) -> CfDa
             y=gt_results["s1_1_s2_1"].to_frame(),
         ),
     )
+
+
+def lilliput(*, seed: int, num_samples: int, alpha: float, gamma: float) -> CfData:
+    """Make the `lilliput` dataset."""
+    num_gen = np.random.default_rng(seed)
+    arrays = _lilliput_arrays(num_gen, num_samples=num_samples, alpha=alpha, gamma=gamma)
+
+    accepted, passed_threshold = _screen(arrays.admittance_score[0])
+    cf_accepted, _ = _screen(arrays.admittance_score[1])
+
+    print(f"Passed threshold is: {passed_threshold}")
+
+    gt_results = _ground_truth(arrays, passed_threshold)
+    best_aim = produce_selection_groups(gt_results, data_name="GroundTruth")
+    worlds = _world_frames(arrays, accepted=accepted, cf_accepted=cf_accepted)
+    dataset = lilliput_dataset(num_samples)
+
+    print(f"OT/DATA P(Y=1|Sx=0,Sy=0): {gt_results['s1_0_s2_0'].mean()}")
+    print(f"OT/DATA P(Y=1|Sx=0,Sy=1): {gt_results['s1_0_s2_1'].mean()}")
+    print(f"OT/DATA P(Y=1|Sx=1,Sy=0): {gt_results['s1_1_s2_0'].mean()}")
+    print(f"OT/DATA P(Y=1|Sx=1,Sy=1): {gt_results['s1_1_s2_1'].mean()}")
+
+    return _cf_data(dataset, worlds=worlds, gt_results=gt_results, cf_groups=best_aim)
@@ -7,7 +7,7 @@ from ethicml import Dataset, DataTuple
 import numpy as np
 import pandas as pd
 
-__all__ = ["simple_x_data", "SimpleXData"]
+__all__ = ["simple_x_data", "simple_x_dataset", "SimpleXData"]
 
 
 def make_x_bar(
@@ -76,21 +76,8 @@ def simple_x_data(
     data = data.reindex(idx).reset_index(drop=True)  # type: ignore[call-arg]
     counterfactual_data = counterfactual_data.reindex(idx).reset_index(drop=True)  # type: ignore[call-arg]
 
-    dataset = Dataset(
-        name="SimpleX",
-        num_samples=num_samples,
-        filename_or_path="none",
-        features=[f"x_{i}" for i in range(1)] + ["sens"],
-        cont_features=[f"x_{i}" for i in range(1)],
-        sens_attr_spec="sens",
-        s_prefix="sens",
-        class_label_spec="outcome",
-        class_label_prefix="outcome",
-        discrete_only=False,
-    )
-
     return SimpleXData(
-        dataset=dataset,
+        dataset=simple_x_dataset(num_samples),
         true=DataTuple(
             x=data[x_df.columns], s=data[s_df.columns], y=data[outcome_placeholder.columns]
         ),
@@ -112,3 +99,19 @@ class SimpleXData(NamedTuple):
     true: DataTuple
     cf: DataTuple
     true_outcomes: DataTuple
+
+
+def simple_x_dataset(num_samples: int) -> Dataset:
+    """Describe the columns of the simple-x data."""
+    return Dataset(
+        name="SimpleX",
+        num_samples=num_samples,
+        filename_or_path="none",
+        features=[f"x_{i}" for i in range(1)] + ["sens"],
+        cont_features=[f"x_{i}" for i in range(1)],
+        sens_attr_spec="sens",
+        s_prefix="sens",
+        class_label_spec="outcome",
+        class_label_prefix="outcome",
+        discrete_only=False,
+    )
@@ -0,0 +1,269 @@
+"""Chunked versions of the synthetic data generators."""
+from __future__ import annotations
+import math
+from pathlib import Path
+import pickle
+from typing import Callable, Iterator, TypeVar
+
+from ethicml import DataTuple
+import numpy as np
+import pandas as pd
+
+from paf.base_templates.data_cache import DataTupleWriter
+from paf.datasets.lilliput import (
+    CfData,
+    _cf_data,
+    _ground_truth,
+    _lilliput_arrays,
+    _LilliputArrays,
+    _screen,
+    _world_frames,
+    lilliput_dataset,
+)
+from paf.datasets.simple_x import SimpleXData, simple_x_data, simple_x_dataset
+from paf.datasets.third_way import (
+    third_way_calibration,
+    third_way_data,
+    third_way_dataset,
+)
+
+__all__ = ["lilliput_chunks", "simple_x_chunks", "third_way_chunks", "write_chunks"]
+
+T = TypeVar("T", CfData, SimpleXData)
+
+BLOCK_SIZE = 10_000
+CALIBRATION_SAMPLES = 100_000
+
+
+def _block_rng(seed: int, block: int) -> np.random.Generator:
+    return np.random.default_rng([seed, block])
+
+
+def _block_seed(seed: int, block: int) -> int:
+    return int(np.random.SeedSequence([seed, block]).generate_state(1)[0])
+
+
+def _map_datatuples(fn: Callable[[list[DataTuple]], DataTuple], parts: list[T]) -> T:
+    """Apply ``fn`` field-wise to the datatuples of several chunks, keeping the other fields."""
+    fields = []
+    for values in zip(*parts):
+        fields.append(fn(list(values)) if isinstance(values[0], DataTuple) else values[0])
+    return type(parts[0])(*fields)
+
+
+def _concat(datatuples: list[DataTuple]) -> DataTuple:
+    if len(datatuples) == 1:
+        return datatuples[0]
+    return DataTuple(
+        x=pd.concat([dt.x for dt in datatuples], ignore_index=True),
+        s=pd.concat([dt.s for dt in datatuples], ignore_index=True),
+        y=pd.concat([dt.y for dt in datatuples], ignore_index=True),
+        name=datatuples[0].name,
+    )
+
+
+def _take(datatuple: DataTuple, start: int, stop: int) -> DataTuple:
+    return DataTuple(
+        x=datatuple.x.iloc[start:stop].reset_index(drop=True),
+        s=datatuple.s.iloc[start:stop].reset_index(drop=True),
+        y=datatuple.y.iloc[start:stop].reset_index(drop=True),
+        name=datatuple.name,
+    )
+
+
+def _slice(data: T, start: int, stop: int) -> T:
+    return _map_datatuples(lambda datatuples: _take(datatuples[0], start, stop), [data])
+
+
+def _rechunk(
+    make_block: Callable[[int, int], T], *, num_samples: int, chunk_size: int, block_size: int
+) -> Iterator[T]:
+    """Generate fixed-size blocks and regroup their rows into chunks of ``chunk_size``.
+
+    Each block only depends on its index, so the concatenation of the chunks is the same for
+    every ``chunk_size``.
+    """
+    buffer: list[T] = []
+    num_buffered = 0
+    for block in range(math.ceil(num_samples / block_size)):
+        num_rows = min(block_size, num_samples - block * block_size)
+        buffer.append(make_block(block, num_rows))
+        num_buffered += num_rows
+        if num_buffered < chunk_size:
+            continue
+        merged = _map_datatuples(_concat, buffer)
+        start = 0
+        while num_buffered - start >= chunk_size:
+            yield _slice(merged, start, start + chunk_size)
+            start += chunk_size
+        buffer = [_slice(merged, start, num_buffered)] if start < num_buffered else []
+        num_buffered -= start
+    if num_buffered > 0:
+        yield _map_datatuples(_concat, buffer)
+
+
+def lilliput_chunks(
+    *,
+    seed: int,
+    num_samples: int,
+    alpha: float,
+    gamma: float,
+    chunk_size: int,
+    block_size: int = BLOCK_SIZE,
+    calibration_samples: int = CALIBRATION_SAMPLES,
+) -> Iterator[CfData]:
+    """Stream the `lilliput` dataset in chunks of ``chunk_size`` rows.
+
+    Rows are drawn in blocks of ``block_size`` seeded by ``(seed, block index)``. The screening
+    cut-offs are taken from the first ``calibration_samples`` rows, and a candidate is accepted
+    if their admittance score reaches the cut-off. ``cf_groups`` is not computed.
+    """
+
+    def _arrays(block: int, num_rows: int) -> _LilliputArrays:
+        return _lilliput_arrays(
+            _block_rng(seed, block), num_samples=num_rows, alpha=alpha, gamma=gamma
+        )
+
+    num_calibration = min(calibration_samples, num_samples)
+    calibration = [
+        _arrays(block, min(block_size, num_calibration - block * block_size)).admittance_score
+        for block in range(math.ceil(num_calibration / block_size))
+    ]
+    admittance_score = np.concatenate(calibration, axis=1)
+    _, passed_threshold = _screen(admittance_score[0])
+    _, cf_passed_threshold = _screen(admittance_score[1])
+    dataset = lilliput_dataset(num_samples)
+
+    def _make_block(block: int, num_rows: int) -> CfData:
+        arrays = _arrays(block, num_rows)
+        factual, counterfactual = arrays.admittance_score
+        worlds = _world_frames(
+            arrays,
+            accepted=((factual >= passed_threshold) & (factual > 0)).astype(int),
+            cf_accepted=((counterfactual >= cf_passed_threshold) & (counterfactual > 0)).astype(
+                int
+            ),
+        )
+        gt_results = _ground_truth(arrays, passed_threshold)
+        return _cf_data(dataset, worlds=worlds, gt_results=gt_results, cf_groups=None)
+
+    yield from _rechunk(
+        _make_block, num_samples=num_samples, chunk_size=chunk_size, block_size=block_size
+    )
+
+
+def third_way_chunks(
+    *,
+    seed: int,
+    num_hidden_features: int,
+    num_features: int,
+    num_samples: int,
+    acceptance_rate: float,
+    alpha: float,
+    gamma: float,
+    random_shift: int,
+    binary_s: int,
+    beta: float,
+    xi: float,
+    chunk_size: int,
+    block_size: int = BLOCK_SIZE,
+    calibration_samples: int = CALIBRATION_SAMPLES,
+) -> Iterator[CfData]:
+    """Stream the third-way dataset in chunks of ``chunk_size`` rows.
+
+    Each block of ``block_size`` rows is generated by :func:`third_way_data` with its rows and
+    observation noise seeded by ``(seed, block index)``. The hidden-feature scaling and the
+    outcome thresholds are shared by all blocks and taken from a calibration sample of
+    ``calibration_samples`` rows.
+    """
+    calibration = third_way_calibration(
+        seed=seed,
+        num_hidden_features=num_hidden_features,
+        num_features=num_features,
+        num_samples=min(calibration_samples, num_samples),
+        acceptance_rate=acceptance_rate,
+        alpha=alpha,
+        gamma=gamma,
+        random_shift=random_shift,
+        binary_s=binary_s,
+        beta=beta,
+        xi=xi,
+    )
+
+    dataset = third_way_dataset(num_samples, num_features=num_features)
+
+    def _make_block(block: int, num_rows: int) -> CfData:
+        block_seed = _block_seed(seed, block)
+        data = third_way_data(
+            seed=block_seed,
+            num_hidden_features=num_hidden_features,
+            num_features=num_features,
+            num_samples=num_rows,
+            acceptance_rate=acceptance_rate,
+            alpha=alpha,
+            gamma=gamma,
+            random_shift=random_shift,
+            binary_s=binary_s,
+            beta=beta,
+            xi=xi,
+            calibration=calibration,
+            noise_seed=block_seed,
+            verbose=False,
+        )
+        return data._replace(dataset=dataset)
+
+    yield from _rechunk(
+        _make_block, num_samples=num_samples, chunk_size=chunk_size, block_size=block_size
+    )
+
+
+def simple_x_chunks(
+    *,
+    seed: int,
+    num_samples: int,
+    alpha: float,
+    gamma: float,
+    random_shift: int,
+    binary_s: int,
+    chunk_size: int,
+    block_size: int = BLOCK_SIZE,
+) -> Iterator[SimpleXData]:
+    """Stream the simple-x dataset in chunks of ``chunk_size`` rows."""
+
+    dataset = simple_x_dataset(num_samples)
+
+    def _make_block(block: int, num_rows: int) -> SimpleXData:
+        data = simple_x_data(
+            seed=_block_seed(seed, block),
+            num_samples=num_rows,
+            alpha=alpha,
+            gamma=gamma,
+            random_shift=random_shift,
+            binary_s=binary_s,
+        )
+        return data._replace(dataset=dataset)
+
+    yield from _rechunk(
+        _make_block, num_samples=num_samples, chunk_size=chunk_size, block_size=block_size
+    )
+
+
+def write_chunks(chunks: Iterator[T], path: Path, *, num_samples: int) -> None:
+    """Write every world of a chunked dataset to ``path`` without holding it in memory.
+
+    Each world is stored in a subdirectory named after its field, readable with
+    :func:`~paf.base_templates.data_cache.load_datatuple`; the dataset is pickled alongside.
+    """
+    writers: dict[str, DataTupleWriter] = {}
+    for chunk in chunks:
+        if not writers:
+            path.mkdir(parents=True, exist_ok=True)
+            with (path / "dataset.pkl").open("wb") as f:
+                pickle.dump(chunk.dataset, f)
+        for field, value in zip(chunk._fields, chunk):
+            if isinstance(value, DataTuple):
+                if field not in writers:
+                    writers[field] = DataTupleWriter(path / field, num_rows=num_samples)
+                writers[field].write(value)
+    for writer in writers.values():
+        writer.close()
@@ -1,6 +1,7 @@
 """Functions for synthetic data."""
 from __future__ import annotations
 import logging
+from typing import NamedTuple
 
 from ethicml import Dataset, DataTuple
 import numpy as np
@@ -11,18 +12,33 @@ from sklearn import preprocessing
 
 from paf.datasets.lilliput import CfData
 
-__all__ = ["third_way_data"]
+__all__ = [
+    "ThirdWayCalibration",
+    "make_x_bar",
+    "make_y_true_bar",
+    "third_way_calibration",
+    "third_way_data",
+    "third_way_dataset",
+]
 
 
 log = logging.getLogger(__name__)
 
 
+class ThirdWayCalibration(NamedTuple):
+    """Statistics of a reference sample that fix how outcomes are assigned to new samples."""
+
+    hidden_scaler: preprocessing.StandardScaler
+    y_true_threshold: float
+    y_threshold: float
+
+
 def make_x_bar(
     num_features: int, num_samples: int, random_state: np.random.Generator
 ) -> npt.NDArray[np.float_]:
     """Initial potential."""
     x_tilde = random_state.uniform(0, 1, size=(num_samples, num_features))
-    return np.stack([scipy.stats.norm.ppf(sample, loc=0, scale=1) for sample in x_tilde])
+    return scipy.stats.norm.ppf(x_tilde, loc=0, scale=1)
 
 
 def make_s(alpha: float, n: int, random_state: np.random.Generator, binary_s: bool) -> npt.NDArray:
@@ -39,9 +55,9 @@ def make_dx(x_bar: np.ndarray, s: np.ndarray, gamma: float, binary_s: bool) -> n
     return np.add(x_bar[:, : x_bar.shape[1]], (gamma * (s[:, np.newaxis])))
 
 
-def make_x(dx: np.ndarray, s: np.ndarray, xi: float, n: int) -> np.ndarray:
+def make_x(dx: np.ndarray, s: np.ndarray, xi: float, n: int, seed: int = 0) -> np.ndarray:
     """Make observations of the data."""
-    rng = np.random.RandomState(0)
+    rng = np.random.RandomState(seed)
     return np.around(
         np.add(
             dx[:, :n],
@@ -51,19 +67,30 @@ def make_x(dx: np.ndarray, s: np.ndarray, xi: float, n: int) -> np.ndarray:
     )
 
 
+def make_y_true_bar(
+    dx: np.ndarray, w: np.ndarray, scaler: preprocessing.StandardScaler | None = None
+) -> pd.DataFrame:
+    """Weighted sum of the hidden features, standardised with ``scaler`` or their own stats."""
+    if scaler is None:
+        scaler = preprocessing.StandardScaler().fit(dx)
+    return pd.DataFrame(scaler.transform(dx) @ w, columns=["y_true"])
+
+
 def make_y(
     y_bar: pd.DataFrame,
     s: pd.DataFrame,
     beta: float,
     acceptance_rate: float,
     threshold: float | None = None,
+    verbose: bool = True,
 ) -> tuple[pd.DataFrame, float]:
     """Go from y_bar to Y."""
     y_bar = y_bar + beta * (s.values * 2 - 1)
 
     if threshold is None:
         threshold = y_bar.quantile([1 - acceptance_rate]).values[0][0]
-        print(threshold)
+        if verbose:
+            print(threshold)
     return (y_bar > threshold).astype(int).rename(columns={"y_bar": "y"}), threshold
 
 
@@ -80,8 +107,99 @@ def third_way_data(
     binary_s: int,
     beta: float,
     xi: float,
+    calibration: ThirdWayCalibration | None = None,
+    noise_seed: int = 0,
+    verbose: bool = True,
 ) -> CfData:
-    """Generate very simple X data."""
+    """Generate very simple X data.
+
+    With a ``calibration`` the outcomes are assigned with its scaling and thresholds instead of
+    ones computed from this sample. ``noise_seed`` seeds the observation noise.
+    """
+    return _third_way(
+        seed=seed,
+        num_hidden_features=num_hidden_features,
+        num_features=num_features,
+        num_samples=num_samples,
+        acceptance_rate=acceptance_rate,
+        alpha=alpha,
+        gamma=gamma,
+        random_shift=random_shift,
+        binary_s=binary_s,
+        beta=beta,
+        xi=xi,
+        calibration=calibration,
+        noise_seed=noise_seed,
+        verbose=verbose,
+    )[0]
+
+
+def third_way_calibration(
+    *,
+    seed: int,
+    num_hidden_features: int,
+    num_features: int,
+    num_samples: int,
+    acceptance_rate: float,
+    alpha: float,
+    gamma: float,
+    random_shift: int,
+    binary_s: int,
+    beta: float,
+    xi: float,
+) -> ThirdWayCalibration:
+    """The outcome scaling and thresholds of the sample :func:`third_way_data` would generate."""
+    return _third_way(
+        seed=seed,
+        num_hidden_features=num_hidden_features,
+        num_features=num_features,
+        num_samples=num_samples,
+        acceptance_rate=acceptance_rate,
+        alpha=alpha,
+        gamma=gamma,
+        random_shift=random_shift,
+        binary_s=binary_s,
+        beta=beta,
+        xi=xi,
+        calibration=None,
+        noise_seed=0,
+        verbose=False,
+    )[1]
+
+
+def third_way_dataset(num_samples: int, *, num_features: int) -> Dataset:
+    """Describe the columns of the third-way data."""
+    return Dataset(
+        name="ThirdWay",
+        num_samples=num_samples,
+        filename_or_path="none",
+        features=[f"x_{i}" for i in range(num_features)] + ["sens"],
+        cont_features=[f"x_{i}" for i in range(num_features)],
+        sens_attr_spec="sens",
+        s_prefix="sens",
+        class_label_spec="outcome",
+        class_label_prefix="outcome",
+        discrete_only=False,
+    )
+
+
+def _third_way(
+    *,
+    seed: int,
+    num_hidden_features: int,
+    num_features: int,
+    num_samples: int,
+    acceptance_rate: float,
+    alpha: float,
+    gamma: float,
+    random_shift: int,
+    binary_s: int,
+    beta: float,
+    xi: float,
+    calibration: ThirdWayCalibration | None,
+    noise_seed: int,
+    verbose: bool,
+) -> tuple[CfData, ThirdWayCalibration]:
     num_gen = np.random.default_rng(seed)
     x_bar = make_x_bar(
         num_features=num_hidden_features, num_samples=num_samples, random_state=num_gen
@@ -106,53 +224,51 @@ def third_way_data(
         )
 
     dx = make_dx(x_bar=x_bar, s=temp_s, gamma=gamma, binary_s=binary_s == 1)
-    counterfactual_dx = make_dx(x_bar, tmp_cf_s, gamma=gamma, binary_s=binary_s == 1)
-    s0_dx = make_dx(x_bar, s0, gamma=gamma, binary_s=binary_s == 1)
-    s1_dx = make_dx(x_bar, s1, gamma=gamma, binary_s=binary_s == 1)
+    # only the observed features are needed in the other worlds
+    observed_x_bar = x_bar[:, :num_features]
+    counterfactual_dx = make_dx(observed_x_bar, tmp_cf_s, gamma=gamma, binary_s=binary_s == 1)
+    s0_dx = make_dx(observed_x_bar, s0, gamma=gamma, binary_s=binary_s == 1)
+    s1_dx = make_dx(observed_x_bar, s1, gamma=gamma, binary_s=binary_s == 1)
 
-    x = make_x(dx, s, xi=xi, n=num_features)
+    x = make_x(dx, s, xi=xi, n=num_features, seed=noise_seed)
     x_df = pd.DataFrame(x, columns=[f"x_{i}" for i in range(x.shape[1])])
-    counterfactual_x = make_x(counterfactual_dx, counterfactual_s, xi=xi, n=num_features)
+    counterfactual_x = make_x(
+        counterfactual_dx, counterfactual_s, xi=xi, n=num_features, seed=noise_seed
+    )
     cf_x_df = pd.DataFrame(counterfactual_x, columns=[f"x_{i}" for i in range(x.shape[1])])
-    s0_x = make_x(s0_dx, s0, xi=xi, n=num_features)
+    s0_x = make_x(s0_dx, s0, xi=xi, n=num_features, seed=noise_seed)
     s0_x_df = pd.DataFrame(s0_x, columns=[f"x_{i}" for i in range(x.shape[1])])
-    s1_x = make_x(s1_dx, s1, xi=xi, n=num_features)
+    s1_x = make_x(s1_dx, s1, xi=xi, n=num_features, seed=noise_seed)
     s1_x_df = pd.DataFrame(s1_x, columns=[f"x_{i}" for i in range(x.shape[1])])
 
     w = np.ones(dx.shape[1]) / dx.shape[1]  # np.random.normal(0, 1, dx.shape[1])
 
-    min_max_scaler = preprocessing.StandardScaler()
-
-    y_true_bar = pd.DataFrame(
-        [np.dot(w, _x) for _x in min_max_scaler.fit_transform(dx)],
-        columns=["y_true"],
-    )
-    counterfactual_y_true_bar = pd.DataFrame(
-        [np.dot(w, _x) for _x in min_max_scaler.fit_transform(counterfactual_dx)],
-        columns=["y_true"],
-    )
-    s0_y_true_bar = pd.DataFrame(
-        [np.dot(w, _x) for _x in min_max_scaler.fit_transform(s0_dx)],
-        columns=["y_true"],
+    hidden_scaler = (
+        preprocessing.StandardScaler().fit(dx)
+        if calibration is None
+        else calibration.hidden_scaler
     )
-    s1_y_true_bar = pd.DataFrame(
-        [np.dot(w, _x) for _x in min_max_scaler.fit_transform(s1_dx)],
-        columns=["y_true"],
+    y_true_bar = make_y_true_bar(dx, w, scaler=hidden_scaler)
+    y_true_threshold = (
+        y_true_bar.quantile([0.75]).values[0][0]
+        if calibration is None
+        else calibration.y_true_threshold
     )
-
-    y_true_threshold = y_true_bar.quantile([0.75]).values[0][0]
-
     y_true = (y_true_bar > y_true_threshold).astype(int)
-    (counterfactual_y_true_bar > y_true_threshold).astype(int)
-    (s0_y_true_bar > y_true_threshold).astype(int)
-    (s1_y_true_bar > y_true_threshold).astype(int)
 
     y_bar = pd.DataFrame(x_df.mean(axis=1), columns=["y_bar"])
     cf_y_bar = pd.DataFrame(cf_x_df.mean(axis=1), columns=["y_bar"])
     s0_y_bar = pd.DataFrame(s0_x_df.mean(axis=1), columns=["y_bar"])
     s1_y_bar = pd.DataFrame(s1_x_df.mean(axis=1), columns=["y_bar"])
 
-    y_df, threshold = make_y(y_bar, s_df, beta=beta, acceptance_rate=acceptance_rate)
+    y_df, threshold = make_y(
+        y_bar,
+        s_df,
+        beta=beta,
+        acceptance_rate=acceptance_rate,
+        threshold=None if calibration is None else calibration.y_threshold,
+        verbose=verbose,
+    )
     y_df = y_df.rename(columns={"y": "outcome"})
     cf_y_df, _ = make_y(
         cf_y_bar, cf_s_df, beta=beta, acceptance_rate=acceptance_rate, threshold=threshold
@@ -191,21 +307,8 @@ def third_way_data(
     s1_1_s2_0_data = s1_1_s2_0_data.reindex(idx).reset_index(drop=True)  # type: ignore[call-arg]
     s1_1_s2_1_data = s1_1_s2_1_data.reindex(idx).reset_index(drop=True)  # type: ignore[call-arg]
 
-    dataset = Dataset(
-        name="ThirdWay",
-        num_samples=num_samples,
-        filename_or_path="none",
-        features=[f"x_{i}" for i in range(num_features)] + ["sens"],
-        cont_features=[f"x_{i}" for i in range(num_features)],
-        sens_attr_spec="sens",
-        s_prefix="sens",
-        class_label_spec="outcome",
-        class_label_prefix="outcome",
-        discrete_only=False,
-    )
-
-    return CfData(
-        dataset=dataset,
+    data_out = CfData(
+        dataset=third_way_dataset(num_samples, num_features=num_features),
         data=DataTuple(x=data[x_df.columns], s=data[s_df.columns], y=data[y_df.columns]),
         cf_data=DataTuple(
             x=counterfactual_data[x_df.columns],
@@ -237,3 +340,7 @@ def third_way_data(
         ),
         cf_groups=None,
     )
+    calibration_out = ThirdWayCalibration(
+        hidden_scaler=hidden_scaler, y_true_threshold=y_true_threshold, y_threshold=threshold
+    )
+    return data_out, calibration_out
@@ -66,7 +66,7 @@ from paf.config_classes.pytorch_lightning.trainer.configs import (  # type: igno
     TrainerConf,
 )
 from paf.log_progress import do_log
-from paf.mmd import KernelType, mmd2
+from paf.mmd import KernelType, mmd2_test
 from paf.plotting import label_plot, make_data_plots
 from paf.scoring import get_full_breakdown, produce_baselines
 from paf.selection import baseline_selection_rules, produce_selection_groups
@@ -101,6 +101,11 @@ class ExpConfig:
     model: ModelType = ModelType.PAF
     debug: bool = False
     constrained: Optional[List[str]] = None
+    cycle_steps: int = 100
+    cycle_batch_size: Optional[int] = None
+    cycle_tol: float = 0.0
+    cycle_subsample: Optional[int] = None
+    mmd_permutations: int = 200
 
 
 @dataclass
@@ -279,15 +284,18 @@ def run_paf(cfg: Config, raw_config: Any) -> None:
     # cfg.enc_trainer.fit(model=model, datamodule=data)
     results = model.collate_results(
         cfg.enc_trainer.predict(model=model, dataloaders=data.test_dataloader(), ckpt_path=None),
-        cycle_steps=100,
+        cycle_steps=cfg.exp.cycle_steps,
+        cycle_batch_size=cfg.exp.cycle_batch_size,
+        cycle_tol=cfg.exp.cycle_tol,
+        cycle_subsample=cfg.exp.cycle_subsample,
     )
 
     if isinstance(results, PafResults):
-        wandb_logger.experiment.log(results.cyc_vals.mean(axis="rows").to_dict())
+        wandb_logger.experiment.log(results.cyc_vals.loc["mean"].to_dict())
 
         if cfg.exp.debug:
-            _s = data.test_datatuple.s.copy().to_numpy()
-            _y = data.test_datatuple.y.copy().to_numpy()
+            _s = data.test_datatuple.s.to_numpy()
+            _y = data.test_datatuple.y.to_numpy()
 
             for arr, name in [
                 (results.x.detach().cpu().numpy(), "Input"),
@@ -368,22 +376,42 @@ def evaluate(
     _model_trainer: pl.Trainer,
 ) -> None:
 
-    baseline_mmd = mmd2(results.x.clone(), results.x.clone(), kernel=EVAL_KERNEL)
-    x2cf_mmd = mmd2(results.recon.clone(), results.cf_x.clone(), kernel=EVAL_KERNEL)
-    recon_mmd = mmd2(results.recon.clone(), results.x.clone(), kernel=EVAL_KERNEL)
-    s0_dist_mmd = mmd2(
-        results.x[results.s == 0].clone(), results.recons_0.clone(), kernel=EVAL_KERNEL, biased=True
+    perms = cfg.exp.mmd_permutations
+    baseline_mmd = mmd2_test(
+        results.x.clone(), results.x.clone(), kernel=EVAL_KERNEL, num_permutations=perms
     )
-    s1_dist_mmd = mmd2(
-        results.x[results.s == 1].clone(), results.recons_1.clone(), kernel=EVAL_KERNEL, biased=True
+    x2cf_mmd = mmd2_test(
+        results.recon.clone(), results.cf_x.clone(), kernel=EVAL_KERNEL, num_permutations=perms
+    )
+    recon_mmd = mmd2_test(
+        results.recon.clone(), results.x.clone(), kernel=EVAL_KERNEL, num_permutations=perms
+    )
+    s0_dist_mmd = mmd2_test(
+        results.x[results.s == 0].clone(),
+        results.recons_0.clone(),
+        kernel=EVAL_KERNEL,
+        biased=True,
+        num_permutations=perms,
+    )
+    s1_dist_mmd = mmd2_test(
+        results.x[results.s == 1].clone(),
+        results.recons_1.clone(),
+        kernel=EVAL_KERNEL,
+        biased=True,
+        num_permutations=perms,
     )
 
     for title, val in [
-        ("MMD X vs X", baseline_mmd.item()),
-        ("MMD X vs Cf", x2cf_mmd.item()),
-        ("MMD X vs X^", recon_mmd.item()),
-        ("MMD S0 vs Cf", s0_dist_mmd.item()),
-        ("MMD S1 vs Cf", s1_dist_mmd.item()),
+        ("MMD X vs X", baseline_mmd.mmd2.item()),
+        ("MMD X vs X p-value", baseline_mmd.p_value.item()),
+        ("MMD X vs Cf", x2cf_mmd.mmd2.item()),
+        ("MMD X vs Cf p-value", x2cf_mmd.p_value.item()),
+        ("MMD X vs X^", recon_mmd.mmd2.item()),
+        ("MMD X vs X^ p-value", recon_mmd.p_value.item()),
+        ("MMD S0 vs Cf", s0_dist_mmd.mmd2.item()),
+        ("MMD S0 vs Cf p-value", s0_dist_mmd.p_value.item()),
+        ("MMD S1 vs Cf", s1_dist_mmd.mmd2.item()),
+        ("MMD S1 vs Cf p-value", s1_dist_mmd.p_value.item()),
         ("P(Y=1|Sx=0,Sy=0", results.pd_results["s1_0_s2_0"].mean()),
         ("P(Y=1|Sx=0,Sy=1", results.pd_results["s1_0_s2_1"].mean()),
         ("P(Y=1|Sx=1,Sy=0", results.pd_results["s1_1_s2_0"].mean()),
@@ -420,8 +448,8 @@ def evaluate(
             name=f"{PS}/{fair_bool=}",
             logger=wandb_logger,
             debug=cfg.exp.debug,
-            x=data.test_datatuple.x.copy(),
-            s=data.test_datatuple.s.copy(),
+            x=data.test_datatuple.x,
+            s=data.test_datatuple.s,
             y=preds.hard.to_frame().copy(),
             graduated=None,
         )
@@ -434,8 +462,8 @@ def evaluate(
                 name=f"{PS}/{TL}/{fair_bool=}",
                 logger=wandb_logger,
                 debug=cfg.exp.debug,
-                x=data.test_datatuple.x.copy(),
-                s=data.test_datatuple.s.copy(),
+                x=data.test_datatuple.x,
+                s=data.test_datatuple.s,
                 y=preds.hard.to_frame().copy(),
                 graduated=data.true_test_datatuple,
             )
@@ -450,8 +478,8 @@ def evaluate(
             name=f"{RW}",
             logger=wandb_logger,
             debug=cfg.exp.debug,
-            x=data.test_datatuple.x.copy(),
-            s=data.test_datatuple.s.copy(),
+            x=data.test_datatuple.x,
+            s=data.test_datatuple.s,
             y=our_clf_preds.hard.to_frame().copy(),
             graduated=None,
         )
@@ -463,8 +491,8 @@ def evaluate(
                 name=f"{RW}/{TL}",
                 logger=wandb_logger,
                 debug=cfg.exp.debug,
-                x=data.test_datatuple.x.copy(),
-                s=data.test_datatuple.s.copy(),
+                x=data.test_datatuple.x,
+                s=data.test_datatuple.s,
                 y=our_clf_preds.hard.to_frame().copy(),
                 graduated=data.true_test_datatuple,
             )
@@ -512,8 +540,8 @@ def baseline_models(
         name=f"{RW}",
         logger=logger,
         debug=debug,
-        x=data.test_datatuple.x.copy(),
-        s=data.test_datatuple.s.copy(),
+        x=data.test_datatuple.x,
+        s=data.test_datatuple.s,
         y=results.hard.to_frame().copy(),
         graduated=None,
     )
@@ -529,8 +557,8 @@ def baseline_models(
             name=f"{RW}/{TL}",
             logger=logger,
             debug=debug,
-            x=data.test_datatuple.x.copy(),
-            s=data.test_datatuple.s.copy(),
+            x=data.test_datatuple.x,
+            s=data.test_datatuple.s,
             y=results.hard.to_frame().copy(),
             graduated=data.true_test_datatuple,
         )
@@ -543,7 +571,7 @@ def multiple_metrics(
     if debug:
         try:
             label_plot(
-                em.DataTuple(x=target.x.copy(), s=target.s.copy(), y=preds.hard.to_frame()),
+                em.DataTuple(x=target.x, s=target.s, y=preds.hard.to_frame()),
                 logger,
                 name,
             )
@@ -600,7 +628,7 @@ def two_model_approach(cfg: Config, data: BaseDataModule, logger: pll.WandbLogge
         {
             "s1_0_s2_0": first_results.hard.values,
             "s1_1_s2_1": dp_results.hard.values,
-            "true_s": data.test_datatuple.s.copy().values[:, 0],
+            "true_s": data.test_datatuple.s.values[:, 0],
         }
     )
 
@@ -617,8 +645,8 @@ def two_model_approach(cfg: Config, data: BaseDataModule, logger: pll.WandbLogge
             name=f"{PS}/{fair_bool=}",
             logger=logger,
             debug=cfg.exp.debug,
-            x=data.test_datatuple.x.copy(),
-            s=data.test_datatuple.s.copy(),
+            x=data.test_datatuple.x,
+            s=data.test_datatuple.s,
             y=preds.hard.to_frame().copy(),
             graduated=None,
         )
@@ -630,8 +658,8 @@ def two_model_approach(cfg: Config, data: BaseDataModule, logger: pll.WandbLogge
                 name=f"{PS}/{TL}/{fair_bool=}",
                 logger=logger,
                 debug=cfg.exp.debug,
-                x=data.test_datatuple.x.copy(),
-                s=data.test_datatuple.s.copy(),
+                x=data.test_datatuple.x,
+                s=data.test_datatuple.s,
                 y=preds.hard.to_frame().copy(),
                 graduated=data.true_test_datatuple,
             )
@@ -642,8 +670,8 @@ def two_model_approach(cfg: Config, data: BaseDataModule, logger: pll.WandbLogge
         name=f"{RW}",
         logger=logger,
         debug=cfg.exp.debug,
-        x=data.test_datatuple.x.copy(),
-        s=data.test_datatuple.s.copy(),
+        x=data.test_datatuple.x,
+        s=data.test_datatuple.s,
         y=first_results.hard.to_frame().copy(),
         graduated=None,
     )
@@ -655,8 +683,8 @@ def two_model_approach(cfg: Config, data: BaseDataModule, logger: pll.WandbLogge
             name=f"{RW}/{TL}",
             logger=logger,
             debug=cfg.exp.debug,
-            x=data.test_datatuple.x.copy(),
-            s=data.test_datatuple.s.copy(),
+            x=data.test_datatuple.x,
+            s=data.test_datatuple.s,
             y=first_results.hard.to_frame().copy(),
             graduated=data.true_test_datatuple,
         )
@@ -2,12 +2,20 @@
 from __future__ import annotations
 from enum import Enum, auto
 import logging
-from typing import NamedTuple, Sequence
+import math
+from typing import Iterator, NamedTuple, Sequence
 
 import torch
 from torch import Tensor
 
-__all__ = ["mmd2", "KernelType", "KernelOut"]
+__all__ = [
+    "mmd2",
+    "mmd2_test",
+    "KernelType",
+    "KernelOut",
+    "MmdTestOut",
+    "RandomFourierFeatures",
+]
 
 
 log = logging.getLogger(__name__)
@@ -19,6 +27,7 @@ class KernelType(Enum):
     LINEAR = auto()
     RBF = auto()
     RQ = auto()
+    RBF_RFF = auto()
 
 
 class KernelOut(NamedTuple):
@@ -28,6 +37,63 @@ class KernelOut(NamedTuple):
     const_diag: float
 
 
+class MmdTestOut(NamedTuple):
+    """MMD^2 of two samples and its permutation-test p-value."""
+
+    mmd2: Tensor
+    p_value: Tensor
+
+
+class RandomFourierFeatures:
+    """Random Fourier features of the multi-scale RBF kernel used by :func:`mmd2`.
+
+    The inner product of two feature vectors approximates the weighted sum of RBF kernels, with
+    ``num_features`` split evenly over the scales. The count is rounded up to a multiple of the
+    number of scales, so the default of 1024 with six scales gives 1026 features. The frequencies
+    are drawn from a seeded generator on first use, and drawn again on the first use after
+    :meth:`resample`.
+    """
+
+    def __init__(
+        self,
+        num_features: int = 1024,
+        *,
+        scales: Sequence[float] | None = None,
+        wts: Sequence[float] | None = None,
+        seed: int = 0,
+    ):
+        self.scales = (2.0, 5.0, 10.0, 20.0, 40.0, 80.0) if scales is None else scales
+        self.wts = [1.0] * len(self.scales) if wts is None else wts
+        self.features_per_scale = max(1, math.ceil(num_features / len(self.scales)))
+        self.generator = torch.Generator().manual_seed(seed)
+        self._freqs: Tensor | None = None
+        self._phases: Tensor | None = None
+        self._amplitudes: Tensor | None = None
+
+    def resample(self) -> None:
+        self._freqs = None
+
+    def _sample(self, dim: int) -> None:
+        num_features = self.features_per_scale * len(self.scales)
+        # the spectral density of exp(-d^2 / (2 * sigma^2)) is a normal with std 1 / sigma
+        sigmas = torch.tensor(self.scales).repeat_interleave(self.features_per_scale)
+        self._freqs = torch.randn(dim, num_features, generator=self.generator) / sigmas
+        self._phases = 2 * math.pi * torch.rand(num_features, generator=self.generator)
+        wts = torch.tensor(self.wts).repeat_interleave(self.features_per_scale)
+        self._amplitudes = (2 * wts / self.features_per_scale).sqrt()
+
+    def __call__(self, x: Tensor) -> Tensor:
+        if self._freqs is None or self._freqs.shape[0] != x.shape[1]:
+            self._sample(x.shape[1])
+        assert self._freqs is not None and self._phases is not None
+        assert self._amplitudes is not None
+        if self._freqs.device != x.device or self._freqs.dtype != x.dtype:
+            self._freqs = self._freqs.to(x)
+            self._phases = self._phases.to(x)
+            self._amplitudes = self._amplitudes.to(x)
+        return torch.cos(torch.addmm(self._phases, x, self._freqs)) * self._amplitudes
+
+
 def _dot_kernel(x: Tensor, y: Tensor) -> KernelOut:
     xx_gm = x @ x.t()
     xy_gm = x @ y.t()
@@ -36,6 +102,46 @@ def _dot_kernel(x: Tensor, y: Tensor) -> KernelOut:
     return KernelOut(xx=xx_gm, xy=xy_gm, yy=yy_gm, const_diag=0.0)
 
 
+def _linear_mmd2(x: Tensor, y: Tensor, biased: bool = False) -> Tensor:
+    """MMD^2 for the linear kernel, from the group sums and norms instead of the Gram matrices.
+
+    The sum of a linear Gram matrix is the squared norm of the summed samples and its trace is
+    the sum of the squared sample norms, so this matches ``_mmd2(_dot_kernel(x, y))`` in O(N*d).
+    """
+    dim_m = x.size(0)
+    dim_n = y.size(0)
+
+    if biased:
+        return (x.mean(dim=0) - y.mean(dim=0)).pow(2).sum()
+    x_sum = x.sum(dim=0)
+    y_sum = y.sum(dim=0)
+    return (
+        (x_sum @ x_sum - x.pow(2).sum()) / (dim_m * (dim_m - 1))
+        + (y_sum @ y_sum - y.pow(2).sum()) / (dim_n * (dim_n - 1))
+        - (2 * (x_sum @ y_sum) / (dim_m * dim_n))
+    )
+
+
+def _rff_mmd2(x: Tensor, y: Tensor, *, features: RandomFourierFeatures, biased: bool) -> Tensor:
+    """Approximate RBF MMD^2 from the mean embeddings of random Fourier features, in O(N*D).
+
+    The kernel sums are estimated from the feature sums, and the unbiased estimate removes the
+    same diagonal as the exact RBF version.
+    """
+    x_sum = features(x).sum(dim=0)
+    y_sum = features(y).sum(dim=0)
+    return _mmd2_from_sums(
+        xx=x_sum @ x_sum,
+        xy=x_sum @ y_sum,
+        yy=y_sum @ y_sum,
+        dim_m=x.size(0),
+        dim_n=y.size(0),
+        trace_x=torch.tensor(x.size(0)),
+        trace_y=torch.tensor(y.size(0)),
+        biased=biased,
+    )
+
+
 def _mix_rq_kernel(
     x: Tensor,
     y: Tensor,
@@ -131,26 +237,169 @@ def _mix_rbf_kernel(
     return KernelOut(xx=k_xx, xy=k_xy, yy=k_yy, const_diag=sum(wts))
 
 
+def _tiles(num_rows: int, tile_size: int) -> Iterator[slice]:
+    for start in range(0, num_rows, tile_size):
+        yield slice(start, min(start + tile_size, num_rows))
+
+
+def _tile_size(memory_budget: int, element_size: int) -> int:
+    # a tile holds the Gram block, the squared distances and the kernel values
+    return max(1, math.isqrt(memory_budget // (3 * element_size)))
+
+
+def _sq_dists(a: Tensor, b: Tensor, a_sqnorms: Tensor, b_sqnorms: Tensor) -> Tensor:
+    return -2 * a @ b.t() + a_sqnorms.unsqueeze(1) + b_sqnorms.unsqueeze(0)
+
+
+def _tiled_rbf_sums(
+    a: Tensor, b: Tensor, *, scales: Sequence[float], wts: Sequence[float], tile_size: int
+) -> tuple[Tensor, Tensor]:
+    """Sum and trace of the RBF kernel matrix between ``a`` and ``b``, one tile at a time."""
+    a_sqnorms = a.pow(2).sum(dim=1)
+    b_sqnorms = b.pow(2).sum(dim=1)
+    gammas = [1.0 / (2 * sigma ** 2) for sigma in scales]
+    total = a.new_zeros(())
+    trace = a.new_zeros(())
+    for rows in _tiles(a.size(0), tile_size):
+        for cols in _tiles(b.size(0), tile_size):
+            sq_dists = _sq_dists(a[rows], b[cols], a_sqnorms[rows], b_sqnorms[cols])
+            k_tile = a.new_zeros(sq_dists.shape)
+            for gamma, weight in zip(gammas, wts):
+                k_tile += weight * torch.exp(-gamma * sq_dists)
+            total += k_tile.sum()
+            if rows == cols:
+                trace += k_tile.diagonal().sum()
+    return total, trace
+
+
+def _tiled_rq_sums(
+    a: Tensor,
+    b: Tensor,
+    *,
+    scales: Sequence[float],
+    wts: Sequence[float],
+    add_dot: float,
+    tile_size: int,
+) -> tuple[Tensor, Tensor | None]:
+    """Sum and trace of the kernel that :func:`_mix_rq_kernel` returns, one tile at a time.
+
+    Like the full version, the squared distances are reduced to their maximum over the rows
+    of ``a`` before the kernel is applied, and ``add_dot`` broadcasts that back to a matrix.
+    The trace is only defined when ``a`` and ``b`` are the same samples.
+    """
+    a_sqnorms = a.pow(2).sum(dim=1)
+    b_sqnorms = b.pow(2).sum(dim=1)
+    max_sq_dists = b.new_empty(b.size(0))
+    for cols in _tiles(b.size(0), tile_size):
+        for rows in _tiles(a.size(0), tile_size):
+            tile_max = _sq_dists(a[rows], b[cols], a_sqnorms[rows], b_sqnorms[cols]).max(dim=0)[0]
+            if rows.start == 0:
+                max_sq_dists[cols] = tile_max
+            else:
+                max_sq_dists[cols] = torch.max(max_sq_dists[cols], tile_max)
+    k_cols = a.new_zeros(max_sq_dists.shape)
+    for alpha, weight in zip(scales, wts):
+        k_cols += weight * torch.exp(-alpha * torch.log(1.0 + max_sq_dists / (2.0 * alpha)))
+    if add_dot > 0:
+        total = a.size(0) * k_cols.sum() + add_dot * (a.sum(dim=0) @ b.sum(dim=0))
+        return total, (k_cols + add_dot * a_sqnorms).sum() if a is b else None
+    return k_cols.sum(), None
+
+
+def _tiled_mmd2(
+    x: Tensor,
+    y: Tensor,
+    *,
+    kernel: KernelType,
+    biased: bool,
+    scales: Sequence[float] | None,
+    wts: Sequence[float] | None,
+    add_dot: float,
+    memory_budget: int,
+) -> Tensor:
+    """The RBF or RQ MMD^2 without materialising the full kernel matrices.
+
+    The pairs are visited in square tiles that fit in ``memory_budget`` bytes, and each tile's
+    kernel values for all scales are summed in one pass.
+    """
+    tile_size = _tile_size(memory_budget, x.element_size())
+    pairs = {"xx": (x, x), "xy": (x, y), "yy": (y, y)}
+    if kernel is KernelType.RBF:
+        scales = (2.0, 5.0, 10.0, 20.0, 40.0, 80.0) if scales is None else scales
+        wts = [1.0] * len(scales) if wts is None else wts
+        sums = {
+            name: _tiled_rbf_sums(a, b, scales=scales, wts=wts, tile_size=tile_size)
+            for name, (a, b) in pairs.items()
+        }
+    else:
+        scales = (0.1, 1.0, 10.0) if scales is None else scales
+        wts = [1.0] * len(scales) if wts is None else wts
+        sums = {
+            name: _tiled_rq_sums(a, b, scales=scales, wts=wts, add_dot=add_dot, tile_size=tile_size)
+            for name, (a, b) in pairs.items()
+        }
+    dim_m = x.size(0)
+    dim_n = y.size(0)
+
+    if biased or sum(wts) != 0.0:
+        trace_x: Tensor | None = torch.tensor(dim_m)
+        trace_y: Tensor | None = torch.tensor(dim_n)
+    else:
+        trace_x = sums["xx"][1]
+        trace_y = sums["yy"][1]
+        if trace_x is None or trace_y is None:
+            raise ValueError("The RQ kernel has no trace without `add_dot` if `wts` sum to 0.")
+    return _mmd2_from_sums(
+        xx=sums["xx"][0],
+        xy=sums["xy"][0],
+        yy=sums["yy"][0],
+        dim_m=dim_m,
+        dim_n=dim_n,
+        trace_x=trace_x,
+        trace_y=trace_y,
+        biased=biased,
+    )
+
+
+def _mmd2_from_sums(
+    *,
+    xx: Tensor,
+    xy: Tensor,
+    yy: Tensor,
+    dim_m: int,
+    dim_n: int,
+    trace_x: Tensor,
+    trace_y: Tensor,
+    biased: bool,
+) -> Tensor:
+    if biased:
+        return xx / (dim_m * dim_m) + yy / (dim_n * dim_n) - 2 * xy / (dim_m * dim_n)
+    return (
+        (xx - trace_x) / (dim_m * (dim_m - 1))
+        + (yy - trace_y) / (dim_n * (dim_n - 1))
+        - (2 * xy / (dim_m * dim_n))
+    )
+
+
 def _mmd2(kernel: KernelOut, biased: bool = False) -> Tensor:
     dim_m = kernel.xx.size(0)
     dim_n = kernel.yy.size(0)
 
-    if biased:
-        return (
-            kernel.xx.sum() / (dim_m * dim_m)
-            + kernel.yy.sum() / (dim_n * dim_n)
-            - 2 * kernel.xy.sum() / (dim_m * dim_n)
-        )
-    if kernel.const_diag != 0.0:
+    if biased or kernel.const_diag != 0.0:
         trace_x = torch.tensor(dim_m)
         trace_y = torch.tensor(dim_n)
     else:
         trace_x = kernel.xx.trace()
         trace_y = kernel.yy.trace()
-    return (
-        (kernel.xx.sum() - trace_x) / (dim_m * (dim_m - 1))
-        + (kernel.yy.sum() - trace_y) / (dim_n * (dim_n - 1))
-        - (2 * kernel.xy.sum() / (dim_m * dim_n))
+    return _mmd2_from_sums(
+        xx=kernel.xx.sum(),
+        xy=kernel.xy.sum(),
+        yy=kernel.yy.sum(),
+        dim_m=dim_m,
+        dim_n=dim_n,
+        trace_x=trace_x,
+        trace_y=trace_y,
+        biased=biased,
     )
 
 
@@ -162,8 +411,15 @@ def mmd2(
     scales: Sequence[float] | None = None,
     wts: Sequence[float] | None = None,
     add_dot: float = 0.0,
+    memory_budget: int | None = None,
+    features: RandomFourierFeatures | None = None,
 ) -> Tensor:
-    """MMD."""
+    """MMD.
+
+    With a ``memory_budget`` in bytes, the RBF and RQ kernels are evaluated in tiles of at most
+    that size instead of as full matrices. ``RBF_RFF`` approximates the RBF kernel with the
+    random Fourier ``features``, or with freshly seeded ones for ``scales`` and ``wts``.
+    """
     if x.shape[0] < 2 or y.shape[0] < 2:
         log.warning(
             "Not enough samples in one group to perform MMD. "
@@ -171,11 +427,132 @@ def mmd2(
         )
         return torch.tensor(0.0)
     if kernel is KernelType.LINEAR:
-        kernel_out = _dot_kernel(x=x, y=y)
-    elif kernel is KernelType.RBF:
+        return _linear_mmd2(x=x, y=y, biased=biased)
+    if kernel is KernelType.RBF_RFF:
+        if features is None:
+            features = RandomFourierFeatures(scales=scales, wts=wts)
+        return _rff_mmd2(x, y, features=features, biased=biased)
+    if memory_budget is not None and kernel in (KernelType.RBF, KernelType.RQ):
+        return _tiled_mmd2(
+            x,
+            y,
+            kernel=kernel,
+            biased=biased,
+            scales=scales,
+            wts=wts,
+            add_dot=add_dot,
+            memory_budget=memory_budget,
+        )
+    if kernel is KernelType.RBF:
         kernel_out = _mix_rbf_kernel(x=x, y=y, scales=scales, wts=wts)
     elif kernel is KernelType.RQ:
         kernel_out = _mix_rq_kernel(x=x, y=y, scales=scales, wts=wts, add_dot=add_dot)
     else:
-        raise NotImplementedError("Only RBF, Linear and RQ kernels implemented.")
+        raise NotImplementedError("Only RBF, RBF_RFF, Linear and RQ kernels implemented.")
     return _mmd2(kernel_out, biased)
+
+
+def _pooled_kernel_matmul(
+    pooled: Tensor,
+    assign: Tensor,
+    *,
+    kernel: KernelType,
+    scales: Sequence[float] | None,
+    wts: Sequence[float] | None,
+    features: RandomFourierFeatures | None,
+    memory_budget: int | None,
+) -> tuple[Tensor, Tensor]:
+    """``K @ assign`` for the kernel matrix of the pooled samples, and the diagonal of ``K``.
+
+    The diagonal is the one :func:`mmd2` removes in the unbiased estimate. For the RBF kernel
+    ``K`` is built once, in blocks of rows that fit in ``memory_budget`` bytes if one is given.
+    """
+    if kernel is KernelType.LINEAR:
+        return pooled @ (pooled.t() @ assign), pooled.pow(2).sum(dim=1)
+    if kernel is KernelType.RBF_RFF:
+        if features is None:
+            features = RandomFourierFeatures(scales=scales, wts=wts)
+        phi = features(pooled)
+        return phi @ (phi.t() @ assign), pooled.new_ones(pooled.size(0))
+    if kernel is not KernelType.RBF:
+        raise NotImplementedError("Only RBF, RBF_RFF and Linear kernels have a permutation test.")
+    scales = (2.0, 5.0, 10.0, 20.0, 40.0, 80.0) if scales is None else scales
+    wts = [1.0] * len(scales) if wts is None else wts
+    num_rows = pooled.size(0)
+    if memory_budget is None:
+        tile_size = num_rows
+    else:
+        # a block holds the Gram rows, the squared distances and the kernel values
+        tile_size = max(1, memory_budget // (3 * pooled.element_size() * num_rows))
+    sqnorms = pooled.pow(2).sum(dim=1)
+    gammas = [1.0 / (2 * sigma ** 2) for sigma in scales]
+    k_assign = assign.new_empty(num_rows, assign.size(1))
+    for rows in _tiles(num_rows, tile_size):
+        sq_dists = _sq_dists(pooled[rows], pooled, sqnorms[rows], sqnorms)
+        k_rows = pooled.new_zeros(sq_dists.shape)
+        for gamma, weight in zip(gammas, wts):
+            k_rows += weight * torch.exp(-gamma * sq_dists)
+        k_assign[rows] = k_rows @ assign
+    return k_assign, pooled.new_full((num_rows,), float(sum(wts) != 0.0))
+
+
+def mmd2_test(
+    x: Tensor,
+    y: Tensor,
+    kernel: KernelType = KernelType.RBF,
+    biased: bool = False,
+    scales: Sequence[float] | None = None,
+    wts: Sequence[float] | None = None,
+    memory_budget: int | None = None,
+    features: RandomFourierFeatures | None = None,
+    num_permutations: int = 200,
+    seed: int = 0,
+) -> MmdTestOut:
+    """MMD^2 with a permutation-test p-value for the hypothesis that ``x`` and ``y`` match.
+
+    Each permutation is an indicator column of the pooled samples that go to ``x``. The kernel
+    matrix is applied to all of them at once, after which the MMD^2 of every permutation comes
+    from a few reductions. The p-value is ``(1 + #{permuted >= observed}) / (1 + P)``.
+    """
+    if x.shape[0] < 2 or y.shape[0] < 2:
+        log.warning(
+            "Not enough samples in one group to perform MMD. "
+            "Returning 0 to not crash, but you should increase the batch size."
+        )
+        return MmdTestOut(mmd2=torch.tensor(0.0), p_value=torch.tensor(1.0))
+    dim_m = x.size(0)
+    dim_n = y.size(0)
+    pooled = torch.cat([x, y], dim=0)
+
+    generator = torch.Generator().manual_seed(seed)
+    ranks = torch.rand(num_permutations, dim_m + dim_n, generator=generator).argsort(dim=1)
+    # the first column is the observed split
+    assign = torch.cat([torch.arange(dim_m + dim_n)[None], ranks], dim=0).t() < dim_m
+    assign = assign.to(pooled)
+
+    # a column of ones gives the row sums of the kernel matrix from the same pass
+    k_assign, diag = _pooled_kernel_matmul(
+        pooled,
+        torch.cat([assign.new_ones(dim_m + dim_n, 1), assign], dim=1),
+        kernel=kernel,
+        scales=scales,
+        wts=wts,
+        features=features,
+        memory_budget=memory_budget,
+    )
+    row_sums, k_assign = k_assign[:, 0], k_assign[:, 1:]
+    xx = (assign * k_assign).sum(dim=0)
+    in_x = row_sums @ assign
+    trace_x = diag @ assign
+    stats = _mmd2_from_sums(
+        xx=xx,
+        xy=in_x - xx,
+        yy=row_sums.sum() - 2 * in_x + xx,
+        dim_m=dim_m,
+        dim_n=dim_n,
+        trace_x=trace_x,
+        trace_y=diag.sum() - trace_x,
+        biased=biased,
+    )
+    p_value = (1 + (stats[1:] >= stats[0]).sum()) / (1 + num_permutations)
+    return MmdTestOut(mmd2=stats[0], p_value=p_value)
@@ -1,6 +1,7 @@
 """Utility functions."""
 from __future__ import annotations
 import collections
+import math
 from typing import Any, MutableMapping
 import warnings
 
@@ -18,6 +19,7 @@ __all__ = [
     "facct_mapper",
     "facct_mapper_2",
     "facct_mapper_outcomes",
+    "Accumulator",
     "HistoryPool",
     "Stratifier",
 ]
@@ -91,28 +93,111 @@ def facct_mapper_outcomes(mapped: pd.Series, fair: bool) -> pd.Series:
     return pd.Series({i: lookup[d] for i, d in enumerate(mapped)})
 
 
+class Accumulator:
+    """Collect per-batch tensors in per-field buffers that are written in place.
+
+    A field's buffer is allocated on its first batch: with ``num_rows`` it holds exactly that
+    many rows, with ``num_batches`` it holds that many batches of the first batch's size, and
+    it doubles whenever it fills up. Reading a field gives a view of the rows written so far.
+    Rows are stacked along dimension 0, or along ``row_dims[field]``.
+    """
+
+    def __init__(
+        self,
+        *,
+        num_batches: float | None = None,
+        num_rows: int | None = None,
+        row_dims: dict[str, int] | None = None,
+    ):
+        finite = num_batches is not None and math.isfinite(num_batches)
+        self.num_batches = int(num_batches) if finite else None  # type: ignore[arg-type]
+        self.num_rows = num_rows
+        self.row_dims = {} if row_dims is None else row_dims
+        self._buffers: dict[str, Tensor] = {}
+        self._lengths: dict[str, int] = {}
+
+    def append(self, **fields: Tensor | None) -> None:
+        """Write a batch of each field after the rows already collected; ``None`` is skipped."""
+        for name, value in fields.items():
+            if value is None:
+                continue
+            dim = self.row_dims.get(name, 0)
+            length = self._lengths.get(name, 0)
+            stop = length + value.shape[dim]
+            buffer = self._buffers.get(name)
+            if buffer is None or buffer.shape[dim] < stop:
+                buffer = self._grow(buffer, value, dim=dim, length=length, stop=stop)
+                self._buffers[name] = buffer
+            buffer.narrow(dim, length, value.shape[dim]).copy_(value.detach())
+            self._lengths[name] = stop
+
+    def _grow(
+        self, buffer: Tensor | None, value: Tensor, *, dim: int, length: int, stop: int
+    ) -> Tensor:
+        if buffer is not None:
+            capacity = 2 * buffer.shape[dim]
+        elif self.num_rows is not None:
+            capacity = self.num_rows
+        elif self.num_batches is not None:
+            capacity = self.num_batches * value.shape[dim]
+        else:
+            capacity = stop
+        shape = list(value.shape)
+        shape[dim] = max(capacity, stop)
+        grown = value.new_empty(shape)
+        if buffer is not None:
+            grown.narrow(dim, 0, length).copy_(buffer.narrow(dim, 0, length))
+        return grown
+
+    def __getitem__(self, name: str) -> Tensor:
+        return self._buffers[name].narrow(self.row_dims.get(name, 0), 0, self._lengths[name])
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._buffers
+
+
 class HistoryPool:
-    def __init__(self, pool_size: int = 50):
+    """Pool of previously generated samples, kept in a preallocated buffer.
+
+    Until the pool is full, incoming samples are stored and returned unchanged. After that,
+    each incoming sample is picked with probability 0.5, and at most ``pool_size`` picked
+    samples per batch are swapped with stored ones in distinct, randomly chosen slots. The
+    other samples are returned unchanged. The original list-based pool drew a slot for every
+    sample with replacement, so one slot could be hit twice in a batch. Here every swapped-out
+    sample is returned exactly once. All of a batch's draws come from one seeded generator,
+    and the swaps are applied with one gather and one scatter.
+    """
+
+    def __init__(self, pool_size: int = 50, *, seed: int = 0):
         self.nb_samples = 0
-        self.history_pool: list[Tensor] = []
+        self.history_pool: Tensor | None = None
         self.pool_sz = pool_size
+        self.generator = torch.Generator().manual_seed(seed)
 
     def push_and_pop(self, samples: Tensor) -> Tensor:
-        samples_to_return = []
-        for sample in samples:
-            sample = torch.unsqueeze(sample, 0)
-            if self.nb_samples < self.pool_sz:
-                self.history_pool.append(sample)
-                samples_to_return.append(sample)
-                self.nb_samples += 1
-            elif np.random.uniform(0, 1) > 0.5:
-                rand_int = np.random.randint(0, self.pool_sz)
-                temp_img = self.history_pool[rand_int].clone()
-                self.history_pool[rand_int] = sample
-                samples_to_return.append(temp_img)
-            else:
-                samples_to_return.append(sample)
-        return torch.cat(samples_to_return, 0)
+        if self.history_pool is None:
+            self.history_pool = samples.new_empty((self.pool_sz, *samples.shape[1:]))
+        elif self.history_pool.device != samples.device:
+            self.history_pool = self.history_pool.to(samples.device)
+
+        num_fill = min(self.pool_sz - self.nb_samples, samples.shape[0])
+        stop = self.nb_samples + num_fill
+        self.history_pool[self.nb_samples : stop] = samples[:num_fill].detach()
+        self.nb_samples = stop
+        num_rest = samples.shape[0] - num_fill
+        if num_rest == 0:
+            return samples
+
+        # distinct slots, so that every swapped-out sample is returned exactly once
+        swap = torch.rand(num_rest, generator=self.generator) > 0.5
+        rows = swap.nonzero(as_tuple=True)[0][: self.pool_sz]
+        slots = torch.randperm(self.pool_sz, generator=self.generator)[: rows.shape[0]]
+        rows = (rows + num_fill).to(samples.device)
+        slots = slots.to(samples.device)
+        samples_to_return = samples.clone()
+        samples_to_return[rows] = self.history_pool[slots]
+        self.history_pool[slots] = samples[rows].detach()
+        return samples_to_return
 
 
 class Stratifier:
@@ -1,21 +1,41 @@
 """Basic tests."""
 from __future__ import annotations
 import copy
+from pathlib import Path
 from typing import Final
 
 from hydra.core.config_store import ConfigStore
 from hydra.experimental import compose, initialize
 from hydra.utils import instantiate
+import numpy as np
 from omegaconf import OmegaConf
+import pandas as pd
 import pytest
 import pytorch_lightning as pl
-from sklearn.preprocessing import MinMaxScaler
+import scipy
+from sklearn.preprocessing import MinMaxScaler, StandardScaler
 import torch
 
 from paf.architectures.paf_model import PafModel
+from paf.base_templates.data_cache import load_datatuple
+from paf.base_templates.dataset_utils import StratifiedBatchSampler
 from paf.config_classes.pytorch_lightning.trainer.configs import (  # type: ignore[import]
     TrainerConf,
 )
+from paf.data_modules import LilliputDataModule
+from paf.datasets.lilliput import _round2, _screen, lilliput
+from paf.datasets.streaming import (
+    lilliput_chunks,
+    simple_x_chunks,
+    third_way_chunks,
+    write_chunks,
+)
+from paf.datasets.third_way import (
+    make_x_bar,
+    make_y_true_bar,
+    third_way_calibration,
+    third_way_data,
+)
 from paf.main import Config, run_paf
 
 cs = ConfigStore.instance()
@@ -229,7 +249,353 @@ def test_clfmod(dm_schema: str) -> None:
         model = PafModel(encoder=encoder, classifier=classifier)
         model_trainer.fit(model=model, datamodule=data)
         results = model.collate_results(
-            model_trainer.predict(model=model, ckpt_path=None, dataloaders=data.test_dataloader())
+            model_trainer.predict(model=model, ckpt_path=None, dataloaders=data.test_dataloader()),
+            cycle_steps=3,
         )
 
         print(results.pd_results)
+        assert list(results.cyc_vals.index) == ["mean", "q05", "q50", "q95"]
+        assert list(results.cyc_vals.columns) == [f"Cycle_loss/{i}" for i in range(3)]
+
+        recons = torch.stack([results.recons_0, results.recons_1])
+        loss, cyc_vals = model.measure_cycle(results.x, results.s, recons, steps=3, batch_size=50)
+        assert results.cycle_loss is not None and loss is not None
+        torch.testing.assert_allclose(loss, results.cycle_loss)
+        pd.testing.assert_frame_equal(cyc_vals, results.cyc_vals)
+
+        _, cyc_vals = model.measure_cycle(results.x, results.s, recons, steps=3, subsample=20)
+        assert cyc_vals.shape == (4, 3)
+        _, cyc_vals = model.measure_cycle(results.x, results.s, recons, steps=3, tol=float("inf"))
+        assert list(cyc_vals.columns) == ["Cycle_loss/0", "Cycle_loss/1"]
+
+
+def test_batched_dataset() -> None:
+    """Check that a batch fetched with one index per field matches the per-row samples."""
+    with initialize(config_path=CFG_PTH):
+        hydra_cfg = compose(config_name="base_conf", overrides=["data=lill"] + SCHEMAS)
+        cfg: Config = instantiate(hydra_cfg, _recursive_=True, _convert_="partial")
+        cfg.data.prepare_data()
+        cfg.data.setup()
+
+        dataset = cfg.data.test_dataloader().dataset
+        indices = [3, 0, 7, 7, 1]
+        batch = dataset[indices]
+        for field, batched in zip(batch._fields, batch):
+            rows = torch.stack([getattr(dataset[i], field) for i in indices])
+            torch.testing.assert_allclose(batched, rows)
+
+        loader = cfg.data.test_dataloader()
+        assert sum(len(batch.s) for batch in loader) == len(dataset)
+
+        assert cfg.data.test_dataloader().dataset is dataset
+        # new data values invalidate the memoised datasets (a second `setup` is a no-op)
+        cfg.data.set_data_values(
+            dataset=cfg.data.dataset,
+            factual_data=cfg.data.factual_data,
+            dts=cfg.data.data_group,
+            best_guess=cfg.data.best_guess,
+            true_dts=cfg.data.true_data_group,
+            cf_dts=cfg.data.cf_data_group,
+            cf_outcomes=cfg.data.cf_outcomes,
+        )
+        assert cfg.data.test_dataloader().dataset is not dataset
+
+
+def test_in_memory_loader() -> None:
+    """Check that the in-memory loader covers the split exactly once per epoch."""
+    with initialize(config_path=CFG_PTH):
+        hydra_cfg = compose(
+            config_name="base_conf",
+            overrides=["data=lill", "data.in_memory_loader=true"] + SCHEMAS,
+        )
+        cfg: Config = instantiate(hydra_cfg, _recursive_=True, _convert_="partial")
+        cfg.data.prepare_data()
+        cfg.data.setup()
+
+        loader = cfg.data.train_dataloader(shuffle=True, drop_last=False)
+        seen = torch.cat([batch.x for batch in loader])
+        expected = cfg.data.train_dataloader(shuffle=False, drop_last=False).data.x
+        assert len(loader) == len(list(loader))
+        torch.testing.assert_allclose(seen.sort(dim=0).values, expected.sort(dim=0).values)
+
+
+def test_data_cache(tmp_path: Path) -> None:
+    """Check that a data module loaded from the on-disk cache matches a freshly prepared one."""
+    kwargs = dict(
+        alpha=0.5,
+        gamma=0.02,
+        seed=0,
+        num_samples=1_000,
+        num_workers=0,
+        train_batch_size=64,
+        eval_batch_size=64,
+        cache_dir=str(tmp_path),
+    )
+    fresh = LilliputDataModule(**kwargs)
+    fresh.prepare_data()
+    assert fresh.cache_path is not None and fresh.cache_path.exists()
+
+    cached = LilliputDataModule(**kwargs)
+    assert cached.load_from_cache()
+    assert cached.feature_groups == fresh.feature_groups
+    assert cached.cf_outcomes is not None and fresh.cf_outcomes is not None
+    for group in ("data_group", "true_data_group", "cf_data_group"):
+        for ours, theirs in zip(getattr(cached, group), getattr(fresh, group)):
+            for field in ("x", "s", "y"):
+                pd.testing.assert_frame_equal(getattr(ours, field), getattr(theirs, field))
+    for ours, theirs in zip(cached.cf_outcomes, fresh.cf_outcomes):
+        pd.testing.assert_frame_equal(ours.y, theirs.y)
+
+    other = LilliputDataModule(**{**kwargs, "seed": 1})
+    assert other.cache_path != fresh.cache_path
+    assert not other.load_from_cache()
+
+
+def test_lilliput_vectorised_helpers() -> None:
+    """Check the vectorised rounding and screening against the row-wise pandas versions."""
+    rng = np.random.default_rng(0)
+    values = np.concatenate(
+        [rng.normal(0.5, 0.3, 10_000), [0.015, 0.125, 1.005, 2.675, 0.285, -0.015]]
+    )
+    expected = np.array([round(value, 2) for value in values.tolist()])
+    np.testing.assert_array_equal(_round2(values), expected)
+
+    scores = rng.integers(-5, 100, 1_000) / 100
+    data = pd.DataFrame({"admittance_score": scores, "other": rng.random(1_000)})
+    passed_initial_screening = data.nlargest(n=200, columns="admittance_score")
+    expected_accepted = (
+        data.where(passed_initial_screening.isin(data), 0)["admittance_score"] > 0
+    ).astype(int)
+    accepted, threshold = _screen(scores)
+    np.testing.assert_array_equal(accepted, expected_accepted.to_numpy())
+    assert threshold == passed_initial_screening["admittance_score"].min()
+
+
+def _third_way_per_row(
+    *,
+    seed: int,
+    num_hidden_features: int,
+    num_features: int,
+    num_samples: int,
+    acceptance_rate: float,
+    alpha: float,
+    gamma: float,
+    beta: float,
+    xi: float,
+    **_: int,
+) -> tuple[np.ndarray, ...]:
+    """The original per-row generator, for binary ``s`` without a random shift."""
+    num_gen = np.random.default_rng(seed)
+    x_tilde = num_gen.uniform(0, 1, size=(num_samples, num_hidden_features))
+    x_bar = np.stack([scipy.stats.norm.ppf(sample, loc=0, scale=1) for sample in x_tilde])
+    s = num_gen.binomial(1, alpha, num_samples)
+    cf_s = 1 - s
+
+    dx = x_bar + gamma * (s[:, np.newaxis] * 2 - 1)
+    cf_dx = x_bar + gamma * (cf_s[:, np.newaxis] * 2 - 1)
+    noise = np.random.RandomState(0).normal(0, 0.05, (num_samples, num_features))
+    x = np.around(dx[:, :num_features] + (xi * (s[:, np.newaxis] * 2 - 1) + noise), 2)
+    cf_x = np.around(cf_dx[:, :num_features] + (xi * (cf_s[:, np.newaxis] * 2 - 1) + noise), 2)
+
+    w = np.ones(num_hidden_features) / num_hidden_features
+    y_true_bar = pd.Series([np.dot(w, row) for row in StandardScaler().fit_transform(dx)])
+    y_true = (y_true_bar > y_true_bar.quantile(0.75)).astype(int).to_numpy()
+
+    y_bar = pd.DataFrame(x).mean(axis=1) + beta * (s * 2 - 1)
+    threshold = y_bar.quantile(1 - acceptance_rate)
+    y = (y_bar > threshold).astype(int).to_numpy()
+    cf_y_bar = pd.DataFrame(cf_x).mean(axis=1) + beta * (cf_s * 2 - 1)
+    cf_y = (cf_y_bar > threshold).astype(int).to_numpy()
+
+    idx = num_gen.permutation(num_samples)
+    return x[idx], s[idx], y[idx], y_true[idx], cf_x[idx], cf_y[idx]
+
+
+def test_third_way_vectorised() -> None:
+    """Check the matrix-wide third-way helpers against their original per-row forms."""
+    x_bar = make_x_bar(num_features=7, num_samples=500, random_state=np.random.default_rng(0))
+    x_tilde = np.random.default_rng(0).uniform(0, 1, size=(500, 7))
+    expected = np.stack([scipy.stats.norm.ppf(sample, loc=0, scale=1) for sample in x_tilde])
+    np.testing.assert_array_equal(x_bar, expected)
+
+    w = np.ones(x_bar.shape[1]) / x_bar.shape[1]
+    scaled = StandardScaler().fit_transform(x_bar)
+    np.testing.assert_allclose(
+        make_y_true_bar(x_bar, w)["y_true"].to_numpy(),
+        [np.dot(w, row) for row in scaled],
+        rtol=1e-12,
+        atol=1e-12,
+    )
+
+    kwargs = dict(
+        seed=0,
+        num_hidden_features=30,
+        num_features=5,
+        num_samples=1_000,
+        acceptance_rate=0.4,
+        alpha=0.6,
+        gamma=0.1,
+        random_shift=0,
+        binary_s=1,
+        beta=0.1,
+        xi=0.01,
+    )
+    first = third_way_data(**kwargs)
+    x, s, y, y_true, cf_x, cf_y = _third_way_per_row(**kwargs)
+    np.testing.assert_array_equal(first.data.x.to_numpy(), x)
+    np.testing.assert_array_equal(first.data.s["sens"].to_numpy(), s)
+    np.testing.assert_array_equal(first.data.y["outcome"].to_numpy(), y)
+    np.testing.assert_array_equal(first.data_true_outcome.y["y_true"].to_numpy(), y_true)
+    np.testing.assert_array_equal(first.cf_data.x.to_numpy(), cf_x)
+    np.testing.assert_array_equal(first.cf_data.y["outcome"].to_numpy(), cf_y)
+
+    # a sample's own calibration should reproduce it
+    calibrated = third_way_data(calibration=third_way_calibration(**kwargs), **kwargs)
+    pd.testing.assert_frame_equal(calibrated.data.y, first.data.y)
+    pd.testing.assert_frame_equal(calibrated.data_true_outcome.y, first.data_true_outcome.y)
+    pd.testing.assert_frame_equal(calibrated.data_xs1_ys0.y, first.data_xs1_ys0.y)
+
+
+def test_streaming(tmp_path: Path) -> None:
+    """The streamed rows should not depend on the chunk size and should round-trip to disk."""
+    kwargs = dict(seed=0, num_samples=2_500, alpha=0.6, gamma=0.2, block_size=1_000)
+    small = list(lilliput_chunks(chunk_size=300, calibration_samples=2_000, **kwargs))
+    large = list(lilliput_chunks(chunk_size=1_024, calibration_samples=2_000, **kwargs))
+    assert [len(chunk.data.x) for chunk in large] == [1_024, 1_024, 452]
+    assert all(len(chunk.data.x) == 300 for chunk in small[:-1])
+    for field in ("data", "cf_data", "data_xs1_ys0"):
+        for attr in ("x", "s", "y"):
+            pd.testing.assert_frame_equal(
+                pd.concat([getattr(getattr(c, field), attr) for c in small], ignore_index=True),
+                pd.concat([getattr(getattr(c, field), attr) for c in large], ignore_index=True),
+            )
+
+    third_way_kwargs = dict(
+        seed=0,
+        num_hidden_features=10,
+        num_features=3,
+        num_samples=2_500,
+        acceptance_rate=0.4,
+        alpha=0.6,
+        gamma=0.1,
+        random_shift=0,
+        binary_s=1,
+        beta=0.1,
+        xi=0.01,
+        block_size=1_000,
+        calibration_samples=2_000,
+    )
+    small = list(third_way_chunks(chunk_size=300, **third_way_kwargs))
+    large = list(third_way_chunks(chunk_size=1_024, **third_way_kwargs))
+    pd.testing.assert_frame_equal(
+        pd.concat([c.data_true_outcome.y for c in small], ignore_index=True),
+        pd.concat([c.data_true_outcome.y for c in large], ignore_index=True),
+    )
+
+    chunks = list(
+        simple_x_chunks(
+            seed=0,
+            num_samples=2_500,
+            alpha=0.6,
+            gamma=0.2,
+            random_shift=0,
+            binary_s=1,
+            chunk_size=700,
+            block_size=1_000,
+        )
+    )
+    write_chunks(iter(chunks), tmp_path / "simple_x", num_samples=2_500)
+    loaded = load_datatuple(tmp_path / "simple_x" / "cf")
+    np.testing.assert_array_equal(
+        loaded.x.to_numpy(), pd.concat([c.cf.x for c in chunks], ignore_index=True).to_numpy()
+    )
+    assert list(loaded.s.columns) == ["sens"]
+    assert chunks[0].dataset.num_samples == 2_500
+
+
+def test_memory_map(tmp_path: Path) -> None:
+    """The torch datasets of a memory-mapped data module should be views of the files."""
+    kwargs = dict(
+        alpha=0.5,
+        gamma=0.02,
+        seed=0,
+        num_samples=1_000,
+        num_workers=0,
+        train_batch_size=64,
+        eval_batch_size=64,
+    )
+    with pytest.raises(ValueError):
+        LilliputDataModule(**kwargs, memory_map=True)
+    in_memory = LilliputDataModule(**kwargs)
+    in_memory.prepare_data()
+    in_memory.setup()
+    mapped = LilliputDataModule(**kwargs, cache_dir=str(tmp_path), memory_map=True)
+    mapped.prepare_data()
+    mapped.setup()
+
+    assert mapped.cache_path is not None and mapped.cache_path.exists()
+    dataset = mapped.split_dataset("train", cf=True)
+    assert np.shares_memory(dataset.x.numpy(), mapped.train_datatuple.x.to_numpy())
+    assert np.shares_memory(dataset.cf_x.numpy(), mapped.cf_train_datatuple.x.to_numpy())
+    expected = in_memory.split_dataset("train", cf=True)
+    torch.testing.assert_allclose(dataset.x, expected.x)
+    torch.testing.assert_allclose(dataset.cf_y, expected.cf_y)
+
+
+def test_scale_and_split_worlds() -> None:
+    """All worlds should share the split indices and be scaled by the factual train scaler."""
+    module = LilliputDataModule(
+        alpha=0.5,
+        gamma=0.02,
+        seed=0,
+        num_samples=1_000,
+        num_workers=0,
+        train_batch_size=64,
+        eval_batch_size=64,
+    )
+    cf_data = lilliput(seed=0, alpha=0.5, num_samples=1_000, gamma=0.02)
+    dts, cf_dts = module.scale_and_split_worlds([cf_data.data, cf_data.cf_data], cf_data.dataset)
+    assert module.train_indices is not None
+    cont = cf_data.dataset.continuous_features
+    scaler = MinMaxScaler(clip=True).fit(cf_data.data.x[cont].iloc[module.train_indices])
+    for ours, world in ((dts, cf_data.data), (cf_dts, cf_data.cf_data)):
+        assert [len(split.x) for split in ours] == [700, 100, 200]
+        pd.testing.assert_frame_equal(
+            ours.train.s, world.s.iloc[module.train_indices].reset_index(drop=True)
+        )
+        np.testing.assert_allclose(
+            ours.test.x[cont].to_numpy(),
+            scaler.transform(world.x[cont].iloc[module.test_indices]),
+        )
+
+
+def test_stratified_batch_sampler() -> None:
+    """Every batch should hold the requested number of rows from each (s, y) stratum."""
+    gen = torch.Generator().manual_seed(0)
+    s = (torch.rand(1_000, generator=gen) < 0.2).float()
+    y = (torch.rand(1_000, generator=gen) < 0.3).float()
+    sampler = StratifiedBatchSampler(s=s, y=y, batch_size=64, seed=0)
+    batches = list(sampler)
+    assert len(batches) == len(sampler) == 15
+    for batch in batches:
+        index = torch.tensor(batch)
+        assert len(batch) == 64
+        for s_val in (0, 1):
+            for y_val in (0, 1):
+                assert int(((s[index] == s_val) & (y[index] == y_val)).sum()) == 16
+    assert batches == list(StratifiedBatchSampler(s=s, y=y, batch_size=64, seed=0))
+
+    quotas = StratifiedBatchSampler(s=s, y=None, batch_size=64, quotas=[40, 24], seed=0)
+    for batch in quotas:
+        assert int(s[torch.tensor(batch)].sum()) == 24
+
+    with pytest.raises(ValueError):
+        StratifiedBatchSampler(s=s, y=y, batch_size=64, quotas=[32, 32])
+
+    uneven = StratifiedBatchSampler(s=s, y=y, batch_size=66, seed=0)
+    assert uneven.quotas == [17, 17, 16, 16]
+    assert all(len(batch) == 66 for batch in uneven)
+    with pytest.raises(ValueError):
+        StratifiedBatchSampler(s=s, y=y, batch_size=3)
+    with pytest.raises(ValueError):
+        StratifiedBatchSampler(s=s, y=None, batch_size=64, quotas=[64, 0])
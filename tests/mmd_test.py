@@ -0,0 +1,103 @@
+"""Tests for the MMD functions."""
+from __future__ import annotations
+
+import pytest
+import torch
+
+from paf.mmd import (
+    KernelType,
+    RandomFourierFeatures,
+    _dot_kernel,
+    _mmd2,
+    mmd2,
+    mmd2_test,
+)
+
+
+@pytest.mark.parametrize("biased", [True, False])
+@pytest.mark.parametrize("sizes", [(2, 2), (50, 31), (300, 700)])
+def test_linear_mmd(biased: bool, sizes: tuple[int, int]) -> None:
+    """The linear-time MMD should match the one computed from the Gram matrices."""
+    gen = torch.Generator().manual_seed(sum(sizes))
+    x = torch.randn(sizes[0], 5, generator=gen, dtype=torch.float64)
+    y = torch.randn(sizes[1], 5, generator=gen, dtype=torch.float64) + 0.5
+    expected = _mmd2(_dot_kernel(x, y), biased)
+    torch.testing.assert_allclose(mmd2(x, y, kernel=KernelType.LINEAR, biased=biased), expected)
+    torch.testing.assert_allclose(
+        mmd2(x.float(), y.float(), kernel=KernelType.LINEAR, biased=biased),
+        expected.float(),
+        rtol=1e-4,
+        atol=1e-5,
+    )
+
+
+@pytest.mark.parametrize("biased", [True, False])
+@pytest.mark.parametrize("kernel", [KernelType.RBF, KernelType.RQ])
+@pytest.mark.parametrize("memory_budget", [8, 1_000, 10**9])
+def test_tiled_mmd(biased: bool, kernel: KernelType, memory_budget: int) -> None:
+    """Any memory budget should give the same MMD as the full kernel matrices."""
+    gen = torch.Generator().manual_seed(0)
+    x = torch.randn(37, 4, generator=gen, dtype=torch.float64)
+    y = torch.randn(23, 4, generator=gen, dtype=torch.float64) * 2
+    kwargs = dict(kernel=kernel, biased=biased)
+    torch.testing.assert_allclose(
+        mmd2(x, y, memory_budget=memory_budget, **kwargs), mmd2(x, y, **kwargs)
+    )
+
+
+@pytest.mark.parametrize("biased", [True, False])
+def test_tiled_rq_add_dot(biased: bool) -> None:
+    """The tiled RQ MMD with ``add_dot`` should not depend on the memory budget.
+
+    The full version can't be the reference here: it adds the Gram matrices in place to the
+    per-column kernel vectors, which fails for any ``add_dot > 0``.
+    """
+    gen = torch.Generator().manual_seed(0)
+    x = torch.randn(37, 4, generator=gen, dtype=torch.float64)
+    y = torch.randn(23, 4, generator=gen, dtype=torch.float64) * 2
+    kwargs = dict(kernel=KernelType.RQ, biased=biased, add_dot=0.5)
+    expected = mmd2(x, y, memory_budget=10**9, **kwargs)
+    for memory_budget in (8, 1_000):
+        torch.testing.assert_allclose(mmd2(x, y, memory_budget=memory_budget, **kwargs), expected)
+
+
+@pytest.mark.parametrize("biased", [True, False])
+def test_rff_mmd(biased: bool) -> None:
+    """With enough features the random Fourier MMD should be close to the exact RBF one."""
+    gen = torch.Generator().manual_seed(0)
+    x = torch.randn(200, 4, generator=gen, dtype=torch.float64)
+    y = torch.randn(150, 4, generator=gen, dtype=torch.float64) + 1
+    features = RandomFourierFeatures(num_features=24_000)
+    approx = mmd2(x, y, kernel=KernelType.RBF_RFF, biased=biased, features=features)
+    exact = mmd2(x, y, kernel=KernelType.RBF, biased=biased)
+    torch.testing.assert_allclose(approx, exact, rtol=0.1, atol=0.05)
+
+
+def test_rff_resample() -> None:
+    """The features are fixed by the seed until they are resampled."""
+    x = torch.randn(10, 3)
+    features = RandomFourierFeatures(num_features=12, seed=1)
+    phi = features(x)
+    assert phi.shape == (10, 12)
+    assert RandomFourierFeatures(num_features=1024)(x).shape == (10, 1026)
+    torch.testing.assert_allclose(features(x), phi)
+    torch.testing.assert_allclose(RandomFourierFeatures(num_features=12, seed=1)(x), phi)
+    features.resample()
+    assert not torch.allclose(features(x), phi)
+
+
+@pytest.mark.parametrize("biased", [True, False])
+@pytest.mark.parametrize("kernel", [KernelType.LINEAR, KernelType.RBF, KernelType.RBF_RFF])
+@pytest.mark.parametrize("memory_budget", [None, 1_000])
+def test_mmd2_test(biased: bool, kernel: KernelType, memory_budget: int | None) -> None:
+    """The observed statistic should match mmd2 and a clear shift should be significant."""
+    gen = torch.Generator().manual_seed(0)
+    x = torch.randn(40, 3, generator=gen, dtype=torch.float64)
+    y = torch.randn(30, 3, generator=gen, dtype=torch.float64) + 2
+    kwargs = dict(kernel=kernel, biased=biased, features=RandomFourierFeatures(num_features=60))
+    out = mmd2_test(x, y, memory_budget=memory_budget, num_permutations=50, **kwargs)
+    torch.testing.assert_allclose(out.mmd2, mmd2(x, y, **kwargs))
+    torch.testing.assert_allclose(out.p_value, 1 / 51)
+
+    same = mmd2_test(x, x.flip(0), num_permutations=50, **kwargs)
+    assert same.p_value > 0.5
@@ -0,0 +1,332 @@
+"""Tests for the model components."""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+import pytest
+import pytorch_lightning as pl
+import torch
+from torch import Tensor
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+
+from paf.architectures.model.model_components import (
+    AE,
+    Clf,
+    Decoder,
+    FeatureLayout,
+    MultiHeadDecoder,
+    augment_recons,
+    index_by_s,
+    to_discrete,
+)
+from paf.architectures.paf_model import PafModel
+from paf.base_templates import Batch
+from paf.mmd import KernelType
+from paf.utils import Accumulator, HistoryPool
+
+GROUPS = [slice(0, 3), slice(3, 4), slice(4, 9), slice(9, 11)]
+
+
+def _augment_recons_loop(x: Tensor, cf_x: Tensor, s: Tensor) -> list[Tensor]:
+    aug_list = [(x[i], cf_x[i]) if _s == 0 else (cf_x[i], x[i]) for i, _s in enumerate(s)]
+    return list((torch.stack([d[0] for d in aug_list]), torch.stack([d[1] for d in aug_list])))
+
+
+@pytest.mark.parametrize("batch_size", [1, 7, 64])
+@pytest.mark.parametrize("shape", [(), (3,), (2, 5)])
+def test_augment_recons(batch_size: int, shape: tuple[int, ...]) -> None:
+    """The vectorised version should match the original per-row loop."""
+    gen = torch.Generator().manual_seed(batch_size)
+    x = torch.randn(batch_size, *shape, generator=gen)
+    cf_x = torch.randn(batch_size, *shape, generator=gen)
+    s = torch.randint(0, 2, (batch_size,), generator=gen).float()
+    for ours, theirs in zip(augment_recons(x, cf_x, s), _augment_recons_loop(x, cf_x, s)):
+        assert torch.equal(ours, theirs)
+
+
+@pytest.mark.parametrize("groups", [GROUPS, []])
+def test_feature_layout(groups: list[slice]) -> None:
+    """The segment operations should match per-group loops."""
+    layout = FeatureLayout(groups)
+    gen = torch.Generator().manual_seed(0)
+    z = torch.randn(32, 15, generator=gen)
+
+    expected_hard = z.sigmoid()
+    expected_soft = z.sigmoid()
+    for group in groups:
+        expected_hard[:, group] = to_discrete(inputs=z[:, group]).float()
+        expected_soft[:, group] = z[:, group].softmax(dim=-1)
+    # the sigmoid of a slice can differ from that of the whole tensor by an ULP
+    torch.testing.assert_allclose(layout.invert(z), expected_hard)
+    torch.testing.assert_allclose(layout.soft_invert(z), expected_soft)
+
+    mask = layout.bernoulli_mask(64, 15, device=z.device)
+    assert mask.shape == (64, 15)
+    assert set(mask.unique().tolist()) <= {0.0, 1.0}
+    for group in groups:
+        first_column = mask[:, [group.start]]
+        assert torch.equal(mask[:, group], first_column.expand(-1, group.stop - group.start))
+
+
+def _recon_loss_loop(z: Tensor, x: Tensor, groups: list[slice]) -> Tensor:
+    loss = x.new_tensor(0.0)
+    for i in range(groups[-1].stop, x.shape[1]):
+        loss += F.l1_loss(z[:, i].sigmoid(), x[:, i])
+    for group in groups:
+        loss += F.cross_entropy(z[:, group], x[:, group].argmax(dim=-1))
+    return loss
+
+
+def test_fused_recon_loss() -> None:
+    """The fused loss should match the per-column and per-group losses and their gradients."""
+    layout = FeatureLayout(GROUPS)
+    gen = torch.Generator().manual_seed(0)
+    x = torch.cat(
+        [
+            F.one_hot(torch.randint(0, group.stop - group.start, (32,), generator=gen)).float()
+            for group in GROUPS
+        ]
+        + [torch.rand(32, 4, generator=gen)],
+        dim=1,
+    )
+    z = torch.randn(32, 15, generator=gen, requires_grad=True)
+    fused = layout.recon_loss(z, x)
+    (fused_grad,) = torch.autograd.grad(fused, z)
+    looped = _recon_loss_loop(z, x, GROUPS)
+    (looped_grad,) = torch.autograd.grad(looped, z)
+    torch.testing.assert_allclose(fused, looped)
+    torch.testing.assert_allclose(fused_grad, looped_grad)
+
+
+@pytest.mark.parametrize("blocks", [0, 1, 3])
+@pytest.mark.parametrize("num_heads", [2, 3])
+def test_multi_head_decoder(blocks: int, num_heads: int) -> None:
+    """Loading a list of decoders should give the same outputs from the stacked module."""
+    torch.manual_seed(0)
+    kwargs = dict(latent_dim=4, in_size=6, blocks=blocks, hid_multiplier=2)
+    legacy = torch.nn.ModuleDict(
+        {"decoders": torch.nn.ModuleList([Decoder(**kwargs) for _ in range(num_heads)])}
+    )
+    stacked = torch.nn.ModuleDict({"decoders": MultiHeadDecoder(num_heads=num_heads, **kwargs)})
+    stacked.load_state_dict(legacy.state_dict())
+
+    z = torch.randn(16, 4)
+    s = torch.randint(0, num_heads, (16,))
+    out = stacked["decoders"](z)
+    expected = [dec(z) for dec in legacy["decoders"]]
+    assert out.shape == (num_heads, 16, 6)
+    torch.testing.assert_allclose(out, torch.stack(expected))
+    torch.testing.assert_allclose(index_by_s(out, s), index_by_s(expected, s))
+
+
+def test_history_pool() -> None:
+    """Swapped samples should be exchanged with the pool and the draws should be seeded."""
+    batches = torch.arange(5 * 8 * 2, dtype=torch.float).view(5, 8, 2)
+    pool = HistoryPool(pool_size=12, seed=3)
+    outputs = [pool.push_and_pop(batch) for batch in batches]
+    assert torch.equal(outputs[0], batches[0])
+    assert torch.equal(outputs[1][:4], batches[1][:4])
+
+    # the samples that filled the pool were both stored and returned, every other one is in
+    # exactly one of the pool and the outputs
+    assert pool.history_pool is not None
+    seen = torch.cat([pool.history_pool] + outputs)[:, 0].sort().values
+    expected = torch.cat([batches.reshape(-1, 2), batches[0], batches[1][:4]])[:, 0]
+    assert torch.equal(seen, expected.sort().values)
+
+    again = HistoryPool(pool_size=12, seed=3)
+    for batch, output in zip(batches, outputs):
+        assert torch.equal(again.push_and_pop(batch), output)
+
+
+def _clf(**kwargs: bool) -> Clf:
+    clf = Clf(
+        adv_weight=1.0,
+        pred_weight=1.0,
+        mmd_weight=1.0,
+        lr=1e-3,
+        s_as_input=True,
+        latent_dims=4,
+        mmd_kernel="LINEAR",
+        scheduler_rate=0.99,
+        weight_decay=0.0,
+        use_iw=False,
+        encoder_blocks=2,
+        adv_blocks=1,
+        decoder_blocks=2,
+        latent_multiplier=2,
+        batch_size=32,
+        debug=False,
+        **kwargs,
+    )
+    clf.build(
+        num_s=2,
+        data_dim=6,
+        s_dim=1,
+        cf_available=False,
+        feature_groups={"discrete": []},
+        outcome_cols=["outcome"],
+        scaler=None,
+    )
+    return clf
+
+
+def test_stacked_forward() -> None:
+    """One stacked pass should match a forward pass per input."""
+    torch.manual_seed(0)
+    clf = _clf()
+    xs = [torch.rand(5, 6), torch.rand(3, 6), torch.rand(1, 6)]
+    ss = [torch.randint(0, 2, (len(x),)).float() for x in xs]
+    with torch.no_grad():
+        for stacked, x, s in zip(clf.stacked_forward(xs, ss=ss), xs, ss):
+            single = clf.forward(x=x, s=s)
+            for ours, theirs in zip(stacked, single):
+                torch.testing.assert_allclose(ours, theirs)
+
+
+def test_fused_mixup() -> None:
+    """Fusing the clean and mixup passes should not change the losses or their gradients."""
+    torch.manual_seed(0)
+    clf = _clf()
+    x = torch.rand(16, 6)
+    s = torch.arange(16).remainder(2).float()
+    y = torch.arange(16).div(2, rounding_mode="floor").remainder(2).float()
+    results = []
+    for fuse_mixup in (False, True):
+        clf.fuse_mixup = fuse_mixup
+        clf.zero_grad()
+        torch.manual_seed(1)
+        _, losses = clf.training_losses(x=x, s=s, y=y, iw=None)
+        sum(losses).backward()
+        grads = [param.grad.clone() for param in clf.parameters() if param.grad is not None]
+        results.append((torch.stack(losses), grads))
+    (losses_0, grads_0), (losses_1, grads_1) = results
+    torch.testing.assert_allclose(losses_1, losses_0)
+    assert len(grads_0) == len(grads_1)
+    for grad_1, grad_0 in zip(grads_1, grads_0):
+        torch.testing.assert_allclose(grad_1, grad_0)
+
+
+@pytest.mark.parametrize("num_batches, num_rows", [(None, None), (2, None), (None, 23), (9, None)])
+def test_accumulator(num_batches: int | None, num_rows: int | None) -> None:
+    """The buffers should hold the concatenation of the batches, however they are allocated."""
+    gen = torch.Generator().manual_seed(0)
+    batches = [
+        (torch.randn(n, 3, generator=gen), torch.randn(2, n, generator=gen)) for n in (8, 8, 7)
+    ]
+    acc = Accumulator(num_batches=num_batches, num_rows=num_rows, row_dims={"y": 1})
+    for x, y in batches:
+        acc.append(x=x, y=y, z=None)
+    assert torch.equal(acc["x"], torch.cat([x for x, _ in batches], dim=0))
+    assert torch.equal(acc["y"], torch.cat([y for _, y in batches], dim=1))
+    assert "x" in acc and "z" not in acc
+    if num_rows is not None:
+        # exactly sized buffers are contiguous, so flattening them does not copy
+        assert acc["y"].flatten(0, 1).data_ptr() == acc["y"].data_ptr()
+
+
+def _paf_model() -> PafModel:
+    enc = AE(
+        s_as_input=False,
+        latent_dims=4,
+        encoder_blocks=1,
+        latent_multiplier=2,
+        adv_blocks=1,
+        decoder_blocks=1,
+        adv_weight=1.0,
+        mmd_weight=1.0,
+        cycle_weight=1.0,
+        target_weight=1.0,
+        proxy_weight=1.0,
+        lr=1e-3,
+        mmd_kernel=KernelType.LINEAR,
+        scheduler_rate=0.99,
+        weight_decay=0.0,
+        debug=False,
+        batch_size=32,
+    )
+    enc.build(
+        num_s=2,
+        data_dim=6,
+        s_dim=1,
+        cf_available=False,
+        feature_groups={"discrete": []},
+        outcome_cols=["outcome"],
+        data=None,  # type: ignore[arg-type]
+        indices=[],
+    )
+    model = PafModel(encoder=enc, classifier=_clf())
+    model.eval()
+    return model
+
+
+def test_measure_cycle() -> None:
+    """Batching, early stopping and subsampling of the cycle measurement."""
+    torch.manual_seed(0)
+    model = _paf_model()
+    x = torch.rand(20, 6)
+    s = torch.arange(20).remainder(2).float()
+    with torch.no_grad():
+        recons = torch.stack(list(model.enc.forward(x=x, s=s).x))
+    original = recons.clone()
+
+    loss, stats = model.measure_cycle(x, s, recons, steps=3)
+    assert loss is not None and loss.shape == x.shape
+    assert list(stats.columns) == [f"Cycle_loss/{i}" for i in range(3)]
+    assert list(stats.index) == ["mean", "q05", "q50", "q95"]
+    assert stats.loc["mean", "Cycle_loss/2"] == pytest.approx(loss.mean().item(), rel=1e-5)
+    assert torch.equal(recons, original)
+
+    batched_loss, batched_stats = model.measure_cycle(x, s, recons, steps=3, batch_size=7)
+    assert batched_loss is not None
+    torch.testing.assert_allclose(batched_loss, loss)
+    np.testing.assert_allclose(batched_stats.to_numpy(), stats.to_numpy(), rtol=1e-5)
+
+    # every change is below an infinite tolerance, so the loop stops after the second step
+    _, early_stats = model.measure_cycle(x, s, recons, steps=3, tol=float("inf"))
+    assert list(early_stats.columns) == ["Cycle_loss/0", "Cycle_loss/1"]
+
+    sub_loss, sub_stats = model.measure_cycle(x, s, recons, steps=2, subsample=5, seed=1)
+    assert sub_loss is not None and sub_loss.shape == (5, 6)
+    again_loss, again_stats = model.measure_cycle(x, s, recons, steps=2, subsample=5, seed=1)
+    assert again_loss is not None
+    assert torch.equal(again_loss, sub_loss)
+    pd.testing.assert_frame_equal(again_stats, sub_stats)
+
+
+def test_collate_results() -> None:
+    """The preallocated predict buffers should match a concatenation of the step outputs."""
+    torch.manual_seed(0)
+    model = _paf_model()
+    x = torch.rand(23, 6)
+    s = torch.arange(23).remainder(2).float()
+    y = torch.arange(23).div(3, rounding_mode="floor").remainder(2).float()
+    samples = [Batch(x=x[i], s=s[i], y=y[i], iw=torch.tensor(1.0)) for i in range(len(x))]
+    loader = DataLoader(samples, batch_size=5)
+
+    steps = []
+    with torch.no_grad():
+        for batch in loader:
+            model.predictions = Accumulator(row_dims={"clf_z": 1, "recons": 1})
+            model.predict_step(batch, 0)
+            steps.append(model.predictions)
+
+    trainer = pl.Trainer(logger=False, enable_checkpointing=False, enable_progress_bar=False)
+    results = model.collate_results(trainer.predict(model=model, dataloaders=loader))
+
+    def _cat(name: str, dim: int = 0) -> Tensor:
+        return torch.cat([step[name] for step in steps], dim=dim)
+
+    torch.testing.assert_allclose(results.x, _cat("x"))
+    torch.testing.assert_allclose(results.s, _cat("s"))
+    torch.testing.assert_allclose(results.cf_x, _cat("cf_recon"))
+    torch.testing.assert_allclose(results.preds_1_0, _cat("preds_1_0"))
+    clf_z = _cat("clf_z", dim=1)
+    torch.testing.assert_allclose(results.clf_z0, clf_z[0])
+    torch.testing.assert_allclose(results.clf_z1, clf_z[1])
+    torch.testing.assert_allclose(results.clf_z, torch.cat([clf_z[0], clf_z[1]]))
+    recons = _cat("recons", dim=1)
+    torch.testing.assert_allclose(results.recons_0, recons[0])
+    torch.testing.assert_allclose(results.recons_1, recons[1])
+    assert len(results.pd_results) == len(x)
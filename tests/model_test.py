@@ -136,6 +136,19 @@ def test_knn() -> None:
         assert torch.allclose(x, features)
 
 
+def test_knn_fit_query() -> None:
+    """A fitted index should answer repeated queries like a freshly built one."""
+    gen = torch.Generator().manual_seed(0)
+    train = torch.randn(500, 6, generator=gen)
+    knn = KnnExact(k=3, normalize=False)
+    with pytest.raises(RuntimeError):
+        knn.query(train)
+    knn.fit(train)
+    for _ in range(2):
+        x = torch.randn(32, 6, generator=gen)
+        assert torch.equal(knn.query(x), KnnExact(k=3, normalize=False)(x=x, y=train))
+
+
 @pytest.mark.parametrize("model", ["ERM_DP", "EQ_DP", "ERM_KAM", "EQ_KAM"])
 @pytest.mark.parametrize("dm_schema", ["ad", "law", "lill"])
 def test_erm_dp(model: str, dm_schema: str) -> None:
@@ -167,6 +180,21 @@ def test_model_type(model: str, dm_schema: str) -> None:
         run_paf(cfg, raw_config=OmegaConf.to_container(hydra_cfg, resolve=True, enum_to_str=True))
 
 
+@pytest.mark.parametrize("dm_schema", ["ad", "lill"])
+def test_cyc_manual_optimisation(dm_schema: str) -> None:
+    """The CycleGan should also train with a single generator pass per batch."""
+    with initialize(config_path=CFG_PTH):
+        # config is relative to a module
+        hydra_cfg = compose(
+            config_name="base_conf",
+            overrides=SCHEMAS + ["enc=cyc", f"data={dm_schema}", "enc.manual_optimisation=true"],
+        )
+
+        cfg: Config = instantiate(hydra_cfg, _recursive_=True, _convert_="partial")
+        assert not cfg.enc.automatic_optimization
+        run_paf(cfg, raw_config=OmegaConf.to_container(hydra_cfg, resolve=True, enum_to_str=True))
+
+
 @pytest.mark.parametrize(
     "model", ["agarwal", "dp_oracle", "kamiran", "kamishima", "lrcv", "oracle", "zafar"]
 )